@@ -0,0 +1,191 @@
+import atexit
+import os
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.base import DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from compact import CompactStorage
+from dedup import Deduplicator
+from digest import DIGEST_INTERVAL, Digest
+from health import OUTBOXES
+from journal import Journal
+from metrics import BOT_NAMES, MetricsMiddleware, RequestMetrics
+from outbox import Outbox
+from profiling import ProfilingMiddleware, create_router
+from recorder import RECORD_UPDATES, Recorder, RecordingMiddleware
+from routing import ROUTING_RULES, Routing, load_table
+from routing import create_router as create_routing_router
+from sessions import SESSION_MAX, SESSION_TTL, SessionStorage
+from storage import SQLiteStorage
+from throttling import OUTGOING_RATE, PRIORITY_CHATS, THROTTLE_RATE, OutgoingBudget, ThrottlingMiddleware
+from userprofile import USER_PROFILES, UserProfiles
+
+# Каталог для файлов состояния (FSM и прочие данные ботов)
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+# Хранилище FSM: sqlite (по умолчанию), memory, compact (в памяти, см. compact.py)
+# или адрес Redis (redis://...).
+# Процессы-обработчики (WORKERS > 1) делят sqlite- или redis-хранилище
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+# Адрес Bot API, если это не api.telegram.org (локальный сервер, тестовый стенд)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+# Номер процесса-обработчика (задается sharding.py). У каждого обработчика
+# свои outbox и сегменты журнала, чтобы процессы не писали в один файл
+WORKER_ID = os.getenv('WORKER_ID', '')
+FILE_SUFFIX = f'.w{WORKER_ID}' if WORKER_ID else ''
+# Число процессов-обработчиков (см. sharding.py). При WORKERS > 1 процесс
+# launcher.py (WORKER_ID пуст) только принимает обновления: диспетчеры ботов
+# в нем не запускаются
+WORKERS = int(os.getenv('WORKERS', '1'))
+# Фоновые задачи, которые должны идти в одном экземпляре на все процессы
+# (сводка, запись таблицы цен): единственный процесс или первый обработчик
+SINGLETON_JOBS = WORKER_ID == '1' if WORKERS > 1 else not WORKER_ID
+
+# Общая HTTP-сессия процесса. Когда боты запущены через launcher.py,
+# все они ходят в api.telegram.org через один пул соединений,
+# поэтому TLS-рукопожатия не повторяются для каждого бота.
+_session = None
+# Журнал заявок и индекс повторов общие для всех ботов процесса
+_journal = None
+_deduplicator = None
+# Профили пользователей общие для всех ботов
+_profiles = None
+# Запись обновлений всех ботов процесса в один файл трассы
+_recorder = None
+# Распределение заявок по менеджерам общее для всех ботов
+_routing = None
+# Ведра флуд-контроля общие: лимит действует на пользователя во всех ботах
+_throttling = None
+
+
+def get_session():
+    global _session
+    if _session is None:
+        kwargs = {'api': TelegramAPIServer.from_base(TELEGRAM_API_URL)} if TELEGRAM_API_URL else {}
+        _session = AiohttpSession(limit=int(os.getenv('HTTP_POOL_LIMIT', '100')), **kwargs)
+        # Ожидание бюджета не входит во время вызова API в метриках
+        if OUTGOING_RATE:
+            _session.middleware(OutgoingBudget())
+        _session.middleware(RequestMetrics())
+    return _session
+
+
+def create_bot(token, name):
+    bot = Bot(token=token, session=get_session(), default=DefaultBotProperties(parse_mode="HTML"))
+    BOT_NAMES[bot.id] = name
+    return bot
+
+
+def create_dispatcher(name):
+    global _throttling
+    storage = create_storage(name)
+    dp = Dispatcher(storage=storage)
+    if isinstance(storage, SessionStorage):
+        dp.startup.register(storage.start)
+        dp.shutdown.register(storage.stop)
+    # Трасса пишется до флуд-контроля: в нее попадают и отброшенные обновления
+    if RECORD_UPDATES:
+        dp.update.outer_middleware(RecordingMiddleware(name, get_recorder()))
+    # Флуд-контроль стоит перед остальными: отброшенные обновления не доходят до обработчиков
+    if THROTTLE_RATE:
+        if _throttling is None:
+            _throttling = ThrottlingMiddleware()
+        dp.update.outer_middleware(_throttling)
+    dp.update.outer_middleware(MetricsMiddleware(name))
+    dp.update.outer_middleware(ProfilingMiddleware(name))
+    # /profile из чата администратора обрабатывается раньше анкет
+    dp.include_router(create_router())
+    if get_routing() is not None:
+        # Кнопка "Беру" под заявками, которые отправил этот бот
+        dp.include_router(create_routing_router(get_routing()))
+    return dp
+
+
+def get_journal():
+    global _journal
+    if _journal is None:
+        _journal = Journal(os.path.join(DATA_DIR, 'journal'), prefix=f'leads{FILE_SUFFIX}')
+    return _journal
+
+
+def get_deduplicator():
+    global _deduplicator
+    if _deduplicator is None:
+        _deduplicator = Deduplicator()
+    return _deduplicator
+
+
+def get_profiles():
+    # None, если профили выключены (USER_PROFILES=0)
+    global _profiles
+    if _profiles is None and USER_PROFILES:
+        _profiles = UserProfiles(os.path.join(DATA_DIR, 'users.sqlite3'))
+    return _profiles
+
+
+def get_routing():
+    # None, если правила маршрутизации не заданы (ROUTING_RULES)
+    global _routing
+    if _routing is None and ROUTING_RULES:
+        _routing = Routing(load_table(ROUTING_RULES), os.path.join(DATA_DIR, 'routing.sqlite3'))
+        # Заявки менеджерам, как и администратору, не ждут в очереди исходящих
+        PRIORITY_CHATS.update(_routing.table.chats)
+    return _routing
+
+
+def get_recorder():
+    global _recorder
+    if _recorder is None:
+        path = os.path.join(DATA_DIR, 'traces', f"updates{FILE_SUFFIX}-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+        _recorder = Recorder(path)
+        # Файл закрывается при выходе процесса, после остановки всех ботов
+        atexit.register(_recorder.close)
+    return _recorder
+
+
+def create_storage(name):
+    if FSM_STORAGE == 'memory':
+        storage = MemoryStorage()
+    elif FSM_STORAGE == 'compact':
+        storage = CompactStorage(name)
+    elif FSM_STORAGE.startswith('redis://'):
+        # Необязательная зависимость: pip install redis.
+        # Брошенные анкеты в Redis истекают сами через SESSION_TTL
+        from aiogram.fsm.storage.redis import RedisStorage
+        ttl = int(SESSION_TTL) or None
+        storage = RedisStorage.from_url(FSM_STORAGE, key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+                                        state_ttl=ttl, data_ttl=ttl)
+    else:
+        storage = SQLiteStorage(os.path.join(DATA_DIR, f'fsm_{name}.sqlite3'))
+    if SESSION_TTL or SESSION_MAX:
+        storage = SessionStorage(storage, name)
+    return storage
+
+
+def create_outbox(name, dp):
+    # Очередь уведомлений администратору, обработчик которой живет
+    # столько же, сколько диспетчер бота
+    outbox = Outbox(os.path.join(DATA_DIR, f'outbox_{name}{FILE_SUFFIX}.sqlite3'))
+    dp.startup.register(outbox.start)
+    dp.shutdown.register(outbox.stop)
+    if WORKERS == 1:
+        # Очередь outbox показывается в /health процесса, который ее отправляет
+        OUTBOXES[name] = outbox
+    return outbox
+
+
+def create_digest(name, outbox, admin_chat_id, router):
+    # Сводка заявок вместо уведомления на каждую заявку (DIGEST_INTERVAL > 0).
+    # Журнал общий для всех процессов-обработчиков, поэтому сводку собирает
+    # только один из них
+    if not DIGEST_INTERVAL:
+        return None
+    digest = Digest(name, get_journal(), outbox, admin_chat_id, os.path.join(DATA_DIR, 'digests'))
+    if SINGLETON_JOBS:
+        router.startup.register(digest.start)
+        router.shutdown.register(digest.stop)
+    return digest
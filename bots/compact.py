@@ -0,0 +1,170 @@
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DEFAULT_DESTINY, BaseStorage
+from aiogram.types import ReplyKeyboardMarkup
+
+# Компактное хранилище FSM в памяти (FSM_STORAGE=compact).
+# MemoryStorage держит на каждого пользователя StorageKey, объект записи и
+# словарь ответов, где ключи и тексты кнопок — отдельные копии строк в каждой
+# сессии. Здесь анкета (forms.py) регистрирует схему, и сессия хранится
+# кортежем фиксированных слотов:
+#   (код состояния, словарь прочих ключей или None, ответ поля 1, ответ поля 2, ...)
+# Состояние — номер в таблице состояний хранилища, а ответ из вариантов поля
+# (choices или кнопки его клавиатуры) — номер варианта. Малые int в CPython
+# общие, поэтому такие ответы не занимают памяти в сессии. Ключ сессии
+# личного чата — просто chat_id. get_data() по-прежнему возвращает словарь.
+
+# Схемы анкет: имя анкеты (FormSchema.name, оно же имя бота) ->
+# (группа состояний, FormCodec). Группа состояний не уникальна: SaleForm есть
+# и у BOT_P, и у BOT_PR с разными полями, поэтому хранилище бота берет схему
+# по имени своей анкеты
+_codecs = {}
+# Слот без ответа
+_MISSING = object()
+
+
+def field_choices(form_field):
+    if form_field.choices:
+        return tuple(form_field.choices)
+    keyboard = form_field.keyboard
+    if isinstance(keyboard, ReplyKeyboardMarkup):
+        return tuple(button.text for row in keyboard.keyboard for button in row)
+    return None
+
+
+class FormCodec:
+    def __init__(self, fields):
+        self.names = tuple(form_field.name for form_field in fields)
+        self.index = {name: number for number, name in enumerate(self.names)}
+        self.choices = tuple(field_choices(form_field) for form_field in fields)
+        self.codes = tuple({value: code for code, value in enumerate(choices)} if choices else None
+                           for choices in self.choices)
+
+    def encode(self, data):
+        # -> (словарь ключей вне схемы или None, список слотов)
+        values = [_MISSING] * len(self.names)
+        extra = None
+        for name, value in data.items():
+            number = self.index.get(name)
+            codes = self.codes[number] if number is not None else None
+            if codes is not None:
+                if isinstance(value, str):
+                    value = codes.get(value, value)
+                elif isinstance(value, int):
+                    # int в слоте поля с вариантами читается как номер варианта
+                    number = None
+            if number is None:
+                if extra is None:
+                    extra = {}
+                extra[name] = value
+            else:
+                values[number] = value
+        while values and values[-1] is _MISSING:
+            values.pop()
+        return extra, values
+
+    def decode(self, extra, values):
+        data = {}
+        for name, choices, value in zip(self.names, self.choices, values):
+            if value is _MISSING:
+                continue
+            data[name] = choices[value] if choices is not None and type(value) is int else value
+        if extra:
+            data.update(extra)
+        return data
+
+
+def register_form(name, states_group, fields):
+    _codecs[name] = (states_group, FormCodec(fields))
+
+
+class CompactStorage(BaseStorage):
+    def __init__(self, name):
+        # Имя анкеты бота, которому принадлежит хранилище
+        self.name = name
+        # bot_id -> ключ сессии -> кортеж слотов
+        self._bots = {}
+        # Таблица состояний: код -> (состояние, схема анкеты)
+        self._states = [(None, None)]
+        self._state_codes = {None: 0}
+
+    def __len__(self):
+        return sum(map(len, self._bots.values()))
+
+    def __bool__(self):
+        # Dispatcher подставляет MemoryStorage вместо ложного storage,
+        # а без сессий __len__ вернул бы 0
+        return True
+
+    def _key(self, key):
+        if key.thread_id is None and key.business_connection_id is None and key.destiny == DEFAULT_DESTINY:
+            return key.chat_id if key.chat_id == key.user_id else (key.chat_id, key.user_id)
+        return key
+
+    def _state_code(self, state):
+        code = self._state_codes.get(state)
+        if code is None:
+            code = self._state_codes[state] = len(self._states)
+            self._states.append((state, self._codec(state)))
+        return code
+
+    def _codec(self, state):
+        # Схема регистрируется при создании анкеты, уже после хранилища
+        states_group, codec = _codecs.get(self.name, (None, None))
+        return codec if state is not None and state.partition(':')[0] == states_group else None
+
+    def _load(self, key):
+        # -> (состояние, данные)
+        record = self._bots.get(key.bot_id, {}).get(self._key(key))
+        if record is None:
+            return None, {}
+        state, codec = self._states[record[0]]
+        if codec is None:
+            return state, dict(record[1] or {})
+        return state, codec.decode(record[1], record[2:])
+
+    def _save(self, key, state, data):
+        sessions = self._bots.setdefault(key.bot_id, {})
+        if state is None and not data:
+            sessions.pop(self._key(key), None)
+            return
+        code = self._state_code(state)
+        codec = self._states[code][1]
+        if codec is None:
+            record = (code, dict(data) if data else None)
+        else:
+            extra, values = codec.encode(data)
+            record = (code, extra, *values)
+        sessions[self._key(key)] = record
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        sessions = self._bots.get(key.bot_id)
+        session_key = self._key(key)
+        record = sessions.get(session_key) if sessions else None
+        if record is not None and state is not None:
+            code = self._state_code(state)
+            if self._states[code][1] is self._states[record[0]][1]:
+                # Переход внутри той же анкеты: слоты не перекодируются
+                sessions[session_key] = (code, *record[1:])
+                return
+        self._save(key, state, self._load(key)[1])
+
+    async def get_state(self, key):
+        record = self._bots.get(key.bot_id, {}).get(self._key(key))
+        return None if record is None else self._states[record[0]][0]
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        self._save(key, await self.get_state(key), data)
+
+    async def get_data(self, key):
+        return self._load(key)[1]
+
+    def discard(self, key):
+        # Как и у MemoryStorage, выгрузка из памяти — это удаление сессии
+        self._bots.get(key.bot_id, {}).pop(self._key(key), None)
+
+    async def close(self):
+        pass
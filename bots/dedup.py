@@ -0,0 +1,128 @@
+import hashlib
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+
+# Подавление повторных заявок перед уведомлением администратора.
+# Телефон извлекается из свободного текста поля contact и нормализуется,
+# ключевые поля анкеты приводятся к простому виду, и из них строится
+# отпечаток заявки. Недавние отпечатки хранятся в LRU с TTL (точная проверка
+# и счетчик повторов; повтор продлевает жизнь записи в LRU, но не окно),
+# а все отпечатки окна — в паре чередующихся
+# фильтров Блума, которые занимают единицы мегабайт даже на миллионах заявок.
+
+# Окно, в котором повтор считается дублем, часов; 0 — проверка выключена
+DEDUP_WINDOW_HOURS = float(os.getenv('DEDUP_WINDOW_HOURS', '24'))
+DEDUP_LRU_SIZE = int(os.getenv('DEDUP_LRU_SIZE', '200000'))
+DEDUP_BLOOM_CAPACITY = int(os.getenv('DEDUP_BLOOM_CAPACITY', '2000000'))
+
+PHONE_PATTERN = re.compile(r'\+?\d[\d\s\-()]{8,}\d')
+NON_DIGITS = re.compile(r'\D')
+SPACES = re.compile(r'\s+')
+# Нумерация вариантов на кнопках: "1. Квартира" -> "квартира"
+CHOICE_NUMBER = re.compile(r'^\d+\.\s*')
+
+NEW = 'new'
+DUPLICATE = 'duplicate'
+PROBABLE_DUPLICATE = 'probable'
+
+
+def normalize_phone(text):
+    for match in PHONE_PATTERN.finditer(text or ''):
+        digits = NON_DIGITS.sub('', match.group())
+        if len(digits) == 11 and digits[0] in '78':
+            return '+7' + digits[1:]
+        if len(digits) == 10 and digits[0] == '9':
+            return '+7' + digits
+        if 10 <= len(digits) <= 15:
+            return '+' + digits
+    return None
+
+
+def normalize_text(value):
+    return CHOICE_NUMBER.sub('', SPACES.sub(' ', str(value or '')).strip().casefold())
+
+
+def fingerprint(scope, contact, values):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(scope.encode('utf-8'))
+    digest.update(b'\0' + (normalize_phone(contact) or normalize_text(contact)).encode('utf-8'))
+    for value in values:
+        digest.update(b'\0' + normalize_text(value).encode('utf-8'))
+    return digest.digest()
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Двойное хеширование: отпечаток уже равномерный 128-битный хеш
+        first = int.from_bytes(key[:8], 'little')
+        second = int.from_bytes(key[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class Deduplicator:
+    def __init__(self, window=DEDUP_WINDOW_HOURS * 3600, lru_size=DEDUP_LRU_SIZE,
+                 bloom_capacity=DEDUP_BLOOM_CAPACITY):
+        self.window = window
+        self.lru_size = lru_size
+        self.bloom_capacity = bloom_capacity
+        # отпечаток -> [время первой заявки, число повторов];
+        # порядок — от давно не встречавшихся к недавним
+        self._recent = OrderedDict()
+        # Текущее и предыдущее поколения фильтра: каждое живет одно окно,
+        # поэтому вместе они помнят отпечатки за последние 1-2 окна
+        self._bloom = BloomFilter(bloom_capacity)
+        self._previous_bloom = BloomFilter(1)
+        self._rotated_at = time.time()
+
+    def _expire(self, now):
+        # Записи в LRU упорядочены по последнему обращению, поэтому с начала
+        # снимаются только подряд истекшие, а остальные проверяются в check()
+        recent = self._recent
+        while recent:
+            first_seen = next(iter(recent.values()))[0]
+            if now - first_seen < self.window:
+                break
+            recent.popitem(last=False)
+        if now - self._rotated_at >= self.window:
+            self._previous_bloom, self._bloom = self._bloom, BloomFilter(self.bloom_capacity)
+            self._rotated_at = now
+
+    def check(self, key):
+        # Возвращает (вердикт, номер повтора)
+        if not self.window:
+            return NEW, 0
+        now = time.time()
+        self._expire(now)
+        entry = self._recent.get(key)
+        if entry is not None and now - entry[0] >= self.window:
+            del self._recent[key]
+            entry = None
+        if entry is not None:
+            self._recent.move_to_end(key)
+            entry[1] += 1
+            return DUPLICATE, entry[1]
+        seen = key in self._bloom or key in self._previous_bloom
+        self._recent[key] = [now, 0]
+        if len(self._recent) > self.lru_size:
+            self._recent.popitem(last=False)
+        self._bloom.add(key)
+        # Отпечаток уже вытеснен из LRU, но есть в фильтре: заявку не с чем
+        # объединить, а фильтр может ошибаться, поэтому она отправляется с пометкой
+        return (PROBABLE_DUPLICATE if seen else NEW), 0
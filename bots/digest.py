@@ -0,0 +1,195 @@
+import asyncio
+import html
+import importlib.util
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from journal import EXPORT_HEADER, export_csv, lead_row
+
+# Сводка заявок (DIGEST_INTERVAL > 0). Вместо сообщения на каждую заявку
+# администратор раз в DIGEST_INTERVAL секунд получает по каждому боту один
+# документ: в подписи статистика по типам объектов, в файле CSV (или XLSX,
+# DIGEST_FORMAT=xlsx, если установлен openpyxl) все заявки окна.
+# Заявки читаются из журнала и пишутся в файл построчно, так что большое окно
+# не держится в памяти целиком. Срочные заявки (ответ содержит одно из слов
+# DIGEST_URGENT) по-прежнему уходят сразу и попадают в сводку тоже.
+#
+# Окна выровнены по DIGEST_INTERVAL от начала эпохи, и у сводки есть ключ
+# идемпотентности (бот и конец окна): после перезапуска пропущенное окно
+# досылается, а уже поставленное в очередь не уходит второй раз.
+
+DIGEST_INTERVAL = int(os.getenv('DIGEST_INTERVAL', '0'))
+DIGEST_FORMAT = os.getenv('DIGEST_FORMAT', 'csv')
+DIGEST_URGENT = [word.strip().lower() for word in os.getenv('DIGEST_URGENT', 'срочно').split(',') if word.strip()]
+# Заявки, записанные в последнюю секунду окна, успевают попасть в журнал
+DIGEST_GRACE = 2
+# Поля анкет, по которым считается статистика сводки
+TYPE_FIELDS = ('property_type', 'direction', 'object_type')
+CAPTION_LIMIT = 1024
+# Сколько дней хранить файлы отправленных сводок
+DIGEST_KEEP_DAYS = 7
+
+_urgent = re.compile('|'.join(re.escape(word) for word in DIGEST_URGENT)) if DIGEST_URGENT else None
+
+
+def is_urgent(data):
+    if _urgent is None:
+        return False
+    return any(isinstance(value, str) and _urgent.search(value.lower()) for value in data.values())
+
+
+def window_end(now, interval):
+    return int(now // interval * interval)
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='seconds')
+
+
+class Digest:
+    def __init__(self, name, journal, outbox, admin_chat_id, directory, interval=DIGEST_INTERVAL, fmt=DIGEST_FORMAT):
+        os.makedirs(directory, exist_ok=True)
+        if fmt == 'xlsx' and importlib.util.find_spec('openpyxl') is None:
+            logging.warning("openpyxl не установлен, сводка будет в CSV")
+            fmt = 'csv'
+        self.name = name
+        self.journal = journal
+        self.outbox = outbox
+        self.admin_chat_id = admin_chat_id
+        self.directory = directory
+        self.interval = interval
+        self.fmt = fmt
+        self._state_path = os.path.join(directory, f'{name}.json')
+        self._task = None
+
+    def _load_last(self):
+        try:
+            with open(self._state_path, encoding='utf-8') as f:
+                return json.load(f)['last']
+        except FileNotFoundError:
+            return None
+
+    def _save_last(self, last):
+        tmp = self._state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'last': last}, f)
+        os.replace(tmp, self._state_path)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        last = self._load_last()
+        if last is None:
+            # Первый запуск: заявки до включения сводки не рассылаются
+            last = window_end(time.time(), self.interval)
+            self._save_last(last)
+        while True:
+            end = window_end(time.time() - DIGEST_GRACE, self.interval)
+            if end > last:
+                try:
+                    await self.send(last, end)
+                except Exception:
+                    # Окно не сдвигается: следующая сводка захватит и эти заявки
+                    logging.exception("%s: ошибка сборки сводки", self.name)
+                else:
+                    last = end
+                    self._save_last(last)
+            await asyncio.sleep(end + self.interval + DIGEST_GRACE - time.time())
+
+    async def send(self, start, end):
+        # Файл собирается в потоке, чтобы не задерживать обработку обновлений
+        built = await asyncio.to_thread(self.build, start, end)
+        if built is None:
+            return False
+        path, caption = built
+        self.outbox.enqueue('send_document', self.admin_chat_id, key=f'digest:{self.name}:{end}',
+                            document_path=path, caption=caption)
+        return True
+
+    def build(self, start, end):
+        # Файл и подпись сводки за окно (start, end] или None, если заявок не было
+        path = os.path.join(self.directory, f"{self.name}-{datetime.fromtimestamp(end):%Y%m%d-%H%M%S}.{self.fmt}")
+        self._prune(end - DIGEST_KEEP_DAYS * 86400)
+        counts = Counter()
+        duplicates = 0
+
+        def records():
+            nonlocal duplicates
+            for record in self._window(start, end):
+                if record.get('verdict') == 'duplicate':
+                    duplicates += 1
+                    continue
+                data = record['data']
+                counts[next((data[f] for f in TYPE_FIELDS if data.get(f)), '—')] += 1
+                yield record
+
+        if self.fmt == 'xlsx':
+            total = write_xlsx(records(), path)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8-sig') as output:
+                total = export_csv(records(), output)
+        if not total:
+            os.remove(path)
+            return None
+        return path, self.render(start, end, total, counts, duplicates)
+
+    def _prune(self, older_than):
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(f'{self.name}-') and entry.stat().st_mtime < older_than:
+                os.remove(entry.path)
+
+    def _window(self, start, end):
+        since, until = _iso(start), _iso(end)
+        date_from = datetime.fromtimestamp(start, timezone.utc).date()
+        date_to = datetime.fromtimestamp(end, timezone.utc).date()
+        for record in self.journal.find(bot=self.name, date_from=date_from, date_to=date_to):
+            # ts в журнале — UTC в ISO-формате, строки сравниваются как время
+            if since < record['ts'] <= until:
+                yield record
+
+    def render(self, start, end, total, counts, duplicates):
+        # Типы объектов — ответы пользователей, поэтому подпись собирается
+        # и обрезается как простой текст, а разметка HTML добавляется потом:
+        # обрезка не разорвет тег, а "<" в ответе не сломает разбор
+        title = f"📊 Сводка заявок {self.name}"
+        lines = [
+            f"{datetime.fromtimestamp(start):%d.%m %H:%M} – {datetime.fromtimestamp(end):%d.%m %H:%M}",
+            f"Всего заявок: {total}",
+        ]
+        lines += [f"• {kind}: {count}" for kind, count in counts.most_common()]
+        if duplicates:
+            lines.append(f"Повторных заявок (не включены): {duplicates}")
+        body = "\n".join(lines)
+        # Лимит подписи считается по тексту без разметки
+        limit = CAPTION_LIMIT - len(title) - 1
+        if len(body) > limit:
+            body = body[:limit - 2] + "\n…"
+        return f"<b>{html.escape(title)}</b>\n{html.escape(body)}"
+
+
+def write_xlsx(records, path):
+    # Необязательная зависимость: pip install openpyxl.
+    # В режиме write_only строки не копятся в памяти, а сразу пишутся в файл
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Заявки')
+    sheet.append(EXPORT_HEADER)
+    count = 0
+    for record in records:
+        sheet.append(lead_row(record))
+        count += 1
+    workbook.save(path)
+    return count
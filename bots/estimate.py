@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from common import DATA_DIR, SINGLETON_JOBS, get_journal
+from leadindex import STEM
+from parsing import parse_area, parse_area_mention, parse_money
+
+# Мгновенная ориентировочная оценка в BOT_Ocenka.
+# Таблица цены за м² по региону и типу объекта строится из заявок на продажу
+# (BOT_PR) в журнале: для каждой пары хранятся число заявок, сумма и сумма
+# квадратов логарифма цены за м². Эти суммы складываются, поэтому новые
+# заявки добавляются к таблице без пересчета всей истории. Агрегация пачки
+# заявок — векторная (np.unique + np.bincount).
+# После каждого обновления таблица разворачивается в словарь готовых
+# ответов (регион, тип) -> (нижняя, средняя, верхняя цена за м²), и оценка
+# в обработчике — это несколько обращений к словарю.
+#
+# Пересборка таблицы из выгрузки журнала (python bots/journal.py export --bot BOT_PR):
+#   python bots/estimate.py rebuild leads.csv
+#   python bots/estimate.py estimate --region Москва --type Квартира --area 54
+
+ESTIMATE_REFRESH = int(os.getenv('ESTIMATE_REFRESH', '3600'))
+# Заявки на продажу, из которых берется статистика
+SALE_BOTS = ('BOT_PR',)
+# Меньше заявок в паре (регион, тип) — оценка берется по типу во всех регионах
+MIN_SAMPLES = 5
+# Цена за м² вне этих границ — опечатка в цене или площади
+PRICE_PER_M2 = (1e3, 1e7)
+ANY_REGION = '*'
+
+_WORD = re.compile(r'[а-яa-z]{3,}')
+
+# Типы объектов у кнопок ботов различаются ("Дача" в BOT_PR, "3. Земельный
+# участок" в BOT_Ocenka), поэтому сводятся к общим категориям
+KINDS = (
+    ('квартира', re.compile(r'квартир|апартамент|комнат|студи')),
+    ('участок', re.compile(r'участ|земл|сот')),
+    ('дом', re.compile(r'дом|дач|коттедж|таунхаус')),
+    ('коммерция', re.compile(r'коммер|офис|склад|торгов')),
+)
+
+
+def object_kind(value):
+    value = (value or '').lower()
+    return next((kind for kind, pattern in KINDS if pattern.search(value)), None)
+
+
+def address_stems(value):
+    return [word[:STEM] for word in _WORD.findall((value or '').lower().replace('ё', 'е'))]
+
+
+def region_key(value):
+    # Регион заявки — первое слово адреса: "Москва, Тверская", "Казань, центр"
+    stems = address_stems(value)
+    return stems[0] if stems else None
+
+
+def sale_sample(data, parsed=None):
+    # (регион, тип, цена за м²) заявки на продажу или None
+    kind = object_kind(data.get('property_type') or data.get('object_type'))
+    region = region_key(data.get('location') or data.get('region'))
+    parsed = parsed or {}
+    price = parsed.get('price') or parse_money(data.get('price') or '')
+    area = parsed.get('area')
+    if area is None:
+        area = parse_area(data['area']) if data.get('area') else parse_area_mention(data.get('details') or '')
+    if not (kind and region and price and area) or None in price or None in area:
+        return None
+    per_m2 = (price[0] + price[1]) / (area[0] + area[1])
+    if not PRICE_PER_M2[0] <= per_m2 <= PRICE_PER_M2[1]:
+        return None
+    return region, kind, per_m2
+
+
+class PriceTable:
+    def __init__(self, path, journal=None, write=True, interval=ESTIMATE_REFRESH):
+        self.path = path
+        self.journal = journal
+        self.write = write
+        self.interval = interval
+        self.regions = np.array([], dtype=str)
+        self.kinds = np.array([], dtype=str)
+        self.count = np.array([], dtype=np.int64)
+        self.total = np.array([], dtype=np.float64)
+        self.squares = np.array([], dtype=np.float64)
+        # ts последней учтенной заявки журнала
+        self.last = ''
+        # Сколько записей каждого сегмента журнала уже учтено (Journal.tail).
+        # Пока позиций нет (таблица пересчитана из CSV), новые заявки
+        # отбираются по ts: позже last
+        self.positions = {}
+        self.lookup = {}
+        self._task = None
+        if os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.count)
+
+    def load(self):
+        with np.load(self.path) as table:
+            self.regions, self.kinds = table['regions'], table['kinds']
+            self.count, self.total, self.squares = table['count'], table['total'], table['squares']
+            self.last = str(table['last'])
+            if 'segments' in table.files:
+                self.positions = dict(zip(table['segments'].tolist(), table['positions'].tolist()))
+        self._precompute()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp.npz'
+        np.savez(tmp, regions=self.regions, kinds=self.kinds, count=self.count, total=self.total,
+                 squares=self.squares, last=np.array(self.last),
+                 segments=np.array(list(self.positions), dtype=str),
+                 positions=np.array(list(self.positions.values()), dtype=np.int64))
+        os.replace(tmp, self.path)
+
+    def add(self, samples):
+        # samples — список (регион, тип, цена за м²); суммы по парам
+        # складываются с уже накопленными
+        if not samples:
+            return
+        regions, kinds, per_m2 = zip(*samples)
+        logs = np.log(np.array(per_m2, dtype=np.float64))
+        keys = np.concatenate([
+            np.char.add(np.char.add(self.regions, '|'), self.kinds),
+            np.char.add(np.char.add(np.array(regions, dtype=str), '|'), np.array(kinds, dtype=str)),
+        ])
+        unique, inverse = np.unique(keys, return_inverse=True)
+        old = len(self.count)
+        self.count = np.bincount(inverse, weights=np.concatenate([self.count, np.ones(len(logs))]),
+                                 minlength=len(unique)).astype(np.int64)
+        self.total = np.bincount(inverse, weights=np.concatenate([self.total, logs]), minlength=len(unique))
+        self.squares = np.bincount(inverse, weights=np.concatenate([self.squares, logs ** 2]),
+                                   minlength=len(unique))
+        split = np.char.partition(unique, '|')
+        self.regions, self.kinds = split[:, 0], split[:, 2]
+        logging.info("Таблица цен: +%d заявок, пар регион/тип %d -> %d", len(logs), old, len(unique))
+        self._precompute()
+
+    def _precompute(self):
+        lookup = {}
+        # Тип во всех регионах — запасной вариант для редких регионов
+        kinds, inverse = np.unique(self.kinds, return_inverse=True)
+        groups = [
+            (self.regions, self.kinds, self.count, self.total, self.squares),
+            (np.full(len(kinds), ANY_REGION), kinds,
+             np.bincount(inverse, weights=self.count, minlength=len(kinds)),
+             np.bincount(inverse, weights=self.total, minlength=len(kinds)),
+             np.bincount(inverse, weights=self.squares, minlength=len(kinds))),
+        ]
+        for regions, group_kinds, count, total, squares in groups:
+            enough = count >= MIN_SAMPLES
+            if not enough.any():
+                continue
+            count, total, squares = count[enough], total[enough], squares[enough]
+            mean = total / count
+            spread = np.sqrt(np.maximum(squares / count - mean ** 2, 0))
+            low, mid, high = np.exp(mean - spread), np.exp(mean), np.exp(mean + spread)
+            for row in zip(regions[enough].tolist(), group_kinds[enough].tolist(), low.tolist(), mid.tolist(),
+                           high.tolist(), count.astype(np.int64).tolist()):
+                lookup[row[0], row[1]] = row[2:]
+        self.lookup = lookup
+
+    def estimate(self, region_text, kind_text, area_text):
+        # (нижняя, средняя, верхняя стоимость, число заявок в статистике)
+        # или None, если оценить нельзя
+        kind = object_kind(kind_text)
+        area = parse_area(area_text or '')
+        if kind is None or area is None or None in area:
+            return None
+        area = (area[0] + area[1]) / 2
+        found = None
+        # Первое слово адреса, для которого есть статистика
+        for stem in address_stems(region_text):
+            found = self.lookup.get((stem, kind))
+            if found is not None:
+                break
+        found = found or self.lookup.get((ANY_REGION, kind))
+        if found is None:
+            return None
+        low, mid, high, count = found
+        return low * area, mid * area, high * area, count
+
+    def refresh(self):
+        # Добавляет заявки на продажу, появившиеся в журнале после прошлого обновления.
+        # Процессы без права записи только перечитывают файл таблицы
+        if not self.write:
+            if os.path.exists(self.path):
+                self.load()
+            return 0
+        since = self.last if not self.positions else None
+        positions = dict(self.positions)
+        samples = []
+        last = self.last
+        for record in self.journal.tail(positions, bots=SALE_BOTS):
+            last = max(last, record['ts'])
+            if since is not None and record['ts'] <= since or record.get('verdict') == 'duplicate':
+                continue
+            sample = sale_sample(record['data'], record.get('parsed'))
+            if sample is not None:
+                samples.append(sample)
+        self.add(samples)
+        if positions != self.positions:
+            self.positions, self.last = positions, last
+            self.save()
+        return len(samples)
+
+    async def start(self):
+        if self._task is None and self.interval:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                # Чтение журнала и агрегация идут в потоке, не задерживая обработку обновлений
+                await asyncio.to_thread(self.refresh)
+            except Exception:
+                logging.exception("Ошибка обновления таблицы цен")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def create_price_table(dp):
+    # Таблицу дописывает один процесс, остальные обработчики (WORKERS > 1)
+    # перечитывают ее файл
+    table = PriceTable(os.path.join(DATA_DIR, 'price_table.npz'), get_journal(), write=SINGLETON_JOBS)
+    dp.startup.register(table.start)
+    dp.shutdown.register(table.stop)
+    return table
+
+
+def format_money(value):
+    if value >= 1e6:
+        return f"{value / 1e6:.1f} млн ₽".replace('.', ',')
+    return f"{value / 1e3:.0f} тыс. ₽"
+
+
+def render_estimate(table, data):
+    result = table.estimate(data.get('region'), data.get('object_type'), data.get('area'))
+    if result is None:
+        return None
+    low, mid, high, count = result
+    return (f"📊 Ориентировочная стоимость: {format_money(low)} – {format_money(high)} "
+            f"(в среднем {format_money(mid)}, по {count} заявкам на продажу похожих объектов). "
+            f"Точную оценку подготовит специалист.")
+
+
+def rebuild(table, rows):
+    # Пересчет таблицы с нуля по строкам выгрузки журнала (CSV с колонками
+    # property_type/object_type, location/region, area/details, price)
+    rows = [row for row in rows if row.get('bot', SALE_BOTS[0]) in SALE_BOTS]
+    samples = [sample for sample in map(sale_sample, rows) if sample is not None]
+    table.regions = table.kinds = np.array([], dtype=str)
+    table.count = np.array([], dtype=np.int64)
+    table.total = table.squares = np.array([], dtype=np.float64)
+    table.add(samples)
+    table.last = max((row.get('ts', '') for row in rows), default='')
+    table.positions = {}
+    table.save()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price per m² table for instant estimates")
+    parser.add_argument('--table', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'price_table.npz'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuild_command = commands.add_parser('rebuild', help="rebuild the table from a journal CSV export")
+    rebuild_command.add_argument('csv')
+    estimate_command = commands.add_parser('estimate', help="estimate one object")
+    estimate_command.add_argument('--region', required=True)
+    estimate_command.add_argument('--type', required=True)
+    estimate_command.add_argument('--area', required=True)
+    args = parser.parse_args()
+
+    table = PriceTable(args.table)
+    if args.command == 'rebuild':
+        with open(args.csv, newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.DictReader(f))
+        samples = rebuild(table, rows)
+        print(f"Строк: {len(rows)}, учтено заявок: {len(samples)}, пар регион/тип: {len(table)}", file=sys.stderr)
+        return
+    started = time.perf_counter()
+    result = table.estimate(args.region, args.type, args.area)
+    elapsed = time.perf_counter() - started
+    if result is None:
+        print("Недостаточно данных для оценки")
+    else:
+        low, mid, high, count = result
+        print(f"{format_money(low)} – {format_money(high)}, в среднем {format_money(mid)} ({count} заявок)")
+    print(f"Время оценки: {elapsed * 1e6:.0f} мкс", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+import asyncio
+import html
+import logging
+import os
+from dataclasses import dataclass, field
+
+from aiogram import F, Router, types
+from aiogram.filters import Command, StateFilter
+from aiogram.methods import EditMessageText
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+from common import create_digest, get_deduplicator, get_journal, get_profiles, get_routing
+from compact import field_choices, register_form
+from dedup import DUPLICATE, NEW, PROBABLE_DUPLICATE, fingerprint
+from digest import is_urgent
+from metrics import DUPLICATES, FUNNEL
+from parsing import parse_lead
+from recorder import register_buttons
+from routing import claim_markup
+
+# Движок анкет. Каждый бот описывает свою анкету схемой (FormSchema):
+# поля, вопросы, клавиатуры, проверки и шаблон итоговой заявки.
+# При запуске схема один раз компилируется в таблицу переходов
+# (состояние -> шаг с предыдущим/следующим шагом и обработчиком),
+# и все шаги обслуживаются одним роутером: выбор шага — поиск в словаре,
+# а не list(Form.__all_states__).index(...) на каждое сообщение.
+
+BACK = "🔙 Назад"
+
+# Фото альбома приходят отдельными сообщениями с общим media_group_id.
+# Они собираются, пока между сообщениями проходит меньше ALBUM_DEBOUNCE секунд
+MEDIA_GROUP_LIMIT = 10
+ALBUM_DEBOUNCE = float(os.getenv('ALBUM_DEBOUNCE', '1.0'))
+# Ограничение Telegram на длину подписи к медиа
+CAPTION_LIMIT = 1024
+# Сохраненный ответ длиннее этого не предлагается кнопкой
+SAVED_BUTTON_LIMIT = 100
+SAVED_HINT = "⬇️ Или отправьте сохраненные данные кнопкой ниже."
+
+# Вид анкеты: reply — каждый вопрос отдельным сообщением с обычной клавиатурой;
+# inline — вся анкета в одном сообщении (приветствие, принятые ответы, текущий
+# вопрос), которое правится на каждом шаге, а варианты ответа — inline-кнопки
+FORM_MODE = os.getenv('FORM_MODE', 'reply')
+# Кнопки анкеты: form:<номер шага>:<номер варианта | back | saved>
+FORM_CALLBACK = 'form:'
+# Служебный ключ данных анкеты: id сообщения анкеты в режиме inline
+FORM_MESSAGE = '_form_message'
+# Служебный ключ данных анкеты: номер самого дальнего шага, до которого дошла
+# сессия. Воронка считает шаг один раз, а не при каждом возврате к нему
+FURTHEST_STEP = '_furthest_step'
+# Ответ длиннее этого сокращается в сообщении анкеты
+PROGRESS_VALUE_LIMIT = 100
+STALE_BUTTON = "Этот вопрос уже неактуален"
+
+
+@dataclass
+class Field:
+    name: str
+    # Вопрос, который задается при переходе на этот шаг, и клавиатура к нему
+    prompt: str
+    keyboard: object = None
+    # Допустимые варианты ответа и сообщение при выборе не из списка
+    choices: tuple = None
+    choice_error: str = None
+    # Сообщение, если ответ пустой (None — пустой ответ допустим)
+    required: str = None
+    # Шаг принимает фото или альбом: сохраняется список file_id
+    # (не больше MEDIA_GROUP_LIMIT) или текст missing_photo
+    photo: bool = False
+    missing_photo: str = "Нет фото"
+    # Ответ сохраняется в общем профиле пользователя (userprofile.py),
+    # и в любом боте вопрос предлагает его кнопкой
+    saved: bool = False
+
+
+@dataclass
+class FormSchema:
+    name: str
+    states_group: str
+    fields: list
+    # Приветственные сообщения /start перед первым вопросом
+    welcome: list
+    # Ответы на "🔙 Назад": на первом шаге и на остальных
+    back_first: str
+    back: str
+    # Итоговая заявка администратору: заголовок и строки (подпись, поле)
+    summary_title: str
+    summary: list
+    thanks: str
+    thanks_keyboard: object = None
+    # Поля, которые вместе с телефоном определяют повтор заявки.
+    # Повторы ищутся среди заявок с той же dedup_scope (по умолчанию — имя бота)
+    dedup_fields: tuple = ()
+    dedup_scope: str = None
+    # Функция (данные анкеты) -> текст, который добавляется к ответу
+    # пользователю и к заявке администратору, или None
+    on_finish: object = None
+
+
+@dataclass(slots=True)
+class Step:
+    field: Field
+    state: str
+    number: int = 0
+    choices: frozenset = None
+    prev: 'Step' = None
+    next: 'Step' = None
+    handle: object = None
+    # Режим inline: варианты ответа по номерам кнопок и клавиатура шага
+    buttons: tuple = ()
+    markup: InlineKeyboardMarkup = None
+
+
+@dataclass(slots=True)
+class Album:
+    step: Step
+    message: types.Message
+    state: FSMContext
+    photos: list = field(default_factory=list)
+    timer: asyncio.TimerHandle = None
+
+
+def button_rows(form_field):
+    # Варианты ответа по рядам, как на обычной клавиатуре поля, без "Назад"
+    keyboard = form_field.keyboard
+    if isinstance(keyboard, ReplyKeyboardMarkup):
+        rows = [[button.text for button in row if button.text != BACK] for row in keyboard.keyboard]
+    else:
+        rows = [[choice] for choice in field_choices(form_field) or ()]
+    return [row for row in rows if row]
+
+
+def progress_value(value):
+    if isinstance(value, list):
+        return f"{len(value)} фото"
+    value = str(value)
+    if len(value) > PROGRESS_VALUE_LIMIT:
+        value = value[:PROGRESS_VALUE_LIMIT - 1] + "…"
+    # Ответ пользователя показывается в сообщении с разметкой HTML
+    return html.escape(value)
+
+
+class FormEngine:
+    def __init__(self, schema, outbox, admin_chat_id, mode=FORM_MODE):
+        self.schema = schema
+        self.outbox = outbox
+        self.admin_chat_id = admin_chat_id
+        self.inline = mode == 'inline'
+        self.states = type(schema.states_group, (StatesGroup,), {f.name: State() for f in schema.fields})
+        self.steps = self._compile()
+        # Схема для компактного хранения сессий (FSM_STORAGE=compact)
+        register_form(schema.name, schema.states_group, schema.fields)
+        # Ответы кнопками не обезличиваются в трассах (RECORD_UPDATES)
+        register_buttons([BACK, *(text for f in schema.fields for text in field_choices(f) or ())])
+        self.first = self.steps[self.states.__all_states__[0].state]
+        self.profiles = get_profiles()
+        self.routing = get_routing()
+        self.saved_fields = [f.name for f in schema.fields if f.saved and not f.photo]
+        # Подписи ответов в сообщении анкеты — те же, что в заявке
+        self.labels = {name: label for label, name in schema.summary}
+        # (chat_id, media_group_id) -> собираемый альбом
+        self._albums = {}
+        self._album_tasks = set()
+        self.router = Router(name=schema.name)
+        self.router.message.register(self.start, Command("start"))
+        self.router.message.register(self.go_back, F.text == BACK)
+        self.router.message.register(self.dispatch, StateFilter(*self.steps))
+        if self.inline:
+            self.router.callback_query.register(self.press, F.data.startswith(FORM_CALLBACK))
+        self.digest = create_digest(schema.name, outbox, admin_chat_id, self.router)
+
+    def _compile(self):
+        steps = {}
+        prev = None
+        for number, (form_field, state) in enumerate(zip(self.schema.fields, self.states.__all_states__)):
+            step = Step(
+                field=form_field,
+                state=state.state,
+                number=number,
+                choices=frozenset(form_field.choices) if form_field.choices else None,
+                prev=prev,
+            )
+            if prev is not None:
+                prev.next = step
+            steps[step.state] = step
+            prev = step
+        for step in steps.values():
+            step.handle = self.finish if step.next is None else self.advance
+            if self.inline:
+                self._compile_buttons(step)
+        return steps
+
+    def _compile_buttons(self, step):
+        buttons = []
+        rows = []
+        for row in button_rows(step.field):
+            rows.append([])
+            for text in row:
+                rows[-1].append(InlineKeyboardButton(
+                    text=text, callback_data=f"{FORM_CALLBACK}{step.number}:{len(buttons)}",
+                ))
+                buttons.append(text)
+        if step.prev is not None:
+            rows.append([self.back_button(step)])
+        step.buttons = tuple(buttons)
+        step.markup = InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+    def back_button(self, step):
+        return InlineKeyboardButton(text=BACK, callback_data=f"{FORM_CALLBACK}{step.number}:back")
+
+    async def start(self, message: types.Message, state: FSMContext):
+        if not self.inline:
+            for text in self.schema.welcome:
+                await message.answer(text)
+        await state.set_state(self.first.state)
+        await state.update_data({FURTHEST_STEP: self.first.number})
+        FUNNEL.inc(self.schema.name, self.first.state)
+        if self.inline:
+            # Новый /start — новое сообщение анкеты, старое остается как есть
+            return await self.show(self.first, message, state, {**await state.get_data(), FORM_MESSAGE: None})
+        return await self.ask(self.first, message, state)
+
+    async def go_back(self, message: types.Message, state: FSMContext):
+        step = self.steps.get(await state.get_state())
+        if step is None or step.prev is None:
+            if self.inline:
+                return await self.warn(step, message, state, self.schema.back_first)
+            return message.answer(self.schema.back_first, reply_markup=self.keyboard(self.first, message))
+        await state.set_state(step.prev.state)
+        if self.inline:
+            return await self.show(step.prev, message, state)
+        return message.answer(self.schema.back, reply_markup=self.keyboard(step.prev, message))
+
+    def saved_value(self, step, user_id):
+        # Сохраненный в профиле ответ, который можно предложить кнопкой
+        form_field = step.field
+        if form_field.saved and self.profiles is not None:
+            value = self.profiles.get(user_id).get(form_field.name)
+            if isinstance(value, str) and 0 < len(value) <= SAVED_BUTTON_LIMIT:
+                return value
+        return None
+
+    def keyboard(self, step, message):
+        # Клавиатура шага, а для сохраняемого поля с известным значением —
+        # кнопка с этим значением: ее нажатие и есть ответ на вопрос
+        value = self.saved_value(step, message.from_user.id)
+        if value is not None:
+            return ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True, keyboard=[
+                [KeyboardButton(text=value)],
+                [KeyboardButton(text=BACK)],
+            ])
+        return step.field.keyboard
+
+    def inline_keyboard(self, step, user_id):
+        value = self.saved_value(step, user_id)
+        if value is None:
+            return step.markup
+        rows = [[InlineKeyboardButton(text=value, callback_data=f"{FORM_CALLBACK}{step.number}:saved")]]
+        if step.prev is not None:
+            rows.append([self.back_button(step)])
+        return InlineKeyboardMarkup(inline_keyboard=rows)
+
+    async def ask(self, step, message, state):
+        if self.inline:
+            return await self.show(step, message, state)
+        keyboard = self.keyboard(step, message)
+        prompt = step.field.prompt if keyboard is step.field.keyboard else f"{step.field.prompt}\n\n{SAVED_HINT}"
+        return message.answer(prompt, reply_markup=keyboard)
+
+    async def warn(self, step, message, state, text, keyboard=None):
+        # Ответ не принят: в режиме inline предупреждение — строка в сообщении
+        # анкеты над вопросом, а не новое сообщение
+        if self.inline and step is not None:
+            return await self.show(step, message, state, note=text)
+        return message.answer(text, reply_markup=keyboard)
+
+    async def show(self, step, message, state, data=None, note=None):
+        # Режим inline: сообщение анкеты правится под шаг step (None — анкета
+        # заполнена). Правка возвращается обработчиком, как message.answer
+        # в режиме reply: при вебхуке она уходит в HTTP-ответе Telegram без
+        # отдельного запроса. Ошибку правки (сообщение удалено) обработчик
+        # уже не увидит: новое сообщение анкеты начнет /start.
+        # Сообщения еще нет — анкета отправляется новым сообщением
+        if data is None:
+            data = await state.get_data()
+        markup = self.inline_keyboard(step, message.from_user.id) if step is not None else None
+        text = self.render_form(step, data, note, saved=step is not None and markup is not step.markup)
+        message_id = data.get(FORM_MESSAGE)
+        if message_id is not None:
+            return EditMessageText(text=text, chat_id=message.chat.id, message_id=message_id,
+                                   reply_markup=markup).as_(message.bot)
+        sent = await message.answer(text, reply_markup=markup)
+        if step is not None:
+            await state.update_data({FORM_MESSAGE: sent.message_id})
+        return None
+
+    def render_form(self, step, data, note=None, saved=False):
+        parts = list(self.schema.welcome)
+        answers = []
+        for form_field in self.schema.fields:
+            if step is not None and form_field is step.field:
+                break
+            value = data.get(form_field.name)
+            if value is not None:
+                answers.append(f"✅ {self.labels.get(form_field.name, form_field.name)}: {progress_value(value)}")
+        if answers:
+            parts.append("\n".join(answers))
+        if note:
+            parts.append(note)
+        if step is not None:
+            parts.append(f"{step.field.prompt}\n\n{SAVED_HINT}" if saved else step.field.prompt)
+        return "\n\n".join(parts)
+
+    async def press(self, callback: types.CallbackQuery, state: FSMContext):
+        # Кнопка сообщения анкеты (режим inline). Нажатие обрабатывается как
+        # ответ сообщением: от пользователя, в чате анкеты
+        number, _, choice = callback.data[len(FORM_CALLBACK):].partition(':')
+        step = self.steps.get(await state.get_state())
+        if step is None or callback.message is None or number != str(step.number):
+            return callback.answer(STALE_BUTTON)
+        message = callback.message.model_copy(update={'from_user': callback.from_user})
+        if choice == 'back':
+            return self.answer_press(callback, await self.go_back(message, state))
+        if choice == 'saved':
+            value = self.saved_value(step, callback.from_user.id)
+        else:
+            value = step.buttons[int(choice)] if choice.isdigit() and int(choice) < len(step.buttons) else None
+        if value is None:
+            return callback.answer(STALE_BUTTON)
+        await state.update_data({step.field.name: value})
+        return self.answer_press(callback, await step.handle(step, message, state))
+
+    @staticmethod
+    def answer_press(callback, edit):
+        # Правка сообщения анкеты заменяет его клавиатуру вместе с нажатой
+        # кнопкой, и отдельный answerCallbackQuery не нужен: нажатие стоит
+        # одного вызова API, как ответ сообщением в режиме reply.
+        # Если анкета ушла новым сообщением, нажатие подтверждается явно
+        if isinstance(edit, EditMessageText):
+            return edit
+        return callback.answer()
+
+    async def dispatch(self, message: types.Message, state: FSMContext):
+        step = self.steps[await state.get_state()]
+        form_field = step.field
+        if form_field.photo:
+            if message.photo and message.media_group_id:
+                return self.collect_album(step, message, state)
+            if message.photo:
+                value = [message.photo[-1].file_id]
+            elif message.text is not None:
+                value = form_field.missing_photo
+            else:
+                return None
+        elif message.text is None:
+            # Опоздавшие фото альбома не считаются ответом на текстовый вопрос
+            if message.media_group_id:
+                return None
+            return await self.ask(step, message, state)
+        else:
+            value = message.text
+        if step.choices is not None and value not in step.choices:
+            return await self.warn(step, message, state, form_field.choice_error,
+                                   None if self.inline else self.keyboard(step, message))
+        if form_field.required and not (value or '').strip():
+            return await self.warn(step, message, state, form_field.required)
+        await state.update_data({form_field.name: value})
+        return await step.handle(step, message, state)
+
+    def collect_album(self, step, message, state):
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = Album(step, message, state)
+        if len(album.photos) < MEDIA_GROUP_LIMIT:
+            album.photos.append(message.photo[-1].file_id)
+        if album.timer is not None:
+            album.timer.cancel()
+        album.timer = asyncio.get_running_loop().call_later(ALBUM_DEBOUNCE, self._close_album, key)
+        return None
+
+    def _close_album(self, key):
+        task = asyncio.create_task(self._finish_album(self._albums.pop(key)))
+        self._album_tasks.add(task)
+        task.add_done_callback(self._album_tasks.discard)
+
+    async def _finish_album(self, album):
+        # Ответ на альбом отправляется отдельно: к этому моменту обработчики
+        # его сообщений уже завершились
+        step, state = album.step, album.state
+        try:
+            # Пока альбом собирался, пользователь мог вернуться назад
+            if await state.get_state() != step.state:
+                return
+            await state.update_data({step.field.name: album.photos})
+            reply = await step.handle(step, album.message, state)
+            if reply is not None:
+                await reply
+        except Exception:
+            logging.exception("Не удалось обработать альбом в %s", self.schema.name)
+
+    async def advance(self, step, message, state):
+        await state.set_state(step.next.state)
+        # Шаг, пройденный повторно после "Назад", в воронке уже учтен
+        if step.next.number > (await state.get_data()).get(FURTHEST_STEP, -1):
+            await state.update_data({FURTHEST_STEP: step.next.number})
+            FUNNEL.inc(self.schema.name, step.next.state)
+        return await self.ask(step.next, message, state)
+
+    async def finish(self, step, message, state):
+        data = await state.get_data()
+        # Служебные ключи анкеты не попадают в журнал
+        form_message = data.pop(FORM_MESSAGE, None)
+        data.pop(FURTHEST_STEP, None)
+        schema = self.schema
+        key = fingerprint(schema.dedup_scope or schema.name, data.get('contact'),
+                          [data.get(name) for name in schema.dedup_fields])
+        verdict, repeat = get_deduplicator().check(key)
+        extra = schema.on_finish(data) if schema.on_finish else None
+        # Ключ — исходное сообщение: повторная обработка того же обновления
+        # после перезапуска не запишет заявку в журнал и не отправит ее второй раз
+        lead_key = f"lead:{message.chat.id}:{message.message_id}"
+        # Цена, площадь и срок сохраняются в журнал еще и числами для поиска
+        get_journal().append(schema.name, message.from_user.id, data, key=lead_key, parsed=parse_lead(data),
+                             fingerprint=key.hex(), verdict=verdict, repeat=repeat)
+        if verdict != NEW:
+            DUPLICATES.inc(schema.name, verdict)
+        if self.profiles is not None and self.saved_fields:
+            # Контакт из этой заявки другие боты предложат кнопкой
+            self.profiles.update(message.from_user.id, **{
+                name: data[name] for name in self.saved_fields if isinstance(data.get(name), str)
+            })
+        # Дубль объединяется с исходной заявкой в журнале по отпечатку,
+        # администратор получает уведомление только о первой.
+        # В режиме сводки сразу уходят только срочные заявки, остальные
+        # администратор получит в сводке из журнала
+        if verdict != DUPLICATE and (self.digest is None or is_urgent(data)):
+            summary = self.render_summary(data)
+            if extra:
+                summary += "\n\n" + extra
+            if verdict == PROBABLE_DUPLICATE:
+                summary += "\n⚠️ Возможно, повторная заявка"
+            chat_id, markup = self.admin_chat_id, None
+            if self.routing is not None:
+                # Заявка уходит менеджеру по правилам маршрутизации, с кнопкой "Беру"
+                lead_id, chat_id = self.routing.assign(schema.name, data, lead_key, self.admin_chat_id)
+                if lead_id is not None:
+                    summary += f"\n🆔 Заявка №{lead_id}"
+                    markup = claim_markup(lead_id)
+            self.notify_admin(summary, self.collect_photos(data), lead_key, chat_id, markup)
+        await state.clear()
+        FUNNEL.inc(self.schema.name, 'done')
+        thanks = self.schema.thanks if not extra else f"{self.schema.thanks}\n\n{extra}"
+        if self.inline:
+            # Сообщение анкеты становится итогом: все ответы и благодарность
+            return await self.show(None, message, state, {**data, FORM_MESSAGE: form_message}, note=thanks)
+        return message.answer(thanks, reply_markup=self.schema.thanks_keyboard)
+
+    def notify_admin(self, summary, photos, key=None, chat_id=None, reply_markup=None):
+        chat_id = chat_id or self.admin_chat_id
+        extra = {'reply_markup': reply_markup} if reply_markup else {}
+        if not photos:
+            self.outbox.enqueue('send_message', chat_id, key=key, text=summary, **extra)
+            return
+        # Фото заявки и сама заявка уходят одним альбомом с подписью,
+        # если подпись укладывается в лимит Telegram. У альбома не бывает
+        # кнопок, поэтому заявка с кнопкой идет отдельным сообщением
+        caption = summary if len(summary) <= CAPTION_LIMIT and not reply_markup else None
+        media = [{'type': 'photo', 'media': file_id} for file_id in photos]
+        if caption is not None:
+            media[0]['caption'] = caption
+        self.outbox.enqueue('send_media_group', chat_id, key=key, media=media)
+        if caption is None:
+            self.outbox.enqueue('send_message', chat_id, key=key and key + ':summary', text=summary, **extra)
+
+    def collect_photos(self, data):
+        photos = []
+        for form_field in self.schema.fields:
+            value = data.get(form_field.name)
+            if form_field.photo and isinstance(value, list):
+                photos.extend(value)
+        return photos[:MEDIA_GROUP_LIMIT]
+
+    def render_summary(self, data):
+        lines = [self.schema.summary_title]
+        for label, name in self.schema.summary:
+            value = data.get(name)
+            if isinstance(value, list):
+                value = f"{len(value)} шт. (во вложении)"
+            lines.append(f"{label}: {value}")
+        return "\n".join(lines)
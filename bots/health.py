@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from functools import partial
+
+from aiohttp import web
+
+from polling import DRAIN_TIMEOUT, POLL_TIMEOUT
+
+# Проверка живости процесса ботов и сторож.
+# GET /health на HEALTH_PORT отвечает JSON со временем с последнего успешного
+# getUpdates каждого бота, задержкой цикла событий и очередью outbox каждого
+# бота: 200, если все в порядке, иначе 503 со списком проблем.
+# Сторож раз в секунду замеряет задержку цикла событий и проверяет polling:
+# - нет успешного getUpdates дольше POLL_STALL_TIMEOUT — зависший запрос
+#   прерывается и повторяется (Poller.restart);
+# - после WATCHDOG_RESTARTS таких перезапусков подряд процесс штатно
+#   останавливается (как по SIGTERM) и завершается с кодом WATCHDOG_EXIT_CODE,
+#   а restart: always в docker-compose запускает его заново.
+# С процессами-обработчиками (WORKERS > 1) сторож также следит за пулом:
+# упавший обработчик пул перезапускает сам, а если один обработчик
+# перезапускается WORKER_RESTARTS раз за минуту, процесс останавливается так же.
+# Если цикл событий заблокирован, ни сторож, ни /health не работают, поэтому
+# отдельный поток завершает процесс, когда цикл не отвечает дольше
+# LOOP_STALL_TIMEOUT секунд.
+
+HEALTH_HOST = os.getenv('HEALTH_HOST', '0.0.0.0')
+# Порт HTTP-эндпоинта /health; 0 — эндпоинт не запускается (сторож работает всегда)
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '0'))
+POLL_STALL_TIMEOUT = float(os.getenv('POLL_STALL_TIMEOUT', str(POLL_TIMEOUT + 60)))
+WATCHDOG_RESTARTS = int(os.getenv('WATCHDOG_RESTARTS', '3'))
+# Задержка цикла событий, при которой /health отвечает 503, секунд
+LOOP_LAG_LIMIT = float(os.getenv('LOOP_LAG_LIMIT', '5'))
+# 0 — поток-сторож цикла событий не запускается
+LOOP_STALL_TIMEOUT = float(os.getenv('LOOP_STALL_TIMEOUT', '60'))
+WATCHDOG_EXIT_CODE = 3
+CHECK_INTERVAL = 1.0
+
+# Имя бота -> Outbox (регистрирует common.create_outbox)
+OUTBOXES = {}
+
+
+class Watchdog:
+    def __init__(self, pollers=(), on_failure=None, stall_timeout=POLL_STALL_TIMEOUT, max_restarts=WATCHDOG_RESTARTS,
+                 lag_limit=LOOP_LAG_LIMIT, loop_stall_timeout=LOOP_STALL_TIMEOUT, pool=None):
+        self.pollers = list(pollers)
+        # sharding.WorkerPool или None
+        self.pool = pool
+        # Вызывается, когда перезапуски polling не помогли
+        self.on_failure = on_failure
+        self.stall_timeout = stall_timeout
+        self.max_restarts = max_restarts
+        self.lag_limit = lag_limit
+        self.loop_stall_timeout = loop_stall_timeout
+        self.lag = 0.0
+        self.exit_code = 0
+        # Имя бота -> (перезапусков подряд, время последнего перезапуска)
+        self._restarts = {}
+        self._heartbeat = time.monotonic()
+        self._failed_at = None
+        self._task = None
+        self._stopped = threading.Event()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        if self.loop_stall_timeout:
+            threading.Thread(target=self._guard, name='loop-watchdog', daemon=True).start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(CHECK_INTERVAL)
+            self.lag = max(0.0, loop.time() - started - CHECK_INTERVAL)
+            self._heartbeat = time.monotonic()
+            try:
+                self._check_pollers()
+            except Exception:
+                logging.exception("Ошибка проверки polling")
+            if self.pool is not None:
+                reason = self.pool.failure()
+                if reason:
+                    self._fail(reason)
+
+    def _check_pollers(self):
+        now = time.monotonic()
+        for poller in self.pollers:
+            restarts, restarted_at = self._restarts.get(poller.name, (0, 0.0))
+            if poller.last_poll > restarted_at:
+                # getUpdates снова проходит: счетчик перезапусков сбрасывается
+                restarts = 0
+            if now - max(poller.last_poll, restarted_at) < self.stall_timeout:
+                self._restarts[poller.name] = (restarts, restarted_at)
+                continue
+            if restarts >= self.max_restarts:
+                self._fail(f"{poller.name}: getUpdates не проходит после {restarts} перезапусков")
+                return
+            logging.warning("%s: нет успешного getUpdates %.0f с, перезапуск polling",
+                            poller.name, now - poller.last_poll)
+            poller.restart()
+            self._restarts[poller.name] = (restarts + 1, now)
+
+    def _fail(self, reason):
+        if self._failed_at is not None:
+            return
+        logging.critical("Сторож: %s, процесс будет перезапущен", reason)
+        self._failed_at = time.monotonic()
+        self.exit_code = WATCHDOG_EXIT_CODE
+        if self.on_failure is not None:
+            self.on_failure()
+
+    def _guard(self):
+        # Поток: цикл событий не обновлял отметку дольше LOOP_STALL_TIMEOUT,
+        # или штатная остановка после сбоя затянулась
+        while not self._stopped.wait(CHECK_INTERVAL):
+            now = time.monotonic()
+            if now - self._heartbeat > self.loop_stall_timeout:
+                logging.critical("Сторож: цикл событий не отвечает %.0f с, выход", now - self._heartbeat)
+                os._exit(WATCHDOG_EXIT_CODE)
+            if self._failed_at is not None and now - self._failed_at > DRAIN_TIMEOUT + self.loop_stall_timeout:
+                logging.critical("Сторож: остановка после сбоя не завершилась, выход")
+                os._exit(WATCHDOG_EXIT_CODE)
+
+    def status(self):
+        now = time.monotonic()
+        problems = []
+        bots = {}
+        for poller in self.pollers:
+            age = now - poller.last_poll
+            bots[poller.name] = {'last_poll_seconds': round(age, 1),
+                                 'poll_restarts': self._restarts.get(poller.name, (0, 0.0))[0]}
+            if age > self.stall_timeout:
+                problems.append(f"{poller.name}: нет успешного getUpdates {age:.0f} с")
+        for name, outbox in OUTBOXES.items():
+            bots.setdefault(name, {})['outbox_backlog'] = outbox.backlog
+        workers = self.pool.status() if self.pool is not None else {}
+        for name, worker in workers.items():
+            if not worker['alive']:
+                problems.append(f"{name} не работает")
+        if self.lag > self.lag_limit:
+            problems.append(f"задержка цикла событий {self.lag:.1f} с")
+        if self._failed_at is not None:
+            problems.append("процесс останавливается сторожем")
+        return {
+            'status': 'fail' if problems else 'ok',
+            'problems': problems,
+            'loop_lag_seconds': round(self.lag, 3),
+            'bots': bots,
+            'workers': workers,
+        }
+
+
+async def start_server(watchdog, host=HEALTH_HOST, port=HEALTH_PORT):
+    async def handle_health(request):
+        status = watchdog.status()
+        return web.json_response(status, status=200 if status['status'] == 'ok' else 503,
+                                 dumps=partial(json.dumps, ensure_ascii=False))
+
+    app = web.Application()
+    app.router.add_get('/health', handle_health)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Проверка живости доступна на %s:%d/health", host, port)
+    return runner
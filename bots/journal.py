@@ -0,0 +1,284 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import struct
+import sys
+import zlib
+from collections import deque
+from datetime import date, datetime, timezone
+
+# Журнал заявок: все завершенные анкеты всех ботов дописываются в сегменты
+# формата JSON lines (leads-000001.jsonl, ...), новый сегмент начинается при
+# превышении segment_size. Рядом с каждым сегментом лежит компактный индекс
+# (.idx) из записей фиксированной длины: день, бот, user_id и смещение строки.
+# Поиск и выгрузка читают только индекс и нужные строки сегментов, не загружая
+# всю историю в память.
+# Каждый процесс-обработчик (см. sharding.py) пишет в свои сегменты
+# (leads.w1-000001.jsonl, ...), поиск читает сегменты всех процессов.
+# Заявка пишется с ключом идемпотентности (тем же, что у уведомления в outbox):
+# обновление, повторно обработанное после перезапуска, не дописывает ее второй
+# раз. Журнал помнит последние RECENT_KEYS ключей; после запуска они читаются
+# из хвоста своих сегментов.
+#
+# Выгрузка в CSV:
+#   python bots/journal.py export --bot BOT_P --from 2026-01-01 -o leads.csv
+# Поиск по типу, адресу и числовым полям (см. leadindex.py):
+#   python bots/journal.py search --type Квартира --region Москва --price "4-6 млн"
+
+# день (дни от 1970-01-01), crc32 имени бота, user_id, смещение в сегменте
+INDEX_RECORD = struct.Struct('<iIqQ')
+SEGMENT_SIZE = 64 * 1024 * 1024
+READ_CHUNK = INDEX_RECORD.size * 4096
+RECENT_KEYS = 10000
+# Сколько байт с конца своих сегментов просматривается за ключами при запуске
+KEY_SCAN_BYTES = 4 * 1024 * 1024
+
+# Порядок колонок CSV: поля анкет всех ботов
+LEAD_FIELDS = [
+    'property_type', 'direction', 'object_type', 'object_info', 'purpose',
+    'location', 'region', 'details', 'area', 'amount', 'price', 'term', 'period',
+    'photos', 'comment', 'contact',
+]
+EXPORT_HEADER = ['ts', 'bot', 'user_id'] + LEAD_FIELDS
+
+
+def bot_code(bot):
+    return zlib.crc32(bot.encode('utf-8'))
+
+
+def day_number(value):
+    return value.toordinal() - date(1970, 1, 1).toordinal()
+
+
+class Journal:
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, prefix='leads'):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.prefix = prefix
+        self._segment = None
+        self._index = None
+        self._offset = 0
+        # Ключи последних заявок (None — еще не прочитаны из сегментов)
+        self._keys = None
+        self._key_order = deque()
+
+    def segments(self, prefix='leads*'):
+        return sorted(glob.glob(os.path.join(self.directory, f'{prefix}-*.jsonl')))
+
+    def _open_segment(self):
+        segments = self.segments(self.prefix)
+        if segments and os.path.getsize(segments[-1]) < self.segment_size:
+            path = segments[-1]
+        else:
+            number = int(os.path.basename(segments[-1])[-12:-6]) + 1 if segments else 1
+            path = os.path.join(self.directory, f'{self.prefix}-{number:06d}.jsonl')
+        self._segment = open(path, 'ab')
+        self._index = open(path[:-len('.jsonl')] + '.idx', 'ab')
+        self._offset = self._segment.tell()
+
+    def _load_keys(self):
+        self._keys = set()
+        tails = []
+        remaining = KEY_SCAN_BYTES
+        for path in reversed(self.segments(self.prefix)):
+            with open(path, 'rb') as segment:
+                size = os.fstat(segment.fileno()).st_size
+                start = max(0, size - remaining)
+                segment.seek(start)
+                lines = segment.read().split(b'\n')
+            if start:
+                # Первая строка прочитана не с начала
+                lines = lines[1:]
+            tails.append(lines)
+            remaining -= size - start
+            if remaining <= 0:
+                break
+        for lines in reversed(tails):
+            for line in lines:
+                try:
+                    key = json.loads(line).get('key')
+                except ValueError:
+                    continue
+                if key is not None:
+                    self._remember(key)
+
+    def _remember(self, key):
+        self._keys.add(key)
+        self._key_order.append(key)
+        if len(self._key_order) > RECENT_KEYS:
+            self._keys.discard(self._key_order.popleft())
+
+    def append(self, bot, user_id, data, key=None, **extra):
+        # None — заявка с этим ключом уже записана
+        if key is not None:
+            if self._keys is None:
+                self._load_keys()
+            if key in self._keys:
+                return None
+            extra['key'] = key
+        if self._segment is None or self._offset >= self.segment_size:
+            self.close()
+            self._open_segment()
+        now = datetime.now(timezone.utc)
+        record = {'ts': now.isoformat(timespec='seconds'), 'bot': bot, 'user_id': user_id, 'data': data, **extra}
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        self._segment.write(line)
+        self._segment.flush()
+        self._index.write(INDEX_RECORD.pack(day_number(now.date()), bot_code(bot), user_id, self._offset))
+        self._index.flush()
+        self._offset += len(line)
+        if key is not None:
+            self._remember(key)
+        return record
+
+    def close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = self._index = None
+
+    def find(self, bot=None, user_id=None, date_from=None, date_to=None):
+        # Итератор по записям, подходящим под фильтр, в порядке добавления
+        code = bot_code(bot) if bot else None
+        day_from = day_number(date_from) if date_from else None
+        day_to = day_number(date_to) if date_to else None
+        for path in self.segments():
+            index_path = path[:-len('.jsonl')] + '.idx'
+            if not os.path.exists(index_path):
+                continue
+            with open(index_path, 'rb') as index, open(path, 'rb') as segment:
+                if not _segment_in_range(index, day_from, day_to):
+                    continue
+                while True:
+                    chunk = index.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    # Недописанная запись в конце индекса пропускается
+                    chunk = chunk[:len(chunk) - len(chunk) % INDEX_RECORD.size]
+                    for day, record_bot, record_user, offset in INDEX_RECORD.iter_unpack(chunk):
+                        if code is not None and record_bot != code:
+                            continue
+                        if user_id is not None and record_user != user_id:
+                            continue
+                        if day_from is not None and day < day_from:
+                            continue
+                        if day_to is not None and day > day_to:
+                            continue
+                        segment.seek(offset)
+                        yield json.loads(segment.readline())
+
+    def tail(self, positions, bots=None):
+        # Записи, добавленные после позиций positions (имя сегмента -> число
+        # прочитанных записей его индекса), в порядке добавления. positions
+        # обновляется на месте: следующий вызов продолжит с того же места.
+        # В отличие от отбора по ts (с точностью до секунды), не пропускает
+        # заявки, записанные в ту же секунду, что и последняя прочитанная
+        codes = {bot_code(bot) for bot in bots} if bots else None
+        for path in self.segments():
+            index_path = path[:-len('.jsonl')] + '.idx'
+            if not os.path.exists(index_path):
+                continue
+            name = os.path.basename(path)
+            done = positions.get(name, 0)
+            with open(index_path, 'rb') as index, open(path, 'rb') as segment:
+                index.seek(done * INDEX_RECORD.size)
+                while True:
+                    chunk = index.read(READ_CHUNK)
+                    # Недописанная запись в конце индекса будет прочитана в следующий раз
+                    chunk = chunk[:len(chunk) - len(chunk) % INDEX_RECORD.size]
+                    if not chunk:
+                        break
+                    index.seek((done + len(chunk) // INDEX_RECORD.size) * INDEX_RECORD.size)
+                    for _, record_bot, _, offset in INDEX_RECORD.iter_unpack(chunk):
+                        done += 1
+                        positions[name] = done
+                        if codes is not None and record_bot not in codes:
+                            continue
+                        segment.seek(offset)
+                        yield json.loads(segment.readline())
+
+
+def _segment_in_range(index, day_from, day_to):
+    # Записи в сегменте идут по времени, поэтому диапазон дней сегмента
+    # определяется первой и последней записью индекса
+    size = os.fstat(index.fileno()).st_size // INDEX_RECORD.size * INDEX_RECORD.size
+    if not size:
+        return False
+    first = INDEX_RECORD.unpack(index.read(INDEX_RECORD.size))[0]
+    index.seek(size - INDEX_RECORD.size)
+    last = INDEX_RECORD.unpack(index.read(INDEX_RECORD.size))[0]
+    index.seek(0)
+    if day_from is not None and last < day_from:
+        return False
+    if day_to is not None and first > day_to:
+        return False
+    return True
+
+
+def _cell(value):
+    # Фото альбома хранятся списком file_id
+    return ' '.join(value) if isinstance(value, list) else value
+
+
+def lead_row(record):
+    data = record['data']
+    return [record['ts'], record['bot'], record['user_id']] + [_cell(data.get(f, '')) for f in LEAD_FIELDS]
+
+
+def export_csv(records, output):
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_HEADER)
+    count = 0
+    for record in records:
+        writer.writerow(lead_row(record))
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lead journal tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="stream matching leads to CSV")
+    search = commands.add_parser('search', help="find leads by type, region and numeric ranges")
+    for command in (export, search):
+        command.add_argument('--dir', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'journal'))
+        command.add_argument('--bot')
+        command.add_argument('--from', dest='date_from', type=date.fromisoformat)
+        command.add_argument('--to', dest='date_to', type=date.fromisoformat)
+        command.add_argument('-o', '--output', default='-')
+    export.add_argument('--user', type=int)
+    search.add_argument('--type', dest='kind', help="button text, e.g. Квартира")
+    search.add_argument('--region', help="words of the address, e.g. 'Москва Тверская'")
+    # Диапазоны задаются так же, как их пишут пользователи: "4-6 млн", "от 50 м2"
+    for name in ('price', 'amount', 'area', 'term'):
+        search.add_argument(f'--{name}')
+    args = parser.parse_args()
+
+    journal = Journal(args.dir)
+    if args.command == 'export':
+        records = journal.find(bot=args.bot, user_id=args.user, date_from=args.date_from, date_to=args.date_to)
+    else:
+        from leadindex import LeadIndex
+        from parsing import parse_area, parse_money, parse_term
+        parsers = {'price': parse_money, 'amount': parse_money, 'area': parse_area, 'term': parse_term}
+        ranges = {}
+        for name, parse in parsers.items():
+            text = getattr(args, name)
+            if text is not None:
+                ranges[name] = parse(text)
+                if ranges[name] is None:
+                    parser.error(f"--{name}: не удалось разобрать {text!r}")
+        index = LeadIndex().build(journal.find(bot=args.bot, date_from=args.date_from, date_to=args.date_to))
+        records = index.query(kind=args.kind, region=args.region, **ranges)
+    if args.output == '-':
+        count = export_csv(records, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8-sig') as output:
+            count = export_csv(records, output)
+    print(f"Выгружено заявок: {count}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import logging
+import asyncio
+import importlib
+import os
+import signal
+import sys
+from contextlib import suppress
+
+import health
+import metrics
+import profiling
+from common import DATA_DIR, get_session
+from polling import DRAIN_TIMEOUT, Poller
+from sharding import WORKERS, WorkerPool
+from webhook import run_webhook
+
+# Все боты репозитория (имя модуля в каталоге bots/)
+ALL_BOTS = ['BOT_P', 'BOT_PR', 'BOT_Inv', 'BOT_Str', 'BOT_Ocenka']
+
+# Способ получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+logging.basicConfig(level=logging.INFO)
+
+
+def resolve_bots(args):
+    # Список ботов берется из аргументов командной строки или из переменной BOTS,
+    # например: BOTS=BOT_P,BOT_Inv. По умолчанию запускаются все боты.
+    names = args or [n.strip() for n in os.getenv('BOTS', '').split(',') if n.strip()]
+    if not names:
+        return list(ALL_BOTS)
+    unknown = [n for n in names if n not in ALL_BOTS]
+    if unknown:
+        sys.exit(f"❌ Неизвестные боты: {', '.join(unknown)}. Доступны: {', '.join(ALL_BOTS)}")
+    return names
+
+
+async def main(names):
+    modules = [importlib.import_module(name) for name in names]
+    logging.info("Запуск ботов в одном процессе (%s): %s", BOT_MODE, ", ".join(names))
+    metrics_runner = await metrics.start_server() if metrics.METRICS_PORT else None
+    # WORKERS > 1: этот процесс только принимает обновления,
+    # обработчики работают в отдельных процессах
+    pool = WorkerPool(names) if WORKERS > 1 else None
+
+    def toggle_profiling():
+        # SIGUSR1 переключает профилирование здесь и в процессах-обработчиках
+        profiling.toggle()
+        if pool is not None:
+            pool.send_signal(signal.SIGUSR1)
+
+    profiling.install(toggle_profiling)
+    # Если перезапуски polling или обработчиков не помогли, сторож останавливает
+    # процесс так же, как SIGTERM, и main возвращает ненулевой код выхода
+    watchdog = health.Watchdog(on_failure=lambda: os.kill(os.getpid(), signal.SIGTERM), pool=pool)
+    await watchdog.start()
+    health_runner = await health.start_server(watchdog) if health.HEALTH_PORT else None
+    try:
+        if pool is not None:
+            await pool.start()
+        if BOT_MODE == 'webhook':
+            await serve_webhook(list(zip(names, modules)), pool)
+        else:
+            await serve_polling(list(zip(names, modules)), pool, watchdog)
+    finally:
+        if pool is not None:
+            await pool.stop(DRAIN_TIMEOUT)
+        profiling.stop()
+        if health_runner is not None:
+            await health_runner.cleanup()
+        await watchdog.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await get_session().close()
+    return watchdog.exit_code
+
+
+def on_stop_signal(callback):
+    loop = asyncio.get_running_loop()
+    with suppress(NotImplementedError):
+        # На Windows обработчики сигналов недоступны
+        loop.add_signal_handler(signal.SIGTERM, callback)
+        loop.add_signal_handler(signal.SIGINT, callback)
+
+
+async def serve_polling(bots, pool=None, watchdog=None):
+    pollers = [
+        Poller(name, module.bot, module.dp, os.path.join(DATA_DIR, f'updates_{name}.sqlite3'), pool)
+        for name, module in bots
+    ]
+    if watchdog is not None:
+        watchdog.pollers.extend(pollers)
+
+    def stop():
+        logging.info("Остановка: новые обновления не запрашиваются")
+        for poller in pollers:
+            poller.stop()
+
+    on_stop_signal(stop)
+    # Если раньше бот работал через вебхук, getUpdates вернет ошибку,
+    # пока вебхук не снят: так polling остается запасным вариантом
+    for name, module in bots:
+        await module.bot.delete_webhook()
+    await asyncio.gather(*(poller.run() for poller in pollers))
+
+
+async def serve_webhook(bots, pool=None):
+    stopped = asyncio.Event()
+    on_stop_signal(stopped.set)
+    runner = await run_webhook(bots, pool)
+    try:
+        await stopped.wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(resolve_bots(sys.argv[1:]))))
@@ -0,0 +1,118 @@
+import bisect
+import math
+import re
+from array import array
+from collections import defaultdict
+
+from parsing import LEAD_NUMBERS, parse_lead
+
+# Вторичный индекс заявок для выборок вида "квартиры в районе X за 4–6 млн".
+# Строится в памяти по журналу: списки номеров записей по боту, типу объекта
+# и словам адреса, а для числовых полей (parsing.LEAD_NUMBERS) — колонки
+# границ диапазонов и отсортированный по нижней границе список.
+# Запрос пересекает списки, начиная с самого короткого, и проверяет диапазоны
+# только у оставшихся записей; без текстовых условий кандидаты берутся из
+# отсортированного списка бинарным поиском.
+
+TYPE_FIELDS = ('property_type', 'direction', 'object_type')
+REGION_FIELDS = ('location', 'region')
+# Слова адреса сравниваются по первым буквам, чтобы "Москва" находила "в Москве"
+STEM = 5
+
+_WORD = re.compile(r'[а-яa-z]{3,}')
+# Номер варианта и эмодзи на кнопках: "1. Квартира", "🏠 Жилая недвижимость"
+_CHOICE_PREFIX = re.compile(r'^[^а-яa-z]+')
+
+
+def normalize_type(value):
+    return _CHOICE_PREFIX.sub('', value.lower().replace('ё', 'е')).strip()
+
+
+def region_stems(value):
+    return {word[:STEM] for word in _WORD.findall(value.lower().replace('ё', 'е'))}
+
+
+class LeadIndex:
+    def __init__(self):
+        self.records = []
+        self._bots = defaultdict(lambda: array('I'))
+        self._types = defaultdict(lambda: array('I'))
+        self._words = defaultdict(lambda: array('I'))
+        # Границы диапазонов; у записи без значения — nan, открытая граница — ±inf
+        self._low = {name: array('d') for name in LEAD_NUMBERS}
+        self._high = {name: array('d') for name in LEAD_NUMBERS}
+        # Отсортированные (нижняя граница, номер) по полям; строятся при первом запросе
+        self._sorted = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record):
+        number = len(self.records)
+        self.records.append(record)
+        data = record['data']
+        self._bots[record['bot']].append(number)
+        kind = next((data[f] for f in TYPE_FIELDS if isinstance(data.get(f), str)), None)
+        if kind:
+            self._types[normalize_type(kind)].append(number)
+        for field in REGION_FIELDS:
+            if isinstance(data.get(field), str):
+                for stem in region_stems(data[field]):
+                    self._words[stem].append(number)
+        # Журнал до появления разбора содержит только текст ответов
+        parsed = record.get('parsed')
+        if parsed is None:
+            parsed = parse_lead(data)
+        for name in LEAD_NUMBERS:
+            low, high = parsed.get(name) or (math.nan, math.nan)
+            self._low[name].append(-math.inf if low is None else low)
+            self._high[name].append(math.inf if high is None else high)
+        self._sorted.clear()
+
+    def build(self, records):
+        for record in records:
+            self.add(record)
+        return self
+
+    def _ordered(self, name):
+        ordered = self._sorted.get(name)
+        if ordered is None:
+            lows = self._low[name]
+            numbers = sorted((i for i in range(len(lows)) if not math.isnan(lows[i])), key=lows.__getitem__)
+            ordered = self._sorted[name] = ([lows[i] for i in numbers], numbers)
+        return ordered
+
+    def query(self, bot=None, kind=None, region=None, **ranges):
+        # ranges: имя поля -> (от, до), None — граница открыта.
+        # Подходят заявки, чей диапазон пересекается с запрошенным
+        postings = []
+        if bot is not None:
+            postings.append(self._bots.get(bot, ()))
+        if kind is not None:
+            postings.append(self._types.get(normalize_type(kind), ()))
+        if region is not None:
+            postings += [self._words.get(stem, ()) for stem in region_stems(region)]
+        ranges = {name: (-math.inf if low is None else low, math.inf if high is None else high)
+                  for name, (low, high) in ranges.items()}
+
+        if postings:
+            postings.sort(key=len)
+            candidates = postings[0]
+            for other in postings[1:]:
+                other = set(other)
+                candidates = [number for number in candidates if number in other]
+        elif ranges:
+            # Без текстовых условий: все записи с нижней границей не выше запрошенной верхней
+            name, (low, high) = next(iter(ranges.items()))
+            lows, numbers = self._ordered(name)
+            candidates = sorted(numbers[:bisect.bisect_right(lows, high)])
+        else:
+            candidates = range(len(self.records))
+
+        for number in candidates:
+            for name, (low, high) in ranges.items():
+                # Сравнение с nan всегда ложно: записи без значения не проходят
+                if not (self._low[name][number] <= high and self._high[name][number] >= low):
+                    break
+            else:
+                yield self.records[number]
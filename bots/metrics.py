@@ -0,0 +1,195 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+# Метрики ботов в формате Prometheus.
+# Все боты процесса работают в одном цикле событий, поэтому счетчики — обычные
+# числа без блокировок, а корзины гистограмм выделяются один раз на набор меток.
+# Запись метрики — поиск в словаре, bisect и два сложения.
+
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+# Порт HTTP-эндпоинта /metrics; 0 — эндпоинт не запускается
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # Последняя корзина — все, что больше верхней границы (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    def __init__(self, name, kind, help_text, labels, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def inc(self, *labels, value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def set(self, *labels, value):
+        self.values[labels] = value
+
+    def observe(self, *labels, value):
+        histogram = self.values.get(labels)
+        if histogram is None:
+            histogram = self.values[labels] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def snapshot(self):
+        # Копия значений для передачи в другой процесс: гистограмма —
+        # кортеж (корзины, сумма)
+        if self.kind != 'histogram':
+            return dict(self.values)
+        return {labels: (tuple(value.counts), value.sum) for labels, value in self.values.items()}
+
+    def render(self, workers=()):
+        # workers — пары (номер процесса-обработчика, snapshot() его метрики);
+        # их значения выводятся с дополнительной меткой worker
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        self._render_values(lines, self.values, ())
+        for worker_id, values in workers:
+            self._render_values(lines, values, (f'worker="{worker_id}"',))
+        return lines
+
+    def _render_values(self, lines, values, extra):
+        for labels, value in values.items():
+            label_text = ','.join([*(f'{name}="{_escape(v)}"' for name, v in zip(self.labels, labels)), *extra])
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{{{label_text}}} {value}")
+                continue
+            counts, total = (value.counts, value.sum) if isinstance(value, Histogram) else value
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = []
+
+
+def metric(name, kind, help_text, labels=(), buckets=None):
+    item = Metric(name, kind, help_text, labels, buckets)
+    REGISTRY.append(item)
+    return item
+
+
+HANDLER_LATENCY = metric('bot_handler_seconds', 'histogram', "Update handling time",
+                         ('bot', 'state'), LATENCY_BUCKETS)
+API_LATENCY = metric('bot_api_request_seconds', 'histogram', "Bot API call time",
+                     ('bot', 'method'), LATENCY_BUCKETS)
+API_ERRORS = metric('bot_api_errors_total', 'counter', "Failed Bot API calls", ('bot', 'method', 'error'))
+API_THROTTLED = metric('bot_api_throttled_total', 'counter', "Bot API calls answered with 429", ('bot', 'method'))
+THROTTLED = metric('bot_throttled_updates_total', 'counter', "Incoming updates dropped by flood control", ('bot',))
+OUTGOING_WAITS = metric('bot_api_budget_waits_total', 'counter', "Bot API calls delayed by the outgoing budget", ('bot',))
+SESSIONS = metric('bot_fsm_sessions', 'gauge', "Unfinished form sessions held in memory", ('bot',))
+SESSIONS_EXPIRED = metric('bot_fsm_sessions_expired_total', 'counter', "Idle form sessions evicted", ('bot', 'reason'))
+DUPLICATES = metric('bot_duplicate_leads_total', 'counter', "Leads recognised as repeats", ('bot', 'verdict'))
+SCHEDULER_QUEUED = metric('bot_scheduler_queued_updates', 'gauge',
+                          "Updates waiting for their chat or a free handler slot", ('bot',))
+SCHEDULER_RUNNING = metric('bot_scheduler_running_handlers', 'gauge', "Handlers running right now", ('bot',))
+SCHEDULER_CHATS = metric('bot_scheduler_chats', 'gauge', "Chats with queued or running updates", ('bot',))
+SCHEDULER_WAIT = metric('bot_scheduler_wait_seconds', 'histogram', "Time an update waited before its handler started",
+                        ('bot',), LATENCY_BUCKETS)
+SLOW_CALLBACKS = metric('bot_slow_callbacks_total', 'counter', "Event loop steps slower than the profiling threshold")
+SLOW_HANDLERS = metric('bot_slow_handlers_total', 'counter', "Handlers slower than the profiling threshold",
+                       ('bot', 'state'))
+LEADS_ROUTED = metric('bot_leads_routed_total', 'counter', "Leads sent to a manager pool", ('bot', 'pool'))
+CLAIM_TIME = metric('bot_lead_claim_seconds', 'histogram', "Time from routing a lead to a manager claiming it",
+                    ('bot',), (60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400))
+FUNNEL = metric('bot_form_step_total', 'counter', "Form sessions that reached a step, once per session", ('bot', 'state'))
+
+# id бота -> имя бота для меток запросов к API
+BOT_NAMES = {}
+
+
+# Метрики процессов-обработчиков (WORKERS > 1): номер обработчика -> последний
+# снимок его метрик. Обработчики присылают снимки процессу-приемнику по
+# очереди подтверждений (см. sharding.py), и /metrics приемника показывает их
+WORKER_SNAPSHOTS = {}
+
+
+def snapshot():
+    return {item.name: item.snapshot() for item in REGISTRY}
+
+
+def collect(worker_id, values):
+    WORKER_SNAPSHOTS[worker_id] = values
+
+
+def render():
+    lines = []
+    workers = sorted(WORKER_SNAPSHOTS.items())
+    for item in REGISTRY:
+        lines.extend(item.render([(worker_id, values.get(item.name, {})) for worker_id, values in workers]))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    # Внешний middleware обновлений: время обработки по боту и состоянию FSM
+    def __init__(self, bot_name):
+        self.bot_name = bot_name
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_LATENCY.observe(self.bot_name, data.get('raw_state') or '', value=time.perf_counter() - started)
+
+
+class RequestMetrics(BaseRequestMiddleware):
+    # Middleware HTTP-сессии: время и ошибки каждого вызова Bot API
+    async def __call__(self, make_request, bot, method):
+        bot_name = BOT_NAMES.get(bot.id, str(bot.id))
+        api_method = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            API_THROTTLED.inc(bot_name, api_method)
+            raise
+        except Exception as e:
+            API_ERRORS.inc(bot_name, api_method, type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(bot_name, api_method, value=time.perf_counter() - started)
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики доступны на %s:%d/metrics", host, port)
+    return runner
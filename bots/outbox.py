@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+from contextlib import suppress
+from dataclasses import dataclass
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import FSInputFile
+
+# Очередь исходящих уведомлений администратору.
+# Обработчик только кладет сообщение в очередь (запись в SQLite) и сразу
+# отвечает пользователю, а фоновый обработчик отправляет сообщения с учетом
+# лимитов Telegram, retry_after и повторов с экспоненциальной задержкой.
+# Неотправленные сообщения лежат на диске и отправляются после перезапуска.
+
+# Лимиты Telegram: около 1 сообщения в секунду в личный чат
+# и не более 20 сообщений в минуту в группу
+PRIVATE_CHAT_RATE = (1.0, 3)
+GROUP_CHAT_RATE = (20 / 60, 3)
+MAX_ATTEMPTS = 10
+MAX_BACKOFF = 300
+# Сколько хранить отправленные сообщения, чтобы отбрасывать повторы по ключу
+SENT_RETENTION = 7 * 24 * 3600
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        # Сколько секунд ждать до появления токена (0 — можно отправлять)
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+@dataclass(slots=True)
+class OutboxItem:
+    id: int
+    chat_id: int
+    method: str
+    payload: dict
+    attempts: int = 0
+    next_at: float = 0.0
+
+
+class Outbox:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, method TEXT NOT NULL, "
+            "payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_at REAL NOT NULL DEFAULT 0, "
+            "status TEXT NOT NULL DEFAULT 'pending', created_at REAL NOT NULL, key TEXT)"
+        )
+        # Ключ идемпотентности: сообщение с уже известным ключом не ставится
+        # в очередь повторно, даже если исходное уже отправлено
+        if 'key' not in {row[1] for row in self._db.execute("PRAGMA table_info(outbox)")}:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN key TEXT")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS outbox_key ON outbox (key)")
+        self._db.execute("DELETE FROM outbox WHERE status = 'sent' AND created_at < ?",
+                         (time.time() - SENT_RETENTION,))
+        # Очередь по каждому чату: порядок сообщений внутри чата сохраняется,
+        # а задержка одного чата не блокирует остальные
+        self._queues = {}
+        self._buckets = {}
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._stopping = False
+        for row in self._db.execute(
+            "SELECT id, chat_id, method, payload, attempts, next_at FROM outbox "
+            "WHERE status = 'pending' ORDER BY id"
+        ):
+            self._push(OutboxItem(row[0], row[1], row[2], json.loads(row[3]), row[4], row[5]))
+
+    @property
+    def backlog(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _push(self, item):
+        self._queues.setdefault(item.chat_id, deque()).append(item)
+
+    def enqueue(self, method, chat_id, key=None, **payload):
+        # Возвращает False, если сообщение с таким ключом уже было в очереди
+        payload['chat_id'] = chat_id
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO outbox (chat_id, method, payload, created_at, key) VALUES (?, ?, ?, ?, ?)",
+            (chat_id, method, json.dumps(payload, ensure_ascii=False), time.time(), key),
+        )
+        if not cursor.rowcount:
+            logging.info("Outbox: сообщение %s уже поставлено в очередь", key)
+            return False
+        self._push(OutboxItem(cursor.lastrowid, chat_id, method, payload))
+        self._wakeup.set()
+        return True
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(*(PRIVATE_CHAT_RATE if chat_id > 0 else GROUP_CHAT_RATE))
+        return bucket
+
+    def _next_ready(self):
+        # Первое сообщение, которое можно отправить сейчас, или время ожидания
+        now = time.time()
+        wait = max(0.0, self._paused_until - now)
+        if wait:
+            return None, wait
+        wait = None
+        monotonic = time.monotonic()
+        for chat_id, queue in self._queues.items():
+            item = queue[0]
+            delay = max(item.next_at - now, self._bucket(chat_id).delay(monotonic))
+            if delay <= 0:
+                return item, 0.0
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def start(self, bot):
+        if self._worker is None or self._worker.done():
+            self._stopping = False
+            self._worker = asyncio.create_task(self._run(bot))
+
+    async def stop(self, timeout=10):
+        # Начатая отправка доводится до конца: если прервать запрос, нельзя
+        # узнать, дошло ли сообщение, и после перезапуска оно уйдет повторно
+        if self._worker is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.wait({self._worker}, timeout=timeout)
+            self._worker.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+
+    async def _run(self, bot):
+        while not self._stopping:
+            item, wait = self._next_ready()
+            if item is None:
+                self._wakeup.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                continue
+            self._bucket(item.chat_id).take(time.monotonic())
+            await self._deliver(bot, item)
+
+    async def _deliver(self, bot, item):
+        payload = item.payload
+        if 'document_path' in payload:
+            # Файл (сводка заявок) лежит на диске, в очереди хранится только путь
+            payload = dict(payload)
+            payload['document'] = FSInputFile(payload.pop('document_path'))
+        try:
+            await getattr(bot, item.method)(**payload)
+        except TelegramRetryAfter as e:
+            # Flood control действует на весь бот: ждем и повторяем то же сообщение
+            logging.warning("Outbox: Telegram просит подождать %s с", e.retry_after)
+            self._paused_until = time.time() + e.retry_after
+            return
+        except Exception as e:
+            self._retry_later(item, e)
+            return
+        self._db.execute("UPDATE outbox SET status = 'sent', payload = '{}' WHERE id = ?", (item.id,))
+        self._pop(item)
+
+    def _retry_later(self, item, error):
+        item.attempts += 1
+        if item.attempts >= MAX_ATTEMPTS:
+            logging.error("Outbox: сообщение %d не отправлено после %d попыток: %s", item.id, item.attempts, error)
+            self._db.execute(
+                "UPDATE outbox SET status = 'failed', attempts = ? WHERE id = ?", (item.attempts, item.id)
+            )
+            self._pop(item)
+            return
+        item.next_at = time.time() + min(MAX_BACKOFF, 2 ** item.attempts)
+        logging.warning("Outbox: ошибка отправки сообщения %d (%s), повтор через %.0f с",
+                        item.id, error, item.next_at - time.time())
+        self._db.execute(
+            "UPDATE outbox SET attempts = ?, next_at = ? WHERE id = ?", (item.attempts, item.next_at, item.id)
+        )
+
+    def _pop(self, item):
+        queue = self._queues[item.chat_id]
+        queue.popleft()
+        if not queue:
+            del self._queues[item.chat_id]
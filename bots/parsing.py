@@ -0,0 +1,162 @@
+import re
+
+# Разбор свободного текста анкет в числа: цена и сумма в рублях, площадь в м²,
+# срок в месяцах. Результат — диапазон (от, до); у "до 6 млн" нет нижней
+# границы, у "от 3 млн" — верхней (None), у точного значения границы равны.
+# Если в тексте нет числа с подходящей единицей, возвращается None.
+# Шаблоны компилируются один раз при импорте модуля.
+
+_NUMBER = r'(\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+)(?:[.,](\d+))?'
+_DASH = r'\s*(?:-|–|—|\.\.\.?|до)\s*'
+_LOWER = r'(?:от|свыше|более|больше|не менее|минимум)'
+_UPPER = r'(?:до|не более|не больше|менее|максимум|в пределах)'
+
+
+def _compile(units):
+    unit = rf'(?:\s*({units})(?![а-яa-z]))'
+    return (
+        # 3-4 млн, от 3 до 4 млн, 50–70 м2
+        re.compile(rf'(?:от\s*)?{_NUMBER}{unit}?{_DASH}{_NUMBER}{unit}?'),
+        # 5,5 млн, до 6 млн, от 3 млн
+        re.compile(rf'(?:({_LOWER}|{_UPPER})\s*)?{_NUMBER}{unit}?'),
+    )
+
+
+_MONEY = _compile(r'млрд\.?|миллиард\w*|млн\.?|миллион\w*|мил|лям\w*|кк|тыс\w*\.?|т\.\s?р\.?|тр|k|к')
+_AREA = _compile(r'кв\.?\s?м\.?|м\.?\s?кв\.?|м2|м²|метр\w*|квадрат\w*|сот\w*|га|гектар\w*')
+_TERM = _compile(r'год\w*|лет|мес\w*|недел\w*|дн\w*|день')
+_HALF_YEAR = re.compile(r'полгода|пол года')
+_YEAR_AND_HALF = re.compile(r'полтора\s+года')
+_ONE_YEAR = re.compile(r'(?<![\d\w])(?:на\s+)?год(?![а-я])')
+
+
+def _money_scale(unit):
+    if unit.startswith(('млрд', 'миллиард')):
+        return 1e9
+    if unit.startswith(('млн', 'миллион', 'мил', 'лям', 'кк')):
+        return 1e6
+    return 1e3
+
+
+def _area_scale(unit):
+    if unit.startswith('сот'):
+        return 100.0
+    if unit.startswith(('га', 'гектар')):
+        return 10000.0
+    return 1.0
+
+
+def _term_scale(unit):
+    if unit.startswith(('год', 'лет')):
+        return 12.0
+    if unit.startswith('недел'):
+        return 12 / 52
+    if unit.startswith(('дн', 'день')):
+        return 12 / 365
+    return 1.0
+
+
+def _number(whole, fraction):
+    value = float(re.sub(r'\D', '', whole))
+    if fraction:
+        value += float('0.' + fraction)
+    return value
+
+
+def _normalize(text):
+    return text.lower().replace('ё', 'е')
+
+
+def _parse(text, patterns, scale, bare):
+    # bare(value) — значение числа без единицы измерения; None — такие
+    # числа не принимаются (например, "2 комнаты" в поле деталей)
+    if not text:
+        return None
+    text = _normalize(text)
+    range_pattern, single_pattern = patterns
+    match = range_pattern.search(text)
+    if match:
+        low_whole, low_fraction, low_unit, high_whole, high_fraction, high_unit = match.groups()
+        low, high = _number(low_whole, low_fraction), _number(high_whole, high_fraction)
+        # "3-4 млн": единица второго числа относится к обоим
+        if high_unit or low_unit:
+            low *= scale(low_unit or high_unit)
+            high *= scale(high_unit or low_unit)
+            return (low, high) if low <= high else (high, low)
+        if bare is not None:
+            low, high = bare(low), bare(high)
+            return (low, high) if low <= high else (high, low)
+    fallback = None
+    for match in single_pattern.finditer(text):
+        bound, whole, fraction, unit = match.groups()
+        if unit:
+            return _bounded(bound, _number(whole, fraction) * scale(unit))
+        # Число без единицы берется, только если в тексте нет числа с единицей
+        if bare is not None and fallback is None:
+            fallback = _bounded(bound, bare(_number(whole, fraction)))
+    return fallback
+
+
+def _bounded(bound, value):
+    if bound is None:
+        return (value, value)
+    if bound.startswith(('от', 'свыше', 'более', 'больше', 'не менее', 'минимум')):
+        return (value, None)
+    return (None, value)
+
+
+def _bare_money(value):
+    # Суммы меньше тысячи рублей в заявках не встречаются: "5,5" — это миллионы
+    return value * 1e6 if value < 1000 else value
+
+
+def parse_money(text):
+    return _parse(text, _MONEY, _money_scale, _bare_money)
+
+
+def parse_area(text):
+    return _parse(text, _AREA, _area_scale, lambda value: value)
+
+
+def parse_area_mention(text):
+    # Площадь внутри деталей ("2 комнаты, 54 м2"): числа без единиц не берутся
+    return _parse(text, _AREA, _area_scale, None)
+
+
+def parse_term(text):
+    if not text:
+        return None
+    parsed = _parse(text, _TERM, _term_scale, None)
+    if parsed is not None:
+        return parsed
+    text = _normalize(text)
+    if _YEAR_AND_HALF.search(text):
+        return (18.0, 18.0)
+    if _HALF_YEAR.search(text):
+        return (6.0, 6.0)
+    if _ONE_YEAR.search(text):
+        return (12.0, 12.0)
+    return None
+
+
+# Числовые поля заявки: имя -> поля анкеты, из которых оно берется, по порядку.
+# Площадь в BOT_P и BOT_PR указывается в деталях вместе с комнатами
+LEAD_NUMBERS = {
+    'price': (('price', parse_money),),
+    'amount': (('amount', parse_money),),
+    'area': (('area', parse_area), ('details', parse_area_mention), ('object_info', parse_area_mention)),
+    'term': (('term', parse_term), ('period', parse_term)),
+}
+
+
+def parse_lead(data):
+    # Числовые значения анкеты: {'price': [от, до], ...}, только найденные
+    parsed = {}
+    for name, sources in LEAD_NUMBERS.items():
+        for source, parse in sources:
+            value = data.get(source)
+            result = parse(value) if isinstance(value, str) else None
+            if result is not None:
+                parsed[name] = list(result)
+                break
+    return parsed
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from functools import partial
+
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+from scheduler import ChatScheduler, chat_key
+from storage import after_flush
+
+# Получение обновлений через getUpdates с корректной остановкой.
+# Каждая полученная пачка сначала записывается в SQLite вместе со следующим
+# offset и только потом подтверждается Telegram следующим запросом.
+# Обновление удаляется из журнала после обработки, поэтому после
+# перезапуска или падения необработанные обновления обрабатываются заново.
+# Повторная обработка не приводит к повторной заявке администратору:
+# уведомления в outbox имеют ключ идемпотентности.
+#
+# По SIGTERM новые обновления больше не запрашиваются, а уже начатые
+# обработчики получают DRAIN_TIMEOUT секунд на завершение.
+# Если задан пул процессов (sharding.py), обновления обрабатываются в нем,
+# а запись удаляется из журнала по подтверждению обработчика.
+# Иначе обработку запускает планировщик (scheduler.py): по порядку в
+# пределах чата и с ограничением числа одновременных обработчиков.
+
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '30'))
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '10'))
+MAX_BACKOFF = 30
+
+
+class Poller:
+    def __init__(self, name, bot, dp, path, pool=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self.bot = bot
+        self.dp = dp
+        self.pool = pool
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS updates (update_id INTEGER PRIMARY KEY, payload TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'offset'").fetchone()
+        self.offset = row[0] if row else None
+        self._stopping = asyncio.Event()
+        self._tasks = set()
+        # Время последнего успешного getUpdates (time.monotonic) для health.py
+        self.last_poll = time.monotonic()
+        self._fetch = None
+        self._workflow = {}
+        self.scheduler = ChatScheduler(name)
+
+    def stop(self):
+        self._stopping.set()
+
+    def restart(self):
+        # Прервать зависший getUpdates: соединение закрывается, и запрос
+        # повторяется с тем же offset
+        if self._fetch is not None and not self._fetch.done():
+            self._fetch.cancel()
+
+    async def run(self):
+        dp = self.dp
+        self._workflow = {'dispatcher': dp, 'bots': [self.bot], **dp.workflow_data}
+        # С пулом обработчиков диспетчер работает в их процессах, а здесь
+        # только принимаются обновления: startup/shutdown не запускаются
+        if self.pool is None:
+            await dp.emit_startup(bot=self.bot, **self._workflow)
+        try:
+            self._replay()
+            await self._poll()
+            await self._drain()
+        finally:
+            try:
+                if self.pool is None:
+                    await dp.emit_shutdown(bot=self.bot, **self._workflow)
+                    await dp.storage.close()
+            finally:
+                self._db.close()
+
+    def _replay(self):
+        rows = self._db.execute("SELECT update_id, payload FROM updates ORDER BY update_id").fetchall()
+        if rows:
+            logging.info("%s: повторная обработка %d обновлений после перезапуска", self.name, len(rows))
+        for update_id, payload in rows:
+            self._start(update_id, payload)
+
+    async def _poll(self):
+        allowed_updates = self.dp.resolve_used_update_types()
+        stopping = asyncio.create_task(self._stopping.wait())
+        backoff = 1
+        logging.info("%s: получение обновлений (offset %s)", self.name, self.offset)
+        try:
+            while not self._stopping.is_set():
+                fetch = self._fetch = asyncio.create_task(self.bot.get_updates(
+                    offset=self.offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates,
+                ))
+                await asyncio.wait({fetch, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                if not fetch.done():
+                    # Остановка во время long polling: пачка еще не получена,
+                    # offset не сдвигался, Telegram отдаст ее после перезапуска
+                    fetch.cancel()
+                    break
+                if fetch.cancelled():
+                    logging.warning("%s: getUpdates прерван сторожем, повтор", self.name)
+                    continue
+                try:
+                    updates = fetch.result()
+                except Exception as e:
+                    logging.warning("%s: ошибка getUpdates (%s), повтор через %d с", self.name, e, backoff)
+                    await asyncio.sleep(backoff)
+                    backoff = min(MAX_BACKOFF, backoff * 2)
+                    continue
+                backoff = 1
+                self.last_poll = time.monotonic()
+                if updates:
+                    self._accept(updates)
+        finally:
+            stopping.cancel()
+
+    def _accept(self, updates):
+        rows = [(u.update_id, u.model_dump_json(exclude_none=True, by_alias=True)) for u in updates]
+        self.offset = updates[-1].update_id + 1
+        # Пачка и новый offset пишутся одной транзакцией до того, как
+        # следующий getUpdates подтвердит пачку Telegram
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR IGNORE INTO updates (update_id, payload) VALUES (?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('offset', ?)", (self.offset,))
+        for update, (update_id, payload) in zip(updates, rows):
+            self._start(update_id, payload, update)
+
+    def _start(self, update_id, payload, update=None):
+        if self.pool is not None:
+            task = self.pool.submit(self.name, json.loads(payload), payload)
+            task.add_done_callback(partial(self._submitted, update_id))
+        else:
+            if update is None:
+                update = Update.model_validate(json.loads(payload), context={'bot': self.bot})
+            task = self.scheduler.submit(chat_key(update), partial(self._process, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _submitted(self, update_id, done):
+        if done.cancelled():
+            return
+        if done.exception() is not None:
+            # Таймаут или падение обработчика: обновление остается в журнале
+            # и обрабатывается заново после перезапуска
+            logging.error("%s: обновление %d не обработано: %s", self.name, update_id, done.exception())
+            return
+        self._done(update_id)
+
+    def _done(self, update_id):
+        self._db.execute("DELETE FROM updates WHERE update_id = ?", (update_id,))
+
+    def _processed(self, update_id):
+        # Обновление удаляется из журнала, когда его переход состояния FSM
+        # записан: при падении между ними оно обрабатывается заново, а не теряется
+        after_flush(self.dp.storage, partial(self._done, update_id))
+
+    async def _process(self, update):
+        try:
+            result = await self.dp.feed_update(self.bot, update, **self._workflow)
+            if isinstance(result, TelegramMethod):
+                await self.dp.silent_call_request(self.bot, result)
+        except Exception:
+            logging.exception("%s: ошибка обработки обновления %d", self.name, update.update_id)
+        # Обработчик, прерванный по таймауту остановки, сюда не доходит,
+        # и обновление остается в журнале до следующего запуска
+        self._processed(update.update_id)
+
+    async def _drain(self):
+        if not self._tasks:
+            return
+        logging.info("%s: ожидание %d обработчиков (до %g с)", self.name, len(self._tasks), DRAIN_TIMEOUT)
+        done, pending = await asyncio.wait(set(self._tasks), timeout=DRAIN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+            logging.warning("%s: %d обновлений не успели обработаться и будут обработаны после запуска",
+                            self.name, len(pending))
@@ -0,0 +1,167 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import time
+import traceback
+from contextlib import suppress
+
+from aiogram import F, Router
+from aiogram.filters import Command
+
+from metrics import SLOW_CALLBACKS, SLOW_HANDLERS
+
+# Профилирование по запросу. Пока оно выключено, ботам это стоит одну
+# проверку флага на обновление. Включается переменной PROFILE=1 при запуске,
+# сигналом SIGUSR1 (kill -USR1 <pid launcher.py>, процессы-обработчики
+# получают его от приемника) или командой /profile из чата ADMIN_CHAT_ID.
+# Пока профилирование включено:
+# - весь процесс профилируется cProfile;
+# - шаги цикла событий дольше PROFILE_SLOW_CALLBACK_MS пишутся в лог
+#   (синхронный код, который останавливает всех ботов процесса);
+# - если обработчик обновления работает дольше PROFILE_HANDLER_MS, в лог
+#   пишется стек, на котором он стоит в этот момент.
+# Повторное переключение выключает профилирование и сохраняет профиль
+# в DATA_DIR/profiles: .prof для pstats/snakeviz и .txt с топом функций.
+
+PROFILE = os.getenv('PROFILE') == '1'
+PROFILE_SLOW_CALLBACK_MS = float(os.getenv('PROFILE_SLOW_CALLBACK_MS', '100'))
+PROFILE_HANDLER_MS = float(os.getenv('PROFILE_HANDLER_MS', '500'))
+PROFILE_DIR = os.path.join(os.getenv('DATA_DIR', 'data'), 'profiles')
+ADMIN_CHAT_ID = int(os.getenv('ADMIN_CHAT_ID') or 0)
+# Сколько функций выводить в текстовый отчет
+REPORT_LINES = 40
+
+_profile = None
+_started = 0.0
+_original_run = asyncio.events.Handle._run
+
+
+def enabled():
+    return _profile is not None
+
+
+def _describe(handle):
+    callback = getattr(handle, '_callback', None)
+    task = getattr(callback, '__self__', None)
+    if isinstance(task, asyncio.Task):
+        return f"задача {task.get_name()} ({task.get_coro().__qualname__})"
+    return repr(handle)
+
+
+def _timed_run(handle):
+    started = time.perf_counter()
+    _original_run(handle)
+    elapsed = time.perf_counter() - started
+    if elapsed * 1000 > PROFILE_SLOW_CALLBACK_MS:
+        SLOW_CALLBACKS.inc()
+        logging.warning("Медленный шаг цикла событий: %.0f мс, %s", elapsed * 1000, _describe(handle))
+
+
+def start():
+    global _profile, _started
+    if _profile is not None:
+        return
+    # Замер каждого шага цикла событий подменяет Handle._run только на время
+    # профилирования, в обычном режиме цикл работает без обертки
+    asyncio.events.Handle._run = _timed_run
+    _profile = cProfile.Profile()
+    _started = time.time()
+    _profile.enable()
+    logging.info("Профилирование включено (pid %d)", os.getpid())
+
+
+def stop():
+    # Выключает профилирование и возвращает путь к сохраненному профилю
+    global _profile
+    if _profile is None:
+        return None
+    _profile.disable()
+    asyncio.events.Handle._run = _original_run
+    profile, _profile = _profile, None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}")
+    profile.dump_stats(path + '.prof')
+    report = io.StringIO()
+    report.write(f"Профиль за {time.time() - _started:.0f} с\n")
+    pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(REPORT_LINES)
+    with open(path + '.txt', 'w', encoding='utf-8') as f:
+        f.write(report.getvalue())
+    logging.info("Профилирование выключено, профиль: %s.prof", path)
+    return path + '.prof'
+
+
+def toggle():
+    if enabled():
+        return stop()
+    start()
+    return None
+
+
+def install(callback=toggle):
+    # SIGUSR1 переключает профилирование; PROFILE=1 включает его сразу
+    with suppress(NotImplementedError, AttributeError):
+        # На Windows нет SIGUSR1 и обработчиков сигналов в цикле событий
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, callback)
+    if PROFILE:
+        start()
+
+
+class ProfilingMiddleware:
+    # Внешний middleware обновлений: стек медленного обработчика в момент,
+    # когда он превысил PROFILE_HANDLER_MS
+    def __init__(self, bot_name):
+        self.bot_name = bot_name
+
+    async def __call__(self, handler, event, data):
+        if _profile is None:
+            return await handler(event, data)
+        state = data.get('raw_state') or ''
+        timer = asyncio.get_running_loop().call_later(
+            PROFILE_HANDLER_MS / 1000, self._sample, asyncio.current_task(), state,
+        )
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            timer.cancel()
+            elapsed = time.perf_counter() - started
+            if elapsed * 1000 > PROFILE_HANDLER_MS:
+                logging.warning("%s: обработчик в состоянии %r работал %.0f мс", self.bot_name, state, elapsed * 1000)
+
+    def _sample(self, task, state):
+        SLOW_HANDLERS.inc(self.bot_name, state)
+        logging.warning("%s: обработчик в состоянии %r дольше %.0f мс, сейчас:\n%s",
+                        self.bot_name, state, PROFILE_HANDLER_MS, ''.join(traceback.format_list(await_stack(task))))
+
+
+def await_stack(task):
+    # Task.print_stack показывает только внешнюю корутину задачи; цепочка
+    # cr_await доходит до того места, где обработчик ждет сейчас
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return traceback.StackSummary.extract(frames)
+
+
+def create_router():
+    # Команда /profile только для чата администратора
+    router = Router(name='profiling')
+    router.message.register(handle_profile, Command('profile'), F.chat.id == ADMIN_CHAT_ID)
+    return router
+
+
+async def handle_profile(message):
+    path = toggle()
+    if path is None:
+        await message.answer(f"Профилирование включено (pid {os.getpid()}). Повторите /profile, чтобы сохранить профиль.")
+    else:
+        await message.answer(f"Профиль сохранен: {path}")
@@ -0,0 +1,166 @@
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import time
+
+from dedup import NON_DIGITS, PHONE_PATTERN
+
+# Запись входящих обновлений для воспроизведения (tools/replay.py).
+# Включается RECORD_UPDATES=1; каждый процесс пишет свой файл
+# DATA_DIR/traces/updates-<время запуска>.jsonl.gz: по строке на обновление
+# со временем получения и именем бота.
+# Обновления обезличиваются до записи:
+# - id пользователей и чатов заменяются псевдонимами (хеш с солью файла),
+#   поэтому обновления одного пользователя остаются связаны между собой;
+# - имена, фамилии, username и названия чатов удаляются, в том числе имя
+#   и фамилия отправленного контакта и подписи пересланных сообщений;
+# - телефоны в тексте и в отправленных контактах заменяются другими цифрами
+#   того же формата (одинаковый телефон -> одинаковая замена);
+# - в любом свободном тексте слова с заглавной буквы считаются именами и
+#   заменяются на "Имя", как и имена отправителя и контакта в любом регистре.
+# Текст, совпадающий с кнопкой анкеты (register_buttons), записывается как
+# есть, чтобы воспроизведение шло по тем же веткам анкеты.
+
+RECORD_UPDATES = os.getenv('RECORD_UPDATES') == '1'
+# Как часто сжатый поток сбрасывается на диск, секунд
+RECORD_FLUSH = float(os.getenv('RECORD_FLUSH', '5'))
+
+# Объекты пользователей и чатов в обновлении
+PEOPLE = frozenset({'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat', 'via_bot',
+                    'sender_user', 'sender_business_bot'})
+TEXTS = {'text': 'entities', 'caption': 'caption_entities'}
+# Прочий свободный текст: inline-запросы, места, опросы
+FREE_TEXTS = frozenset({'query', 'title', 'address', 'question', 'description'})
+# Имена без объекта пользователя: пересылка от скрытого отправителя, подпись в канале
+SIGNATURES = frozenset({'forward_sender_name', 'sender_user_name', 'author_signature', 'forward_signature'})
+NAME = re.compile(r'\b[А-ЯЁA-Z][а-яёa-z]+\b')
+PLACEHOLDER_NAME = "Имя"
+
+# Тексты кнопок анкет (регистрирует forms.FormEngine)
+BUTTON_TEXTS = set()
+
+
+def register_buttons(texts):
+    BUTTON_TEXTS.update(text for text in texts if text)
+
+
+class Recorder:
+    def __init__(self, path, flush_interval=RECORD_FLUSH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.salt = os.urandom(16)
+        self.count = 0
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._flushed = time.monotonic()
+
+    def record(self, bot, update):
+        raw = update.model_dump(mode='json', exclude_none=True, by_alias=True)
+        # Номер обновления назначит API, в который трасса воспроизводится
+        raw.pop('update_id', None)
+        line = {'t': round(time.time(), 3), 'bot': bot, 'update': self.anonymize(raw)}
+        self._file.write(json.dumps(line, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.count += 1
+        now = time.monotonic()
+        if now - self._flushed >= self.flush_interval:
+            self._file.flush()
+            self._flushed = now
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            logging.info("Записано обновлений: %d в %s", self.count, self.path)
+
+    def _hash(self, value, size):
+        return hashlib.blake2b(str(value).encode('utf-8'), key=self.salt, digest_size=size).digest()
+
+    def pseudonym(self, value):
+        # Знак сохраняется: у групп и каналов id отрицательные
+        number = int.from_bytes(self._hash(abs(value), 5), 'big') + 1
+        return number if value >= 0 else -number
+
+    def scrub_phone(self, match):
+        text = match.group()
+        digits = NON_DIGITS.sub('', text)
+        fake = itertools.cycle(str(int.from_bytes(self._hash(digits, 16), 'big')))
+        # Первая цифра (код страны или 8) остается, чтобы номер разбирался так же
+        position = text.index(digits[0]) + 1
+        return text[:position] + re.sub(r'\d', lambda _: next(fake), text[position:])
+
+    def scrub_text(self, text, names):
+        if text in BUTTON_TEXTS:
+            return text
+        scrubbed = NAME.sub(PLACEHOLDER_NAME, PHONE_PATTERN.sub(self.scrub_phone, text))
+        for name in names:
+            # Имена отправителя и контакта, написанные со строчной буквы
+            scrubbed = re.sub(rf'\b{re.escape(name)}\b', PLACEHOLDER_NAME, scrubbed, flags=re.IGNORECASE)
+        return scrubbed
+
+    def anonymize(self, value, names=None):
+        if isinstance(value, list):
+            return [self.anonymize(item, names) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if names is None:
+            names = set()
+        # Имена отправителя и контакта сначала собираются, чтобы найти их в тексте
+        for key in PEOPLE | {'contact'}:
+            person = value.get(key)
+            if isinstance(person, dict):
+                names.update(person[field] for field in ('first_name', 'last_name')
+                             if isinstance(person.get(field), str) and len(person[field]) > 1)
+        result = {}
+        for key, item in value.items():
+            if key in PEOPLE and isinstance(item, dict):
+                result[key] = self._person(item)
+            elif key == 'contact' and isinstance(item, dict):
+                result[key] = self._contact(item)
+            elif key in SIGNATURES and isinstance(item, str):
+                result[key] = PLACEHOLDER_NAME
+            elif (key in TEXTS or key in FREE_TEXTS) and isinstance(item, str):
+                result[key] = self.scrub_text(item, names)
+            else:
+                result[key] = self.anonymize(item, names)
+        # Разметка ссылается на позиции в исходном тексте
+        for key, entities in TEXTS.items():
+            if key in value and result[key] != value[key]:
+                result.pop(entities, None)
+        return result
+
+    def _person(self, person):
+        result = {key: person[key] for key in ('id', 'is_bot', 'type', 'language_code') if key in person}
+        result['id'] = self.pseudonym(person['id'])
+        if 'is_bot' in person:
+            result['first_name'] = "User"
+        if person.get('type', 'private') != 'private':
+            result['title'] = "Chat"
+        return result
+
+    def _contact(self, contact):
+        result = {
+            'phone_number': PHONE_PATTERN.sub(self.scrub_phone, contact.get('phone_number', '')),
+            'first_name': "User",
+        }
+        if 'user_id' in contact:
+            result['user_id'] = self.pseudonym(contact['user_id'])
+        return result
+
+
+class RecordingMiddleware:
+    # Внешний middleware обновлений: запись до обработки
+    def __init__(self, bot_name, recorder):
+        self.bot_name = bot_name
+        self.recorder = recorder
+
+    async def __call__(self, handler, event, data):
+        try:
+            self.recorder.record(self.bot_name, event)
+        except Exception:
+            logging.exception("Не удалось записать обновление %s", self.bot_name)
+        return await handler(event, data)
@@ -0,0 +1,310 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+
+from aiogram import F, Router, types
+from aiogram.exceptions import TelegramBadRequest
+
+from leadindex import REGION_FIELDS, normalize_type, region_stems
+from metrics import CLAIM_TIME, LEADS_ROUTED
+
+# Распределение заявок по менеджерам.
+# Правила маршрутизации лежат в JSON-файле ROUTING_RULES: пулы чатов
+# менеджеров и правила по боту, направлению (direction), типу объекта
+# (property_type, у BOT_Ocenka — object_type) и региону (слово из адреса):
+#   {
+#     "strategy": "least_loaded",
+#     "pools": {"moscow": [-1001, -1002], "invest": [-1003], "all": [-1004]},
+#     "rules": [
+#       {"bot": "BOT_PR", "region": "Москва", "pool": "moscow"},
+#       {"bot": "BOT_Inv", "pool": "invest", "strategy": "round_robin"},
+#       {"pool": "all"}
+#     ]
+#   }
+# Условия, не указанные в правиле, подходят к любой заявке; из подходящих
+# правил выбирается первое по порядку в файле. При загрузке правила
+# компилируются в словарь (бот, направление, тип, регион) -> маршрут, где
+# пропущенное условие — ANY, поэтому выбор маршрута — несколько поисков в
+# словаре (все сочетания значений заявки и ANY), а не перебор правил.
+# В пуле заявка достается чату с наименьшим числом невзятых заявок
+# (least_loaded) или следующему по кругу (round_robin). Менеджер берет заявку
+# кнопкой "Беру" в том чате, куда она назначена; время от отправки до нажатия
+# сохраняется в базе и в метрике bot_lead_claim_seconds.
+# Без ROUTING_RULES все заявки идут в ADMIN_CHAT_ID.
+#
+# Отчет по времени реакции и проверка маршрута:
+#   python bots/routing.py report --days 7
+#   python bots/routing.py route --bot BOT_PR --property-type Квартира --region "Москва, Арбат"
+
+ROUTING_RULES = os.getenv('ROUTING_RULES')
+LEAST_LOADED = 'least_loaded'
+ROUND_ROBIN = 'round_robin'
+STRATEGIES = (LEAST_LOADED, ROUND_ROBIN)
+# Невзятая заявка старше этого не считается нагрузкой чата, секунд
+LOAD_WINDOW = float(os.getenv('ROUTING_LOAD_WINDOW', '86400'))
+CLAIM_BUTTON = "✋ Беру"
+CLAIM_PREFIX = 'claim:'
+STALE_CLAIM = "Кнопка устарела"
+ANY = None
+DIMENSIONS = ('bot', 'direction', 'property_type', 'region')
+TYPE_FIELDS = {'direction': ('direction',), 'property_type': ('property_type', 'object_type')}
+
+
+@dataclass(frozen=True, slots=True)
+class Route:
+    pool: str
+    chats: tuple
+    strategy: str
+
+
+def rule_value(dimension, value):
+    if dimension == 'bot':
+        return value
+    if dimension == 'region':
+        # Первое слово региона правила: "Санкт-Петербург" -> "санкт"
+        stems = region_stems(value)
+        if not stems:
+            raise ValueError(f"Регион правила без слов: {value!r}")
+        return min(stems, key=value.lower().replace('ё', 'е').find)
+    return normalize_type(value)
+
+
+def lead_values(bot, data):
+    # Значения заявки по измерениям; у каждого измерения еще вариант ANY
+    values = [(bot, ANY)]
+    for dimension in ('direction', 'property_type'):
+        value = next((data[f] for f in TYPE_FIELDS[dimension] if isinstance(data.get(f), str)), None)
+        values.append((normalize_type(value), ANY) if value else (ANY,))
+    stems = set()
+    for field in REGION_FIELDS:
+        if isinstance(data.get(field), str):
+            stems |= region_stems(data[field])
+    values.append((*stems, ANY))
+    return values
+
+
+class RoutingTable:
+    def __init__(self, config):
+        pools = config.get('pools') or {}
+        default_strategy = config.get('strategy', LEAST_LOADED)
+        # (бот, направление, тип, регион) -> (порядковый номер правила, маршрут)
+        self.table = {}
+        self.routes = {}
+        # Все чаты менеджеров из правил
+        self.chats = set()
+        for number, rule in enumerate(config.get('rules') or []):
+            pool = rule.get('pool')
+            chats = pools.get(pool)
+            if not chats:
+                raise ValueError(f"Правило {number + 1}: пул {pool!r} не задан или пуст")
+            strategy = rule.get('strategy', default_strategy)
+            if strategy not in STRATEGIES:
+                raise ValueError(f"Правило {number + 1}: стратегия {strategy!r}, ожидается одна из {STRATEGIES}")
+            unknown = set(rule) - set(DIMENSIONS) - {'pool', 'strategy'}
+            if unknown:
+                raise ValueError(f"Правило {number + 1}: неизвестные условия {sorted(unknown)}")
+            route = self.routes.setdefault((pool, strategy), Route(pool, tuple(int(c) for c in chats), strategy))
+            self.chats.update(route.chats)
+            key = tuple(rule_value(d, rule[d]) if d in rule else ANY for d in DIMENSIONS)
+            # Из одинаковых правил действует первое
+            self.table.setdefault(key, (number, route))
+
+    def __len__(self):
+        return len(self.table)
+
+    def route(self, bot, data):
+        best = None
+        for key in itertools.product(*lead_values(bot, data)):
+            found = self.table.get(key)
+            if found is not None and (best is None or found[0] < best[0]):
+                best = found
+        return best[1] if best is not None else None
+
+
+def load_table(path):
+    with open(path, encoding='utf-8') as f:
+        return RoutingTable(json.load(f))
+
+
+class Routing:
+    def __init__(self, table, path, load_window=LOAD_WINDOW):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.table = table
+        self.load_window = load_window
+        # Общая база всех ботов и процессов-обработчиков
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=1000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leads (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE, "
+            "bot TEXT NOT NULL, chat_id INTEGER NOT NULL, created_at REAL NOT NULL, "
+            "claimed_at REAL, claimed_by INTEGER, claimed_name TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS leads_open ON leads (chat_id, created_at) WHERE claimed_at IS NULL")
+        # Счетчики round_robin по маршрутам
+        self._turns = {}
+
+    def assign(self, bot, data, key, fallback_chat_id):
+        # -> (номер заявки, чат) или (None, fallback_chat_id), если ни одно правило
+        # не подошло. Повторный вызов с тем же ключом возвращает прежнее назначение
+        row = self._db.execute("SELECT id, chat_id FROM leads WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            return row
+        route = self.table.route(bot, data)
+        if route is None:
+            return None, fallback_chat_id
+        if route.strategy == ROUND_ROBIN or len(route.chats) == 1:
+            turn = self._turns.get(route, 0)
+            self._turns[route] = turn + 1
+            chat_id = route.chats[turn % len(route.chats)]
+        else:
+            chat_id = self._least_loaded(route.chats)
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO leads (key, bot, chat_id, created_at) VALUES (?, ?, ?, ?)",
+            (key, bot, chat_id, time.time()),
+        )
+        if not cursor.rowcount:
+            return self._db.execute("SELECT id, chat_id FROM leads WHERE key = ?", (key,)).fetchone()
+        LEADS_ROUTED.inc(bot, route.pool)
+        return cursor.lastrowid, chat_id
+
+    def _least_loaded(self, chats):
+        placeholders = ','.join('?' * len(chats))
+        load = dict(self._db.execute(
+            f"SELECT chat_id, COUNT(*) FROM leads WHERE claimed_at IS NULL AND created_at > ? "
+            f"AND chat_id IN ({placeholders}) GROUP BY chat_id",
+            (time.time() - self.load_window, *chats),
+        ).fetchall())
+        # При равной нагрузке — первый чат пула
+        return min(chats, key=lambda chat_id: load.get(chat_id, 0))
+
+    def claim(self, lead_id, chat_id, user_id, name):
+        # -> (взята сейчас, секунд до взятия, имя взявшего) или None, если заявки
+        # нет или она назначена другому чату: callback_data кнопки присылает
+        # клиент, и номер заявки в ней может быть любым
+        now = time.time()
+        updated = self._db.execute(
+            "UPDATE leads SET claimed_at = ?, claimed_by = ?, claimed_name = ? "
+            "WHERE id = ? AND chat_id = ? AND claimed_at IS NULL",
+            (now, user_id, name, lead_id, chat_id),
+        ).rowcount
+        row = self._db.execute(
+            "SELECT bot, created_at, claimed_at, claimed_name FROM leads WHERE id = ? AND chat_id = ?", (lead_id, chat_id),
+        ).fetchone()
+        if row is None:
+            return None
+        bot, created_at, claimed_at, claimed_name = row
+        if updated:
+            CLAIM_TIME.observe(bot, value=claimed_at - created_at)
+        return bool(updated), claimed_at - created_at, claimed_name
+
+    def report(self, since):
+        # Чат -> (заявок, взято, медиана и 90-й перцентиль времени до взятия)
+        rows = self._db.execute(
+            "SELECT chat_id, claimed_at - created_at FROM leads WHERE created_at >= ? ORDER BY chat_id", (since,)
+        ).fetchall()
+        result = {}
+        for chat_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            delays = sorted(delay for _, delay in group if delay is not None)
+            if not delays:
+                result[chat_id] = (len(group), 0, None, None)
+                continue
+            p90 = delays[min(len(delays) - 1, int(len(delays) * 0.9))]
+            result[chat_id] = (len(group), len(delays), statistics.median(delays), p90)
+        return result
+
+    def close(self):
+        self._db.close()
+
+
+def claim_markup(lead_id, text=CLAIM_BUTTON):
+    # Разметка хранится в outbox как JSON
+    return {'inline_keyboard': [[{'text': text, 'callback_data': f'{CLAIM_PREFIX}{lead_id}'}]]}
+
+
+def format_delay(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    return f"{seconds / 3600:.1f} ч"
+
+
+def create_router(routing):
+    router = Router(name='routing')
+
+    async def handle_claim(callback: types.CallbackQuery):
+        value = callback.data[len(CLAIM_PREFIX):]
+        # Данные кнопки приходят от клиента: не номер заявки (старая версия
+        # бота, подделка) — нажатие подтверждается, а не падает с ValueError
+        if not (value.isascii() and value.isdigit() and len(value) <= 18):
+            return callback.answer(STALE_CLAIM)
+        lead_id = int(value)
+        # Взять заявку можно только из чата, которому она назначена
+        chat_id = callback.message.chat.id if callback.message is not None else None
+        result = routing.claim(lead_id, chat_id, callback.from_user.id, callback.from_user.full_name)
+        if result is None:
+            return callback.answer("Заявка не найдена в этом чате", show_alert=True)
+        claimed, delay, name = result
+        if not claimed:
+            return callback.answer(f"Заявку уже взял(а) {name}")
+        logging.info("Заявку %d взял(а) %s через %s", lead_id, name, format_delay(delay))
+        if callback.message is not None:
+            # Кнопка заменяется отметкой, кто и через сколько взял заявку
+            try:
+                await callback.message.edit_reply_markup(
+                    reply_markup=claim_markup(lead_id, f"✅ {name} · {format_delay(delay)}"),
+                )
+            except TelegramBadRequest as e:
+                logging.warning("Не удалось отметить взятую заявку %d: %s", lead_id, e)
+        return callback.answer("Заявка ваша")
+
+    router.callback_query.register(handle_claim, F.data.startswith(CLAIM_PREFIX))
+    return router
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lead routing: claim report and route check")
+    parser.add_argument('--db', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'routing.sqlite3'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    report_command = commands.add_parser('report', help="time to claim per manager chat")
+    report_command.add_argument('--days', type=float, default=7)
+    route_command = commands.add_parser('route', help="show where a lead would go")
+    route_command.add_argument('--rules', default=ROUTING_RULES, required=not ROUTING_RULES)
+    route_command.add_argument('--bot', required=True)
+    for dimension in ('direction', 'property-type', 'region'):
+        route_command.add_argument(f'--{dimension}')
+    args = parser.parse_args()
+
+    if args.command == 'route':
+        table = load_table(args.rules)
+        data = {'direction': args.direction, 'property_type': args.property_type, 'region': args.region}
+        started = time.perf_counter()
+        route = table.route(args.bot, {name: value for name, value in data.items() if value})
+        elapsed = time.perf_counter() - started
+        print(f"Правил в таблице: {len(table)}")
+        print("Ни одно правило не подошло: ADMIN_CHAT_ID" if route is None
+              else f"Пул {route.pool} ({route.strategy}): {', '.join(map(str, route.chats))}")
+        print(f"Время выбора: {elapsed * 1e6:.0f} мкс", file=sys.stderr)
+        return
+    routing = Routing(None, args.db)
+    print(f"{'чат':>16} {'заявок':>7} {'взято':>6} {'медиана':>9} {'p90':>9}")
+    for chat_id, (total, claimed, median, p90) in routing.report(time.time() - args.days * 86400).items():
+        median = format_delay(median) if median is not None else '—'
+        p90 = format_delay(p90) if p90 is not None else '—'
+        print(f"{chat_id:>16} {total:>7} {claimed:>6} {median:>9} {p90:>9}")
+
+
+if __name__ == '__main__':
+    main()
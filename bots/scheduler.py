@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+from functools import partial
+
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+
+from metrics import SCHEDULER_CHATS, SCHEDULER_QUEUED, SCHEDULER_RUNNING, SCHEDULER_WAIT
+
+# Планировщик обработки обновлений бота.
+# У каждого чата своя очередь: задача следующего обновления чата ждет
+# завершения предыдущей, поэтому переходы FSM одного пользователя идут строго
+# по порядку, даже если он отправил два сообщения подряд. Разные чаты
+# обрабатываются параллельно, но одновременно работает не больше
+# HANDLER_CONCURRENCY обработчиков (0 — без ограничения); остальные ждут
+# свободного места в порядке поступления. Очередь чата удаляется, как только
+# в ней не остается обновлений.
+
+HANDLER_CONCURRENCY = int(os.getenv('HANDLER_CONCURRENCY', '64'))
+
+
+def chat_key(update):
+    # Чат обновления, а если чата нет (inline-запросы и т. п.) — пользователь
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.chat is not None:
+        return context.chat.id
+    if context.user is not None:
+        return context.user.id
+    return update.update_id
+
+
+class ChatScheduler:
+    def __init__(self, name, limit=HANDLER_CONCURRENCY):
+        self.name = name
+        self._slots = asyncio.Semaphore(limit) if limit else None
+        # чат -> задача последнего обновления чата (хвост очереди)
+        self._tails = {}
+        self.queued = 0
+        self.running = 0
+
+    def __len__(self):
+        return len(self._tails)
+
+    def submit(self, key, job):
+        # job — функция без аргументов, возвращающая корутину обработки.
+        # Возвращает задачу; ее отмена снимает обновление с очереди
+        task = asyncio.create_task(self._run(job, self._tails.get(key), time.perf_counter()))
+        self._tails[key] = task
+        task.add_done_callback(partial(self._forget, key))
+        SCHEDULER_CHATS.set(self.name, value=len(self._tails))
+        return task
+
+    def _forget(self, key, task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+            SCHEDULER_CHATS.set(self.name, value=len(self._tails))
+
+    async def _run(self, job, previous, submitted):
+        # Счетчик меняется внутри задачи: отмененная до старта задача его не трогает
+        self.queued += 1
+        SCHEDULER_QUEUED.set(self.name, value=self.queued)
+        try:
+            if previous is not None:
+                # Отмена или ошибка предыдущего обновления не останавливает очередь
+                await asyncio.wait({previous})
+            if self._slots is not None:
+                await self._slots.acquire()
+        finally:
+            self.queued -= 1
+            SCHEDULER_QUEUED.set(self.name, value=self.queued)
+        SCHEDULER_WAIT.observe(self.name, value=time.perf_counter() - submitted)
+        self.running += 1
+        SCHEDULER_RUNNING.set(self.name, value=self.running)
+        try:
+            return await job()
+        finally:
+            self.running -= 1
+            SCHEDULER_RUNNING.set(self.name, value=self.running)
+            if self._slots is not None:
+                self._slots.release()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import suppress
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from metrics import SESSIONS, SESSIONS_EXPIRED
+from storage import after_flush
+
+# Ограничение числа незаконченных анкет в памяти.
+# Хранилище-обертка запоминает время последней активности каждой сессии
+# (любое обновление пользователя или изменение состояния). Фоновая задача
+# раз в SESSION_SWEEP_INTERVAL секунд очищает сессии, простаивающие дольше
+# SESSION_TTL, а при превышении SESSION_MAX сразу вытесняется самая давняя.
+# Законченные и очищенные сессии выгружаются из памяти вложенного хранилища.
+
+# Время жизни брошенной анкеты, секунд; 0 — не ограничено
+SESSION_TTL = float(os.getenv('SESSION_TTL', '86400'))
+SESSION_MAX = int(os.getenv('SESSION_MAX', '50000'))
+# Через сколько секунд простоя напомнить о незаконченной заявке; 0 — не напоминать
+SESSION_REMINDER = float(os.getenv('SESSION_REMINDER', '0'))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '60'))
+REMINDER_TEXT = "👋 Вы не закончили заявку. Продолжим? Просто ответьте на последний вопрос."
+
+
+class SessionStorage(BaseStorage):
+    def __init__(self, storage, name, ttl=SESSION_TTL, max_sessions=SESSION_MAX, remind_after=SESSION_REMINDER,
+                 sweep_interval=SESSION_SWEEP_INTERVAL, clock=time.monotonic):
+        self.storage = storage
+        self.name = name
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.remind_after = remind_after
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        # StorageKey -> [время последней активности, напоминание отправлено];
+        # порядок — от самой давней активности к последней
+        self._sessions = OrderedDict()
+        self._sweeper = None
+        self._bot = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __bool__(self):
+        # Dispatcher подставляет MemoryStorage вместо ложного storage,
+        # а без сессий __len__ вернул бы 0
+        return True
+
+    async def start(self, bot):
+        self._bot = bot
+        purge = getattr(self.storage, 'purge', None)
+        if self.ttl and purge is not None:
+            # Сессии на диске, брошенные до перезапуска, в память не попадут
+            deleted = purge(time.time() - self.ttl)
+            if deleted:
+                logging.info("%s: удалено брошенных анкет: %d", self.name, deleted)
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._sweeper
+            self._sweeper = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logging.exception("%s: ошибка очистки сессий", self.name)
+
+    async def sweep(self):
+        now = self.clock()
+        idle_limit = min(self.ttl or float('inf'), self.remind_after or float('inf'))
+        for key, session in list(self._sessions.items()):
+            idle = now - session[0]
+            if idle < idle_limit:
+                break
+            if self.ttl and idle >= self.ttl:
+                await self._expire(key, 'ttl')
+            elif self.remind_after and not session[1]:
+                session[1] = True
+                await self._remind(key)
+        SESSIONS.set(self.name, value=len(self._sessions))
+
+    async def _remind(self, key):
+        if self._bot is None:
+            return
+        try:
+            await self._bot.send_message(key.chat_id, REMINDER_TEXT)
+        except Exception as e:
+            logging.warning("%s: не удалось напомнить чату %s: %s", self.name, key.chat_id, e)
+
+    async def _expire(self, key, reason):
+        self._sessions.pop(key, None)
+        await self.storage.set_state(key, None)
+        await self.storage.set_data(key, {})
+        self._discard(key)
+        SESSIONS_EXPIRED.inc(self.name, reason)
+
+    def _discard(self, key):
+        discard = getattr(self.storage, 'discard', None)
+        if discard is not None:
+            discard(key)
+        elif isinstance(self.storage, MemoryStorage):
+            self.storage.storage.pop(key, None)
+
+    async def _touch(self, key):
+        session = self._sessions.get(key)
+        if session is None:
+            self._sessions[key] = [self.clock(), False]
+            if self.max_sessions and len(self._sessions) > self.max_sessions:
+                await self._expire(next(iter(self._sessions)), 'lru')
+        else:
+            session[0] = self.clock()
+            session[1] = False
+            self._sessions.move_to_end(key)
+
+    async def _forget(self, key):
+        self._sessions.pop(key, None)
+        self._discard(key)
+
+    async def set_state(self, key, state=None):
+        await self.storage.set_state(key, state)
+        if state is None and not await self.storage.get_data(key):
+            await self._forget(key)
+        else:
+            await self._touch(key)
+
+    async def get_state(self, key):
+        state = await self.storage.get_state(key)
+        # Состояние читается на каждое обновление пользователя; сессия,
+        # которой еще нет в списке, восстановлена с диска после перезапуска
+        if state is not None or key in self._sessions:
+            await self._touch(key)
+        else:
+            # Пользователь без анкеты не занимает память
+            self._discard(key)
+        return state
+
+    async def set_data(self, key, data):
+        await self.storage.set_data(key, data)
+        if not data and await self.storage.get_state(key) is None:
+            await self._forget(key)
+        else:
+            await self._touch(key)
+
+    async def get_data(self, key):
+        return await self.storage.get_data(key)
+
+    def after_flush(self, callback):
+        after_flush(self.storage, callback)
+
+    async def close(self):
+        await self.stop()
+        await self.storage.close()
@@ -0,0 +1,314 @@
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+import metrics
+import profiling
+from common import WORKERS, get_session
+from scheduler import ChatScheduler
+from storage import after_flush
+
+# Обработка обновлений в нескольких процессах (WORKERS > 1).
+# Процесс launcher.py только получает обновления (polling или вебхук)
+# и раздает их процессам-обработчикам по chat_id: все обновления одного чата
+# попадают в один процесс и обрабатываются в нем по порядку, поэтому шаги
+# анкеты не перемешиваются. Состояния FSM процессы делят через общее
+# хранилище (SQLite в DATA_DIR или Redis, см. FSM_STORAGE).
+# Обработчик подтверждает каждое обновление, после чего оно удаляется из
+# журнала получения (polling) или на вебхук отправляется ответ 200.
+# Число процессов WORKERS читается в common.py.
+# Процесс-приемник раз в секунду проверяет обработчики: упавший запускается
+# заново, и ему повторно отдаются неподтвержденные обновления.
+# По той же очереди обработчики присылают снимки метрик: /metrics приемника
+# показывает их с меткой worker.
+
+# Сколько ждать подтверждения обновления от обработчика, секунд
+WORKER_TIMEOUT = float(os.getenv('WORKER_TIMEOUT', '60'))
+# Сколько раз обновление отдается заново после падения обработчика
+WORKER_RETRIES = 2
+# Столько перезапусков одного обработчика за WORKER_RESTART_WINDOW секунд —
+# сбой, после которого сторож (health.py) перезапускает весь процесс
+WORKER_RESTARTS = int(os.getenv('WORKER_RESTARTS', '5'))
+WORKER_RESTART_WINDOW = 60
+CHECK_INTERVAL = 1.0
+# Как часто обработчик отправляет приемнику снимок своих метрик (при METRICS_PORT), секунд
+METRICS_INTERVAL = 5.0
+
+
+def shard_key(raw):
+    # chat_id события, а если чата нет (inline-запросы и т. п.) — id пользователя
+    for name, event in raw.items():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+    return raw.get('update_id', 0)
+
+
+class WorkerPool:
+    def __init__(self, names, workers=WORKERS):
+        self.names = names
+        self.workers = workers
+        # spawn: обработчик не наследует цикл событий и сокеты процесса-приемника
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = []
+        self._processes = []
+        self._acks = self._context.Queue()
+        # (бот, update_id) -> [future, номер обработчика, бот, payload, попыток, таймер]
+        self._pending = {}
+        # Номер обработчика -> время его недавних перезапусков
+        self._restarts = [[] for _ in range(workers)]
+        self._ready = 0
+        self._all_ready = None
+        self._loop = None
+        self._reader = None
+        self._supervisor = None
+        self._stopping = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._all_ready = asyncio.Event()
+        for index in range(self.workers):
+            self._queues.append(None)
+            self._processes.append(None)
+            self._spawn(index)
+        self._reader = threading.Thread(target=self._read_acks, name='worker-acks', daemon=True)
+        self._reader.start()
+        self._supervisor = asyncio.create_task(self._supervise())
+        await self._all_ready.wait()
+        logging.info("Запущено процессов-обработчиков: %d", self.workers)
+
+    def _spawn(self, index):
+        queue = self._context.Queue()
+        process = self._context.Process(
+            target=worker_main, args=(index + 1, self.names, queue, self._acks),
+            name=f'worker-{index + 1}', daemon=True,
+        )
+        with worker_environment(index + 1, self.workers):
+            process.start()
+        self._queues[index] = queue
+        self._processes[index] = process
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stopping:
+                    self._restart(index)
+
+    def _restart(self, index):
+        # Упавший обработчик запускается заново с новой очередью, и ему
+        # заново отдаются его неподтвержденные обновления в прежнем порядке.
+        # Обновление, на котором обработчик падает больше WORKER_RETRIES раз,
+        # завершается ошибкой, чтобы не ронять его бесконечно
+        dead = self._processes[index]
+        logging.error("%s завершился с кодом %s, перезапуск", dead.name, dead.exitcode)
+        now = time.monotonic()
+        self._restarts[index] = [t for t in self._restarts[index] if now - t < WORKER_RESTART_WINDOW] + [now]
+        self._queues[index].cancel_join_thread()
+        self._queues[index].close()
+        self._spawn(index)
+        for key, pending in list(self._pending.items()):
+            future, worker, name, payload, attempts, timer = pending
+            if worker != index:
+                continue
+            if attempts >= WORKER_RETRIES:
+                del self._pending[key]
+                timer.cancel()
+                if not future.done():
+                    future.set_exception(RuntimeError(f"{dead.name} падает на обновлении {key[1]} бота {name}"))
+                continue
+            pending[4] = attempts + 1
+            self._queues[index].put((name, payload))
+
+    def _read_acks(self):
+        # Подтверждения читаются в отдельном потоке: Queue.get блокирующий
+        while True:
+            message = self._acks.get()
+            if message is None:
+                return
+            if len(message) == 3:
+                # (None, номер обработчика, снимок метрик)
+                self._loop.call_soon_threadsafe(metrics.collect, *message[1:])
+                continue
+            self._loop.call_soon_threadsafe(self._on_ack, *message)
+
+    def _on_ack(self, name, update_id):
+        if name is None:
+            self._ready += 1
+            if self._ready == self.workers:
+                self._all_ready.set()
+            return
+        pending = self._pending.pop((name, update_id), None)
+        if pending is not None:
+            future, timer = pending[0], pending[5]
+            timer.cancel()
+            if not future.done():
+                future.set_result(None)
+
+    def _expire(self, key):
+        pending = self._pending.pop(key, None)
+        if pending is not None and not pending[0].done():
+            pending[0].set_exception(asyncio.TimeoutError(f"обновление {key[1]} бота {key[0]} не обработано "
+                                                          f"за {WORKER_TIMEOUT:g} с"))
+
+    def submit(self, name, raw, payload=None, timeout=WORKER_TIMEOUT):
+        # Future завершается, когда обработчик закончил обработку обновления,
+        # или ошибкой: asyncio.TimeoutError через timeout секунд,
+        # RuntimeError, если обработчик падает на этом обновлении
+        future = self._loop.create_future()
+        if payload is None:
+            payload = json.dumps(raw, ensure_ascii=False)
+        key = (name, raw['update_id'])
+        index = shard_key(raw) % self.workers
+        self._pending[key] = [future, index, name, payload, 0, self._loop.call_later(timeout, self._expire, key)]
+        self._queues[index].put((name, payload))
+        return future
+
+    def failure(self):
+        # Обработчик перезапускался WORKER_RESTARTS раз за WORKER_RESTART_WINDOW
+        # секунд: сам он уже не поднимется (см. health.Watchdog)
+        now = time.monotonic()
+        for index, restarts in enumerate(self._restarts):
+            recent = [t for t in restarts if now - t < WORKER_RESTART_WINDOW]
+            if len(recent) >= WORKER_RESTARTS:
+                return f"worker-{index + 1}: {len(recent)} перезапусков за {WORKER_RESTART_WINDOW} с"
+        return None
+
+    def status(self):
+        now = time.monotonic()
+        pending = [0] * self.workers
+        for item in self._pending.values():
+            pending[item[1]] += 1
+        return {
+            process.name: {
+                'alive': process.is_alive(),
+                'restarts': sum(now - t < WORKER_RESTART_WINDOW for t in self._restarts[index]),
+                'pending': pending[index],
+            }
+            for index, process in enumerate(self._processes)
+        }
+
+    def send_signal(self, signum):
+        for process in self._processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    async def stop(self, timeout=10):
+        self._stopping = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+        for queue in self._queues:
+            queue.put(None)
+        await asyncio.to_thread(self._join, timeout)
+        self._acks.put(None)
+
+    def _join(self, timeout):
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning("%s не завершился за %s с", process.name, timeout)
+                process.terminate()
+
+
+@contextmanager
+def worker_environment(worker_id, workers):
+    # Настройки обработчика передаются через окружение: при запуске spawn
+    # модули common и throttling импортируются раньше, чем вызывается worker_main
+    saved = {name: os.environ.get(name) for name in ('WORKER_ID', 'WORKERS', 'OUTGOING_RATE')}
+    os.environ['WORKER_ID'] = str(worker_id)
+    os.environ['WORKERS'] = str(workers)
+    # Бюджет исходящих вызовов бота делится между обработчиками
+    os.environ['OUTGOING_RATE'] = str(float(os.getenv('OUTGOING_RATE', '25')) / workers)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def worker_main(worker_id, names, queue, acks):
+    # Остановкой управляет процесс-приемник; Ctrl+C приходит всей группе процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f'[w{worker_id}] %(levelname)s:%(name)s:%(message)s', force=True)
+    asyncio.run(Worker(worker_id, names, queue, acks).run())
+
+
+class Worker:
+    def __init__(self, worker_id, names, queue, acks):
+        self.worker_id = worker_id
+        self.modules = {name: importlib.import_module(name) for name in names}
+        self.queue = queue
+        self.acks = acks
+        # Порядок в пределах чата и лимит одновременных обработчиков — как
+        # в однопроцессном режиме, по планировщику на бота
+        self.schedulers = {name: ChatScheduler(name) for name in names}
+        self._tasks = set()
+
+    async def run(self):
+        profiling.install()
+        for module in self.modules.values():
+            await module.dp.emit_startup(bot=module.bot, dispatcher=module.dp, bots=[module.bot],
+                                         **module.dp.workflow_data)
+        self.acks.put((None, None))
+        push = asyncio.create_task(self._push_metrics()) if metrics.METRICS_PORT else None
+        try:
+            while True:
+                message = await asyncio.to_thread(self.queue.get)
+                if message is None:
+                    break
+                self._schedule(*message)
+            if self._tasks:
+                await asyncio.wait(set(self._tasks))
+        finally:
+            if push is not None:
+                push.cancel()
+            for module in self.modules.values():
+                await module.dp.emit_shutdown(bot=module.bot, dispatcher=module.dp, bots=[module.bot],
+                                              **module.dp.workflow_data)
+                await module.dp.storage.close()
+            await get_session().close()
+            profiling.stop()
+
+    async def _push_metrics(self):
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            self.acks.put((None, self.worker_id, metrics.snapshot()))
+
+    def _schedule(self, name, payload):
+        module = self.modules[name]
+        raw = json.loads(payload)
+        update = Update.model_validate(raw, context={'bot': module.bot})
+        task = self.schedulers[name].submit(shard_key(raw), partial(self._process, module, name, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, module, name, update):
+        try:
+            result = await module.dp.feed_update(module.bot, update, dispatcher=module.dp, bots=[module.bot],
+                                                 **module.dp.workflow_data)
+            if isinstance(result, TelegramMethod):
+                await module.dp.silent_call_request(module.bot, result)
+        except Exception:
+            logging.exception("%s: ошибка обработки обновления %d", name, update.update_id)
+        # Подтверждение уходит после записи состояния FSM на диск
+        after_flush(module.dp.storage, partial(self.acks.put, (name, update.update_id)))
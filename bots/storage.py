@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+# Хранилище FSM на SQLite (режим WAL) вместо MemoryStorage: незаконченные
+# анкеты переживают перезапуск контейнера.
+# Чтения обслуживаются из кэша в памяти, а изменения set_state/set_data
+# копятся в буфере и пишутся одной транзакцией раз в flush_interval секунд,
+# поэтому серия сообщений не означает fsync на каждое сообщение.
+# Обновление считается обработанным (удаляется из журнала получения или
+# подтверждается процессу-приемнику) только после сброса, который записал
+# его изменения (after_flush).
+
+
+def after_flush(storage, callback):
+    # callback вызывается, когда сделанные до этого момента изменения FSM
+    # записаны; хранилища без буфера записи вызывают его сразу
+    defer = getattr(storage, 'after_flush', None)
+    if defer is None:
+        callback()
+    else:
+        defer(callback)
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path, flush_interval=0.2):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, "
+            "updated REAL NOT NULL DEFAULT 0)"
+        )
+        # Базы, созданные до появления времени последнего изменения:
+        # существующие сессии считаются активными с момента обновления
+        if 'updated' not in {row[1] for row in self._db.execute("PRAGMA table_info(fsm)")}:
+            self._db.execute("ALTER TABLE fsm ADD COLUMN updated REAL NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE fsm SET updated = ?", (time.time(),))
+        # key -> [state, data]; пустая запись [None, {}] в базе не хранится
+        self._cache = {}
+        # key -> [state, data] для записей, еще не сброшенных на диск
+        self._dirty = {}
+        # Ждут сброса текущего буфера (after_flush)
+        self._waiting = []
+        self._flusher = None
+
+    def _load(self, key):
+        record = self._cache.get(key)
+        if record is None:
+            # Запись могла быть выгружена из кэша до сброса на диск
+            record = self._dirty.get(key)
+        if record is None:
+            row = self._db.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+            record = [row[0], json.loads(row[1])] if row else [None, {}]
+            self._cache[key] = record
+        return record
+
+    def _mark_dirty(self, key, record):
+        self._dirty[key] = record
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self.flush()
+
+    def after_flush(self, callback):
+        if not self._dirty:
+            callback()
+            return
+        self._waiting.append(callback)
+
+    def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        waiting, self._waiting = self._waiting, []
+        now = time.time()
+        rows = [(key, state, json.dumps(data, ensure_ascii=False), now) for key, (state, data) in batch.items()]
+        try:
+            # В режиме WAL с synchronous=NORMAL коммит не делает fsync,
+            # поэтому запись пачки синхронно занимает доли миллисекунды
+            self._write(rows)
+        except sqlite3.Error:
+            logging.exception("Не удалось записать состояния FSM в %s", self.path)
+            # Вернуть записи в буфер, не затирая более новые изменения
+            for key, record in batch.items():
+                self._dirty.setdefault(key, record)
+            self._waiting[:0] = waiting
+            return
+        for callback in waiting:
+            try:
+                callback()
+            except Exception:
+                logging.exception("Ошибка после сброса состояний FSM в %s", self.path)
+
+    def _write(self, rows):
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "DELETE FROM fsm WHERE key = ?",
+                [(key,) for key, state, data, updated in rows if state is None and data == '{}'],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO fsm (key, state, data, updated) VALUES (?, ?, ?, ?)",
+                [row for row in rows if not (row[1] is None and row[2] == '{}')],
+            )
+
+    async def set_state(self, key, state=None):
+        storage_key = self.key_builder.build(key)
+        record = self._load(storage_key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(storage_key, record)
+
+    async def get_state(self, key):
+        return self._load(self.key_builder.build(key))[0]
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        record = self._load(storage_key)
+        record[1] = data.copy()
+        self._mark_dirty(storage_key, record)
+
+    async def get_data(self, key):
+        return self._load(self.key_builder.build(key))[1].copy()
+
+    def discard(self, key):
+        # Выгрузить запись из кэша; несброшенные изменения остаются в буфере
+        self._cache.pop(self.key_builder.build(key), None)
+
+    def purge(self, older_than):
+        # Удалить с диска сессии, не менявшиеся с момента older_than (time.time())
+        self.flush()
+        deleted = self._db.execute("DELETE FROM fsm WHERE updated < ?", (older_than,)).rowcount
+        self._cache.clear()
+        return deleted
+
+    async def close(self):
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+        self.flush()
+        self._db.close()
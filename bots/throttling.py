@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from metrics import BOT_NAMES, OUTGOING_WAITS, THROTTLED
+from outbox import GROUP_CHAT_RATE, PRIVATE_CHAT_RATE, TokenBucket
+
+# Защита от флуда.
+# Входящие обновления: у каждого пользователя свое ведро токенов, общее
+# для всех ботов процесса. Лишние обновления отбрасываются до FSM-обработчиков,
+# пользователь один раз получает предупреждение. Фото одного альбома
+# считаются одним сообщением.
+# Исходящие вызовы: общий бюджет на бота и ограничение на чат. Ответы одному
+# чату не могут занять весь бюджет, а чат администратора обслуживается вне
+# очереди, поэтому уведомления о заявках не ждут за чужими ответами.
+
+# Устойчивая скорость и запас сообщений пользователя; 0 — без ограничения
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '1'))
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', '5'))
+# Ведро простаивающего пользователя удаляется через THROTTLE_TTL секунд,
+# при переполнении — самое давнее
+THROTTLE_TTL = float(os.getenv('THROTTLE_TTL', '600'))
+THROTTLE_MAX_USERS = int(os.getenv('THROTTLE_MAX_USERS', '100000'))
+THROTTLE_MESSAGE = "⏳ Слишком много сообщений. Подождите немного и повторите."
+
+# Общий лимит исходящих сообщений бота в секунду (у Telegram — около 30);
+# 0 — без ограничения. Запас сообщений одного чата: ответы на /start идут подряд
+OUTGOING_RATE = float(os.getenv('OUTGOING_RATE', '25'))
+OUTGOING_CHAT_BURST = int(os.getenv('OUTGOING_CHAT_BURST', '5'))
+# Чаты вне очереди: ADMIN_CHAT_ID и чаты менеджеров из ROUTING_RULES (добавляет common.get_routing)
+PRIORITY_CHATS = {int(chat_id) for chat_id in os.getenv('ADMIN_CHAT_ID', '').split(',') if chat_id.strip()}
+
+
+class UserBucket(TokenBucket):
+    def __init__(self, rate, capacity):
+        super().__init__(rate, capacity)
+        self.media_group = None
+        self.warned = False
+
+
+class BucketMap:
+    # Ведра по ключу в порядке последнего использования: простаивающие
+    # дольше ttl и лишние сверх max_size удаляются с начала
+    def __init__(self, factory, ttl, max_size):
+        self.factory = factory
+        self.ttl = ttl
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def get(self, key, now):
+        buckets = self._buckets
+        while buckets and now - next(iter(buckets.values())).updated > self.ttl:
+            buckets.popitem(last=False)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = self.factory(key)
+            if len(buckets) > self.max_size:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+
+class ThrottlingMiddleware:
+    # Внешний middleware обновлений, один экземпляр на все диспетчеры
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, ttl=THROTTLE_TTL, max_users=THROTTLE_MAX_USERS):
+        self.buckets = BucketMap(lambda user_id: UserBucket(rate, burst), ttl, max_users)
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        now = time.monotonic()
+        bucket = self.buckets.get(user.id, now)
+        message = event.message
+        media_group = message.media_group_id if message is not None else None
+        if media_group is not None and media_group == bucket.media_group:
+            return await handler(event, data)
+        if bucket.delay(now):
+            THROTTLED.inc(BOT_NAMES.get(data['bot'].id, ''))
+            callback = event.callback_query
+            if callback is not None:
+                # Нажатие кнопки подтверждается всегда, иначе клиент крутит
+                # индикатор загрузки на кнопке, пока не выйдет время ответа
+                text = None if bucket.warned else THROTTLE_MESSAGE
+                bucket.warned = True
+                return callback.answer(text)
+            if bucket.warned or message is None:
+                return None
+            bucket.warned = True
+            return message.answer(THROTTLE_MESSAGE)
+        bucket.take(now)
+        bucket.media_group = media_group
+        bucket.warned = False
+        return await handler(event, data)
+
+
+class OutgoingBudget(BaseRequestMiddleware):
+    # Middleware HTTP-сессии: вызовы с chat_id ждут токен общего ведра бота
+    # и ведра чата. Остальные вызовы (getUpdates, setWebhook, ...) не ограничиваются
+    def __init__(self, rate=OUTGOING_RATE, priority_chats=PRIORITY_CHATS, ttl=THROTTLE_TTL,
+                 max_chats=THROTTLE_MAX_USERS):
+        self.rate = rate
+        self.priority_chats = priority_chats
+        self._bots = {}
+        self._chats = BucketMap(self._chat_bucket, ttl, max_chats)
+
+    @staticmethod
+    def _chat_bucket(key):
+        # Скорость — как у Telegram для личных чатов и групп
+        rate = PRIVATE_CHAT_RATE[0] if _is_private(key[1]) else GROUP_CHAT_RATE[0]
+        return TokenBucket(rate, OUTGOING_CHAT_BURST)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is not None:
+            await self.acquire(bot, chat_id)
+        return await make_request(bot, method)
+
+    async def acquire(self, bot, chat_id):
+        total = self._bots.get(bot.id)
+        if total is None:
+            total = self._bots[bot.id] = TokenBucket(self.rate, self.rate)
+        if chat_id in self.priority_chats:
+            # Токен берется в долг: остальные чаты подождут
+            total.take(time.monotonic())
+            return
+        waited = False
+        while True:
+            now = time.monotonic()
+            chat = self._chats.get((bot.id, chat_id), now)
+            delay = max(total.delay(now), chat.delay(now))
+            if not delay:
+                total.take(now)
+                chat.take(now)
+                return
+            if not waited:
+                OUTGOING_WAITS.inc(BOT_NAMES.get(bot.id, str(bot.id)))
+                waited = True
+            await asyncio.sleep(delay)
+
+
+def _is_private(chat_id):
+    # @username бывает только у каналов и групп
+    return isinstance(chat_id, int) and chat_id > 0
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+# Общий для всех ботов профиль пользователя (по Telegram user_id).
+# Пользователь, оставивший заявку в одном боте, в другом не вводит контакт
+# заново: шаг контакта предлагает кнопку с сохраненным значением.
+# Профили лежат в одной SQLite-базе (режим WAL) для всех ботов и процессов.
+# Чтения идут через кэш в памяти процесса (LRU): повторное обращение к
+# профилю — поиск в словаре. Запись из кэша устаревает через
+# USER_PROFILE_TTL секунд, чтобы увидеть изменения из других процессов.
+
+# 0 — профили не сохраняются и кнопка не предлагается
+USER_PROFILES = os.getenv('USER_PROFILES', '1') == '1'
+USER_PROFILE_CACHE = int(os.getenv('USER_PROFILE_CACHE', '10000'))
+USER_PROFILE_TTL = float(os.getenv('USER_PROFILE_TTL', '300'))
+
+
+class UserProfiles:
+    def __init__(self, path, cache_size=USER_PROFILE_CACHE, ttl=USER_PROFILE_TTL):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # Процессы-обработчики пишут в одну базу
+        self._db.execute("PRAGMA busy_timeout=1000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS profiles (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        # user_id -> (время загрузки, профиль); пустой профиль тоже кэшируется
+        self._cache = OrderedDict()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        entry = self._cache.get(user_id)
+        if entry is not None and now - entry[0] < self.ttl:
+            self._cache.move_to_end(user_id)
+            return entry[1]
+        try:
+            row = self._db.execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        except sqlite3.Error:
+            logging.exception("Не удалось прочитать профиль %s", user_id)
+            return entry[1] if entry is not None else {}
+        profile = json.loads(row[0]) if row else {}
+        self._remember(user_id, profile, now)
+        return profile
+
+    def update(self, user_id, **values):
+        profile = self.get(user_id)
+        if all(profile.get(name) == value for name, value in values.items()):
+            return profile
+        profile = {**profile, **values}
+        try:
+            # В режиме WAL с synchronous=NORMAL запись одной строки не делает fsync
+            self._db.execute(
+                "INSERT OR REPLACE INTO profiles (user_id, data, updated) VALUES (?, ?, ?)",
+                (user_id, json.dumps(profile, ensure_ascii=False), time.time()),
+            )
+        except sqlite3.Error:
+            logging.exception("Не удалось сохранить профиль %s", user_id)
+        self._remember(user_id, profile, time.monotonic())
+        return profile
+
+    def _remember(self, user_id, profile, now):
+        self._cache[user_id] = (now, profile)
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def close(self):
+        self._db.close()
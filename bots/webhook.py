@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import os
+
+from aiohttp import web
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from common import get_session
+from polling import DRAIN_TIMEOUT
+from scheduler import ChatScheduler, chat_key
+
+# Режим вебхуков: один aiohttp-сервер принимает обновления всех ботов,
+# каждый бот на своем пути /webhook/<имя бота>.
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Публичный адрес сервера, например https://bots.example.com.
+# Если он не задан, setWebhook не вызывается: так сервер можно
+# проверить локально, отправляя ему записанные обновления POST-запросами.
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '').rstrip('/')
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (символы A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+
+
+def webhook_path(name):
+    return f"/webhook/{name}"
+
+
+def build_app(bots, pool=None):
+    # bots: список пар (имя, модуль бота с атрибутами bot и dp)
+    app = web.Application()
+    for name, module in bots:
+        if pool is not None:
+            # Диспетчер бота работает в процессах-обработчиках: здесь его
+            # startup/shutdown (outbox, сводка, хранилище FSM) не запускаются
+            app.router.add_post(webhook_path(name), _sharded_handler(name, pool))
+        else:
+            # handle_in_background=False: сервер ждет обработчик, и если тот вернул
+            # метод API (return message.answer(...)), ответ уходит прямо в теле
+            # HTTP-ответа на вебхук, без отдельного запроса к api.telegram.org
+            ScheduledRequestHandler(
+                ChatScheduler(name),
+                dispatcher=module.dp,
+                bot=module.bot,
+                handle_in_background=False,
+                secret_token=WEBHOOK_SECRET,
+            ).register(app, path=webhook_path(name))
+            app.on_startup.append(_startup_callback(module))
+            app.on_cleanup.append(_shutdown_callback(module))
+        if WEBHOOK_BASE_URL:
+            app.on_startup.append(_set_webhook_callback(name, module))
+    # Сессия общая для всех ботов и закрывается один раз, после остановки всех диспетчеров
+    app.on_cleanup.append(_close_session)
+    return app
+
+
+def _set_webhook_callback(name, module):
+    async def set_webhook(app):
+        url = WEBHOOK_BASE_URL + webhook_path(name)
+        await module.bot.set_webhook(
+            url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=module.dp.resolve_used_update_types(),
+        )
+        logging.info("Вебхук %s установлен: %s", name, url)
+    return set_webhook
+
+
+class ScheduledRequestHandler(SimpleRequestHandler):
+    # Обработка вебхука через планировщик чатов (scheduler.py): обновления
+    # одного чата по порядку, одновременно не больше HANDLER_CONCURRENCY
+    def __init__(self, scheduler, **kwargs):
+        super().__init__(**kwargs)
+        self.scheduler = scheduler
+
+    async def close(self):
+        # SimpleRequestHandler закрывает сессию бота в on_shutdown, до того как
+        # сервер дождется начатых обработчиков, а сессия общая для всех ботов:
+        # ее закрывает _close_session в on_cleanup
+        pass
+
+    async def _handle_request(self, bot, request):
+        update = Update.model_validate(await request.json(loads=bot.session.json_loads), context={'bot': bot})
+        result = await self.scheduler.submit(
+            chat_key(update), lambda: self.dispatcher.feed_webhook_update(bot, update, **self.data),
+        )
+        return web.Response(body=self._build_response_writer(bot=bot, result=result))
+
+
+def _sharded_handler(name, pool):
+    # Обновление уходит в процесс-обработчик; 200 отправляется после обработки,
+    # поэтому при падении Telegram повторит вебхук
+    async def handle(request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401, text='Unauthorized')
+        payload = await request.text()
+        try:
+            await pool.submit(name, json.loads(payload), payload)
+        except (asyncio.TimeoutError, RuntimeError) as e:
+            # Telegram повторит вебхук, на который не ответили 200
+            logging.error("%s: обновление не обработано: %s", name, e)
+            return web.Response(status=500)
+        return web.json_response({})
+    return handle
+
+
+def _startup_callback(module):
+    async def startup(app):
+        await module.dp.emit_startup(bot=module.bot, app=app, dispatcher=module.dp, **module.dp.workflow_data)
+    return startup
+
+
+def _shutdown_callback(module):
+    # on_cleanup вызывается после завершения начатых обработчиков (в отличие
+    # от on_shutdown, куда его ставит setup_application): outbox и сборщик
+    # сессий останавливаются, когда им уже никто не пишет, а буфер состояний
+    # FSM сбрасывается на диск последним
+    async def shutdown(app):
+        try:
+            await module.dp.emit_shutdown(bot=module.bot, app=app, dispatcher=module.dp, **module.dp.workflow_data)
+        finally:
+            await module.dp.storage.close()
+    return shutdown
+
+
+async def _close_session(app):
+    await get_session().close()
+
+
+async def run_webhook(bots, pool=None):
+    # При остановке сервер перестает принимать запросы и ждет начатые
+    # обработчики не дольше DRAIN_TIMEOUT. Необработанный вебхук Telegram
+    # отправит повторно, а повтор заявки отсечет ключ идемпотентности outbox
+    runner = web.AppRunner(build_app(bots, pool), shutdown_timeout=DRAIN_TIMEOUT)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logging.info("Сервер вебхуков слушает %s:%d", WEBHOOK_HOST, WEBHOOK_PORT)
+    return runner
@@ -0,0 +1,30 @@
+import os
+import socket
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули ботов импортируются так же, как в launcher.py: плоско из bots/,
+# фейковый Bot API — из tools/
+sys.path[:0] = [os.path.join(ROOT, 'bots'), os.path.join(ROOT, 'tools')]
+
+# Настройки читаются при импорте модулей ботов, поэтому задаются здесь,
+# до импорта тестов
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bots-tests-')
+os.environ['FSM_STORAGE'] = 'memory'
+os.environ['THROTTLE_RATE'] = '0'
+os.environ['OUTGOING_RATE'] = '0'
+os.environ.pop('ROUTING_RULES', None)
+os.environ.pop('DIGEST_INTERVAL', None)
+os.environ.pop('WORKERS', None)
+os.environ.pop('WORKER_ID', None)
+
+
+@pytest.fixture
+def port():
+    # Свободный порт для фейкового Bot API
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,108 @@
+import asyncio
+import itertools
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, Update
+
+from fake_api import FakeBotAPI
+from forms import BACK, Field, FormEngine, FormSchema
+from outbox import Outbox
+
+TOKEN = '100001:forms-test'
+ADMIN_CHAT_ID = 1
+USER_ID = 2_000_000
+
+kind_kb = ReplyKeyboardMarkup(resize_keyboard=True, keyboard=[
+    [KeyboardButton(text="Квартира"), KeyboardButton(text="Дом")],
+    [KeyboardButton(text=BACK)],
+])
+
+schema = FormSchema(
+    name='TEST_FORM',
+    states_group='TestForm',
+    welcome=["Добро пожаловать!"],
+    fields=[
+        Field('property_type', "Что хотите продать?", keyboard=kind_kb,
+              choices=("Квартира", "Дом"), choice_error="Выберите вариант на клавиатуре."),
+        Field('location', "Где находится объект?"),
+        Field('contact', "Оставьте телефон и имя:"),
+    ],
+    back_first="Вы на первом шаге.",
+    back="Вернулись на предыдущий шаг.",
+    summary_title="Новая заявка:",
+    summary=[("Тип", 'property_type'), ("Адрес", 'location'), ("Контакт", 'contact')],
+    thanks="Спасибо! Заявка отправлена.",
+)
+
+
+class Chat:
+    # Пользователь, который пишет боту: каждое сообщение — новое обновление
+    def __init__(self, bot, dp):
+        self.bot = bot
+        self.dp = dp
+        self.ids = itertools.count(1)
+
+    async def send(self, text):
+        message_id = next(self.ids)
+        update = Update.model_validate({'update_id': message_id, 'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': USER_ID, 'type': 'private'},
+            'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Test'},
+            'text': text,
+        }}, context={'bot': self.bot})
+        # В режиме reply ответ на шаг возвращается обработчиком
+        return await self.dp.feed_update(self.bot, update)
+
+    async def state(self):
+        return await self.dp.fsm.get_context(self.bot, USER_ID, USER_ID).get_state()
+
+
+def test_form_steps_back_and_finish(tmp_path, port):
+    async def scenario():
+        api = FakeBotAPI()
+        url = await api.start(port=port)
+        bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+        outbox = Outbox(str(tmp_path / 'outbox.sqlite3'))
+        engine = FormEngine(schema, outbox, ADMIN_CHAT_ID, mode='reply')
+        dp = Dispatcher()
+        dp.include_router(engine.router)
+        chat = Chat(bot, dp)
+        try:
+            # /start: приветствие отправляется сразу, первый вопрос — ответом обработчика
+            reply = await chat.send('/start')
+            assert api.calls['sendMessage'] == 1
+            assert reply.text == "Что хотите продать?"
+            assert await chat.state() == 'TestForm:property_type'
+
+            # Назад с первого шага и ответ не из списка оставляют на месте
+            assert (await chat.send(BACK)).text == "Вы на первом шаге."
+            assert (await chat.send("Гараж")).text == "Выберите вариант на клавиатуре."
+            assert await chat.state() == 'TestForm:property_type'
+
+            assert (await chat.send("Квартира")).text == "Где находится объект?"
+            assert await chat.state() == 'TestForm:location'
+
+            # Назад возвращает на предыдущий шаг, и ответ на него можно изменить
+            assert (await chat.send(BACK)).text == "Вернулись на предыдущий шаг."
+            assert await chat.state() == 'TestForm:property_type'
+            await chat.send("Дом")
+            assert (await chat.send("Казань, центр")).text == "Оставьте телефон и имя:"
+
+            reply = await chat.send("Иван, +7 900 000-00-00")
+            assert reply.text == "Спасибо! Заявка отправлена."
+            assert await chat.state() is None
+        finally:
+            await bot.session.close()
+            await api.stop()
+
+        # Заявка ушла в очередь уведомлений администратору с последними ответами
+        assert outbox.backlog == 1
+        item = outbox._queues[ADMIN_CHAT_ID][0]
+        assert item.payload['text'] == ("Новая заявка:\nТип: Дом\nАдрес: Казань, центр\n"
+                                        "Контакт: Иван, +7 900 000-00-00")
+
+    asyncio.run(scenario())
@@ -0,0 +1,86 @@
+import asyncio
+import sqlite3
+
+import outbox as outbox_module
+from outbox import Outbox
+
+ADMIN_CHAT_ID = 1
+
+
+class FlakyBot:
+    # Первые failures вызовов send_message падают, остальные записываются
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sent = []
+
+    async def send_message(self, **payload):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("сеть недоступна")
+        self.sent.append(payload)
+
+
+async def wait_for(condition, timeout=5):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+def test_enqueue_with_known_key_is_ignored_after_restart(tmp_path):
+    async def scenario():
+        path = str(tmp_path / 'outbox.sqlite3')
+        outbox = Outbox(path)
+        assert outbox.enqueue('send_message', ADMIN_CHAT_ID, key='lead:1', text="Заявка")
+        assert not outbox.enqueue('send_message', ADMIN_CHAT_ID, key='lead:1', text="Заявка")
+        # Неотправленное сообщение читается с диска, и ключ по-прежнему известен
+        restarted = Outbox(path)
+        assert restarted.backlog == 1
+        assert not restarted.enqueue('send_message', ADMIN_CHAT_ID, key='lead:1', text="Заявка")
+        assert restarted.enqueue('send_message', ADMIN_CHAT_ID, key='lead:2', text="Другая заявка")
+        assert restarted.backlog == 2
+
+    asyncio.run(scenario())
+
+
+def test_failed_delivery_is_retried_once_delivered(tmp_path, monkeypatch):
+    # Без задержки между попытками тест не ждет экспоненциальную паузу
+    monkeypatch.setattr(outbox_module, 'MAX_BACKOFF', 0)
+
+    async def scenario():
+        path = str(tmp_path / 'outbox.sqlite3')
+        outbox = Outbox(path)
+        outbox.enqueue('send_message', ADMIN_CHAT_ID, key='lead:1', text="Заявка")
+        bot = FlakyBot(failures=2)
+        await outbox.start(bot)
+        await wait_for(lambda: bot.sent)
+        await outbox.stop()
+        assert bot.sent == [{'chat_id': ADMIN_CHAT_ID, 'text': "Заявка"}]
+        assert outbox.backlog == 0
+        with sqlite3.connect(path) as db:
+            assert db.execute("SELECT status, attempts FROM outbox").fetchall() == [('sent', 2)]
+        # Отправленное сообщение с тем же ключом не уходит второй раз
+        assert not Outbox(path).enqueue('send_message', ADMIN_CHAT_ID, key='lead:1', text="Заявка")
+
+    asyncio.run(scenario())
+
+
+def test_message_is_dropped_after_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox_module, 'MAX_BACKOFF', 0)
+    monkeypatch.setattr(outbox_module, 'MAX_ATTEMPTS', 3)
+
+    async def scenario():
+        path = str(tmp_path / 'outbox.sqlite3')
+        outbox = Outbox(path)
+        outbox.enqueue('send_message', ADMIN_CHAT_ID, key='lead:1', text="Заявка")
+        outbox.enqueue('send_message', ADMIN_CHAT_ID, key='lead:2', text="Следующая")
+        bot = FlakyBot(failures=3)
+        await outbox.start(bot)
+        await wait_for(lambda: bot.sent)
+        await outbox.stop()
+        # Сообщение, исчерпавшее попытки, не задерживает следующие в том же чате
+        assert [payload['text'] for payload in bot.sent] == ["Следующая"]
+        with sqlite3.connect(path) as db:
+            rows = db.execute("SELECT key, status FROM outbox ORDER BY id").fetchall()
+        assert rows == [('lead:1', 'failed'), ('lead:2', 'sent')]
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+import asyncio
+import sqlite3
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import polling
+from fake_api import FakeBotAPI
+from polling import Poller
+
+TOKEN = '100002:polling-test'
+USER_ID = 2_000_001
+
+
+def message_update(text):
+    return {'message': {
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': USER_ID, 'type': 'private'},
+        'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Test'},
+        'text': text,
+    }}
+
+
+def logged_updates(path):
+    with sqlite3.connect(path) as db:
+        return [row[0] for row in db.execute("SELECT update_id FROM updates")]
+
+
+async def wait_for(condition, timeout=5):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+def test_update_interrupted_by_stop_is_processed_after_restart(tmp_path, port, monkeypatch):
+    # Остановка не ждет зависший обработчик дольше DRAIN_TIMEOUT, а фейковый
+    # API при остановке не ждет прерванный long polling
+    monkeypatch.setattr(polling, 'DRAIN_TIMEOUT', 0.1)
+    monkeypatch.setattr(polling, 'POLL_TIMEOUT', 1)
+    path = str(tmp_path / 'updates.sqlite3')
+
+    async def scenario():
+        api = FakeBotAPI()
+        url = await api.start(port=port)
+        bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+        handled = []
+        hang = True
+
+        dp = Dispatcher()
+
+        @dp.message()
+        async def handle(message):
+            handled.append(message.text)
+            if hang:
+                await asyncio.Event().wait()
+
+        try:
+            update_id = api.push_update(TOKEN, message_update("заявка"))
+            poller = Poller('TEST', bot, dp, path)
+            run = asyncio.create_task(poller.run())
+            await wait_for(lambda: handled)
+            poller.stop()
+            await run
+            # Обработчик прерван: обновление осталось в журнале, хотя Telegram
+            # его уже не отдаст (offset сдвинут)
+            assert logged_updates(path) == [update_id]
+            assert poller.offset == update_id + 1
+
+            hang = False
+            handled.clear()
+            poller = Poller('TEST', bot, dp, path)
+            assert poller.offset == update_id + 1
+            run = asyncio.create_task(poller.run())
+            await wait_for(lambda: handled)
+            await wait_for(lambda: not logged_updates(path))
+            poller.stop()
+            await run
+            # Обновление обработано заново ровно один раз
+            assert handled == ["заявка"]
+        finally:
+            await bot.session.close()
+            await api.stop()
+
+    asyncio.run(scenario())
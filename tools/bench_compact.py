@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import gc
+import importlib
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots'))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from load import ALL_BOTS, TOKEN_VARS
+
+# Память на незаконченную анкету: MemoryStorage против CompactStorage
+# (compact.py) на N одновременных сессиях всех пяти ботов. Каждый пользователь
+# остановился на случайном шаге своей анкеты; ответы из вариантов — свежие
+# копии текста кнопки, как их получает бот из message.text, остальные ответы
+# уникальны. Печатает байты на сессию и время чтения/записи данных сессии.
+#
+#   python tools/bench_compact.py --sessions 100000 1000000
+
+FIRST_USER_ID = 5_000_000_000
+
+
+def load_forms():
+    # Схемы анкет берутся из модулей ботов; импорт регистрирует их в compact.py
+    os.environ.setdefault('ADMIN_CHAT_ID', '1')
+    os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench-compact-')
+    os.environ['FSM_STORAGE'] = 'memory'
+    for number, name in enumerate(ALL_BOTS, start=1):
+        os.environ[TOKEN_VARS[name]] = f'{100000 + number}:bench-{name}'
+    forms = []
+    for name in ALL_BOTS:
+        module = importlib.import_module(name)
+        states = [f"{module.form.states_group}:{form_field.name}" for form_field in module.form.fields]
+        forms.append((name, module.bot.id, module.form.fields, states))
+    return forms
+
+
+def answer(rng, form_field, user_id):
+    from compact import field_choices
+    choices = [choice for choice in field_choices(form_field) or () if choice != "🔙 Назад"]
+    if choices:
+        # Новый объект строки, как текст входящего сообщения
+        return rng.choice(choices).encode('utf-8').decode('utf-8')
+    if form_field.photo:
+        return [f"AgACAgIAAxkBAAI{user_id}{n}FmZ2xvYmFsLXBob3RvLWlkLWV4YW1wbGU" for n in range(rng.randint(1, 3))]
+    if form_field.name == 'contact':
+        return f"Иван Петров, +7 900 {user_id % 10 ** 7:07d}"
+    return f"Ответ {rng.randint(1, 10 ** 6)} на вопрос {form_field.name}"
+
+
+def sessions(forms, count, seed=1):
+    rng = random.Random(seed)
+    for number in range(count):
+        user_id = FIRST_USER_ID + number
+        name, bot_id, fields, states = forms[number % len(forms)]
+        step = rng.randrange(1, len(fields))
+        data = {form_field.name: answer(rng, form_field, user_id) for form_field in fields[:step]}
+        yield StorageKey(bot_id=bot_id, chat_id=user_id, user_id=user_id), states[step], data
+
+
+def create_storages(factory, forms):
+    # Как в боте: у каждого бота свое хранилище (common.create_storage)
+    return {bot_id: factory(name) for name, bot_id, fields, states in forms}
+
+
+async def fill(storages, forms, count):
+    for key, state, data in sessions(forms, count):
+        storage = storages[key.bot_id]
+        await storage.set_state(key, state)
+        await storage.set_data(key, data)
+
+
+async def measure_memory(factory, forms, count):
+    gc.collect()
+    tracemalloc.start()
+    storages = create_storages(factory, forms)
+    await fill(storages, forms, count)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used
+
+
+async def measure_speed(factory, forms, count):
+    # Один шаг анкеты: get_state, get_data, set_data с новым ответом, set_state
+    storages = create_storages(factory, forms)
+    await fill(storages, forms, count)
+    keys = [(storages[key.bot_id], key, state) for key, state, data in sessions(forms, count, seed=2)]
+    started = time.perf_counter()
+    for storage, key, state in keys:
+        await storage.get_state(key)
+        data = await storage.get_data(key)
+        data['comment'] = "Ответ"
+        await storage.set_data(key, data)
+        await storage.set_state(key, state)
+    return (time.perf_counter() - started) / len(keys)
+
+
+async def bench(counts, speed_sessions):
+    forms = load_forms()
+    from compact import CompactStorage
+    storages = {'MemoryStorage': lambda name: MemoryStorage(), 'CompactStorage': CompactStorage}
+    print(f"{'сессий':>9} {'хранилище':<15} {'МБ':>9} {'байт/сессия':>12}")
+    for count in counts:
+        results = {}
+        for label, factory in storages.items():
+            results[label] = await measure_memory(factory, forms, count)
+            print(f"{count:>9} {label:<15} {results[label] / 2 ** 20:>9.1f} {results[label] / count:>12.0f}")
+        print(f"{'':>9} экономия {1 - results['CompactStorage'] / results['MemoryStorage']:.0%}")
+    for label, factory in storages.items():
+        elapsed = await measure_speed(factory, forms, speed_sessions)
+        print(f"{label}: шаг анкеты {elapsed * 1e6:.1f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FSM memory per session: MemoryStorage vs CompactStorage")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--speed-sessions', type=int, default=100000, help="sessions for the timing run")
+    args = parser.parse_args()
+    asyncio.run(bench(args.sessions, args.speed_sessions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots'))
+
+from dedup import DUPLICATE, PROBABLE_DUPLICATE, Deduplicator, fingerprint
+
+# Память и время проверки индекса повторов на миллионе отпечатков:
+# - построение отпечатка из полей анкеты (нормализация телефона и текста),
+# - проверка новых заявок (вставка в LRU и фильтр Блума),
+# - проверка повторов, которые еще в LRU, и тех, что уже вытеснены в фильтр,
+# - доля ложных срабатываний фильтра, заполненного ровно до емкости
+#   (DEDUP_BLOOM_CAPACITY = --count): новые ключи только проверяются, не добавляются.
+
+
+def leads(count, seed):
+    rnd = random.Random(seed)
+    for number in range(count):
+        phone = f'+7 9{rnd.randrange(10 ** 9):09d}'
+        yield f'Клиент {number}, {phone}', ['1. Квартира', f'Район {rnd.randrange(500)}']
+
+
+def bench(count, lru_size):
+    started = time.perf_counter()
+    keys = [fingerprint('BOT_P', contact, values) for contact, values in leads(count, seed=1)]
+    print(f"Отпечаток: {(time.perf_counter() - started) / count * 1e6:.2f} мкс на заявку")
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    deduplicator = Deduplicator(window=24 * 3600, lru_size=lru_size, bloom_capacity=count)
+    started = time.perf_counter()
+    for key in keys:
+        deduplicator.check(key)
+    inserted = time.perf_counter() - started
+    # ru_maxrss в Linux — килобайты
+    memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) * 1024
+    bloom = len(deduplicator._bloom.bits)
+    print(f"Новые заявки: {inserted / count * 1e6:.2f} мкс на проверку; "
+          f"прирост пикового RSS {memory / 2 ** 20:.1f} МБ (фильтр {bloom / 2 ** 20:.1f} МБ, "
+          f"LRU {len(deduplicator._recent)} записей)")
+
+    # Ложные срабатывания меряются до проверок повторов: они добавляют в фильтр
+    # вытесненные ключи заново, а новые ключи здесь не добавляются вовсе
+    fresh = [fingerprint('BOT_P', contact, values) for contact, values in leads(100000, seed=2)]
+    bloom, previous = deduplicator._bloom, deduplicator._previous_bloom
+    false_positives = sum(key in bloom or key in previous for key in fresh)
+    print(f"Ложные срабатывания фильтра на {count} ключах (емкость {count}): "
+          f"{false_positives / len(fresh):.4%}")
+
+    # Последние lru_size отпечатков еще в LRU, более ранние вытеснены в фильтр
+    sample = keys[-min(lru_size, count):][:100000]
+    started = time.perf_counter()
+    duplicates = sum(deduplicator.check(key)[0] == DUPLICATE for key in sample)
+    print(f"Повторы из LRU: {(time.perf_counter() - started) / len(sample) * 1e6:.2f} мкс; "
+          f"найдено {duplicates} из {len(sample)}")
+
+    evicted = keys[:max(0, count - lru_size)][:100000]
+    if not evicted:
+        print("Повторы из фильтра: все отпечатки поместились в LRU (--count <= --lru-size)")
+        return
+    started = time.perf_counter()
+    probable = sum(deduplicator.check(key)[0] == PROBABLE_DUPLICATE for key in evicted)
+    print(f"Повторы из фильтра: {(time.perf_counter() - started) / len(evicted) * 1e6:.2f} мкс; "
+          f"найдено {probable} из {len(evicted)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Duplicate lead index benchmark")
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--lru-size', type=int, default=200000)
+    args = parser.parse_args()
+    bench(args.count, args.lru_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots'))
+
+from leadindex import LeadIndex
+from parsing import parse_area, parse_area_mention, parse_lead, parse_money, parse_term
+
+# Скорость разбора цены, площади и срока на корпусе ответов в том виде, как их
+# пишут пользователи, и выборки по вторичному индексу против полного перебора.
+#
+#   python tools/bench_parsing.py --corpus 200000 --leads 50000
+
+TYPES = ["Квартира", "Дом", "Дача", "Участок", "Коммерческая недвижимость"]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Тула", "Сочи", "Краснодар", "Екатеринбург", "Новосибирск"]
+DISTRICTS = ["Центральный", "Северный", "Южный", "Ленинский", "Заречный", "Октябрьский", "Приморский"]
+
+
+def money(rng):
+    value = rng.choice([rng.randint(2, 30), round(rng.uniform(1.5, 25), 1)])
+    return rng.choice([
+        lambda: f"{value} млн",
+        lambda: f"{str(value).replace('.', ',')} млн руб",
+        lambda: f"от {value} до {value + rng.randint(1, 3)} млн",
+        lambda: f"{value}-{value + 1} млн",
+        lambda: f"до {value} миллионов",
+        lambda: f"{int(value * 1e6):,}".replace(',', ' '),
+        lambda: f"{int(value * 1000)} тыс",
+        lambda: f"{value}кк",
+        lambda: "договорная",
+    ])()
+
+
+def area(rng):
+    value = rng.randint(18, 250)
+    return rng.choice([
+        lambda: f"{value} кв.м",
+        lambda: f"{value}м2",
+        lambda: f"{value}",
+        lambda: f"{value}-{value + 20} м²",
+        lambda: f"{rng.randint(4, 30)} соток",
+    ])()
+
+
+def details(rng):
+    return f"{rng.randint(1, 4)} комнаты, {area(rng)}, {rng.randint(1, 25)} этаж"
+
+
+def term(rng):
+    return rng.choice([
+        lambda: f"{rng.randint(1, 11)} месяцев",
+        lambda: f"{rng.randint(1, 5)} год",
+        lambda: f"{rng.randint(1, 3)}-{rng.randint(4, 6)} года",
+        lambda: "полгода",
+        lambda: "долгосрочно",
+    ])()
+
+
+def lead(rng):
+    return {
+        'bot': rng.choice(['BOT_P', 'BOT_PR']),
+        'data': {
+            'property_type': rng.choice(TYPES),
+            'location': f"{rng.choice(CITIES)}, {rng.choice(DISTRICTS)} район",
+            'details': details(rng),
+            'price': money(rng),
+            'contact': f"Иван +7900{rng.randint(1000000, 9999999)}",
+        },
+    }
+
+
+def measure(label, parse, corpus):
+    started = time.perf_counter()
+    parsed = sum(parse(text) is not None for text in corpus)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<20} {len(corpus) / elapsed:>12,.0f} строк/с   разобрано {parsed / len(corpus):.1%}")
+
+
+def scan(records, kind, city, low, high):
+    # Тот же запрос перебором: разобранные значения уже в записи, как в журнале
+    for record in records:
+        data = record['data']
+        price = record['parsed'].get('price')
+        if data['property_type'] == kind and city in data['location'] and price \
+                and (price[0] or 0) <= high and (price[1] or float('inf')) >= low:
+            yield record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Free-text number parsing and lead index benchmark")
+    parser.add_argument('--corpus', type=int, default=200000, help="strings per parser")
+    parser.add_argument('--leads', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    measure("parse_money", parse_money, [money(rng) for _ in range(args.corpus)])
+    measure("parse_area", parse_area, [area(rng) for _ in range(args.corpus)])
+    measure("parse_area_mention", parse_area_mention, [details(rng) for _ in range(args.corpus)])
+    measure("parse_term", parse_term, [term(rng) for _ in range(args.corpus)])
+
+    records = [lead(rng) for _ in range(args.leads)]
+    started = time.perf_counter()
+    for record in records:
+        record['parsed'] = parse_lead(record['data'])
+    print(f"parse_lead: {args.leads / (time.perf_counter() - started):,.0f} заявок/с")
+    started = time.perf_counter()
+    index = LeadIndex().build(records)
+    print(f"Индекс по {len(index)} заявкам построен за {time.perf_counter() - started:.2f} с")
+
+    queries = [(rng.choice(TYPES), rng.choice(CITIES), rng.randint(2, 10) * 1e6) for _ in range(args.queries)]
+    for label, run in (
+        ("индекс", lambda kind, city, low: list(index.query(kind=kind, region=city, price=(low, low + 2e6)))),
+        ("перебор", lambda kind, city, low: list(scan(records, kind, city, low, low + 2e6))),
+    ):
+        started = time.perf_counter()
+        found = sum(len(run(*query)) for query in queries)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<8} {elapsed / len(queries) * 1000:8.3f} мс на запрос, найдено в среднем {found / len(queries):.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots'))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from sessions import SessionStorage
+
+# Память FSM под постоянным потоком брошенных анкет: каждую минуту (по
+# виртуальным часам) приходят новые пользователи, отвечают на пару вопросов
+# и уходят. MemoryStorage растет линейно, SessionStorage с TTL держит
+# примерно постоянный объем — только сессии последних TTL секунд.
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def abandon(storage, user_id):
+    key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+    await storage.get_state(key)
+    await storage.set_state(key, 'SaleForm:property_type')
+    await storage.update_data(key, {'property_type': 'Квартира'})
+    await storage.get_state(key)
+    await storage.set_state(key, 'SaleForm:location')
+    await storage.update_data(key, {'location': 'Москва, Тверская ул., д. 1'})
+
+
+async def run(storage, clock, minutes, per_minute):
+    # Объем памяти, занятой хранилищем, после каждой минуты
+    usage = []
+    tracemalloc.start()
+    for minute in range(minutes):
+        for user in range(per_minute):
+            await abandon(storage, minute * per_minute + user)
+        if isinstance(storage, SessionStorage):
+            await storage.sweep()
+        usage.append(tracemalloc.get_traced_memory()[0])
+        clock.now += 60
+    tracemalloc.stop()
+    return usage
+
+
+async def bench(minutes, per_minute, ttl, max_sessions):
+    memory = await run(MemoryStorage(), Clock(), minutes, per_minute)
+    clock = Clock()
+    storage = SessionStorage(MemoryStorage(), 'bench', ttl=ttl, max_sessions=max_sessions, remind_after=0, clock=clock)
+    bounded = await run(storage, clock, minutes, per_minute)
+
+    print(f"Брошенных анкет в минуту: {per_minute}; TTL {ttl:.0f} с; лимит {max_sessions}")
+    print(f"{'минута':>7} {'MemoryStorage, МБ':>18} {'SessionStorage, МБ':>19}")
+    step = max(1, minutes // 10)
+    for minute in range(step - 1, minutes, step):
+        print(f"{minute + 1:>7} {memory[minute] / 2 ** 20:>18.1f} {bounded[minute] / 2 ** 20:>19.1f}")
+    print(f"Сессий в SessionStorage в конце: {len(storage)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FSM session memory under abandoned-form traffic")
+    parser.add_argument('--minutes', type=int, default=120)
+    parser.add_argument('--per-minute', type=int, default=500)
+    parser.add_argument('--ttl', type=float, default=1800)
+    parser.add_argument('--max-sessions', type=int, default=50000)
+    args = parser.parse_args()
+    asyncio.run(bench(args.minutes, args.per_minute, args.ttl, args.max_sessions))
+
+
+if __name__ == '__main__':
+    main()
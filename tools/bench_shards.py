@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import signal
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots'))
+
+from fake_api import FakeBotAPI
+from load import ALL_BOTS, FIRST_USER_ID, Simulator, configure_environment
+
+# Масштабирование обработки по процессам: launcher.py запускается отдельным
+# процессом с WORKERS=1, 2, ... N против фейкового Bot API, и одни и те же
+# виртуальные пользователи проходят анкеты. Печатает updates/sec для каждого N.
+# Выигрыш виден, когда ядер не меньше N + 1 (приемник и фейковый API тоже
+# занимают процессор).
+#
+#   python tools/bench_shards.py --workers 1 2 4 --users 200
+
+LAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots', 'launcher.py')
+
+
+async def measure(api, modules, workers, args):
+    data_dir = tempfile.mkdtemp(prefix=f'shards-{workers}-')
+    env = dict(os.environ, DATA_DIR=data_dir, WORKERS=str(workers), BOTS=','.join(args.bots), POLL_TIMEOUT='1')
+    calls = api.calls['getUpdates']
+    process = await asyncio.create_subprocess_exec(sys.executable, LAUNCHER, env=env, stderr=asyncio.subprocess.DEVNULL)
+    # Приемник начинает getUpdates, когда все обработчики готовы
+    while api.calls['getUpdates'] < calls + len(modules):
+        await asyncio.sleep(0.1)
+
+    simulator = Simulator(api, args.back_rate, args.timeout)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulator.conversation(module, FIRST_USER_ID + user)
+        for module in modules
+        for user in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+    process.send_signal(signal.SIGTERM)
+    await process.wait()
+    return simulator.updates / elapsed, simulator.lost
+
+
+async def run(args):
+    api = FakeBotAPI()
+    api_url = await api.start(port=args.port)
+    # Модули ботов нужны здесь только ради схем анкет
+    configure_environment(api_url, tempfile.mkdtemp(prefix='shards-'), 'sqlite')
+    modules = [importlib.import_module(name) for name in args.bots]
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"Боты: {', '.join(args.bots)}; пользователей на бота: {args.users}; ядер: {os.cpu_count()}")
+    baseline = None
+    for workers in args.workers:
+        throughput, lost = await measure(api, modules, workers, args)
+        baseline = baseline or throughput
+        print(f"WORKERS={workers}: {throughput:8.1f} updates/sec  x{throughput / baseline:.2f}  потеряно {lost}")
+    await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update processing throughput by worker process count")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=100, help="virtual users per bot")
+    parser.add_argument('--bots', nargs='+', default=ALL_BOTS, choices=ALL_BOTS)
+    parser.add_argument('--back-rate', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--port', type=int, default=8082)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
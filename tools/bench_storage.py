@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots'))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from storage import SQLiteStorage
+
+# Сравнение SQLiteStorage с MemoryStorage:
+# - стоимость одного шага анкеты (get_state + update_data + set_state),
+# - время восстановления всех сессий после перезапуска процесса.
+
+STATES = ['SaleForm:property_type', 'SaleForm:location', 'SaleForm:details', 'SaleForm:price', 'SaleForm:contact']
+
+
+def keys(users):
+    return [StorageKey(bot_id=1, chat_id=user, user_id=user) for user in range(users)]
+
+
+async def run_updates(storage, users, steps):
+    started = time.perf_counter()
+    for step in range(steps):
+        for key in keys(users):
+            await storage.get_state(key)
+            await storage.update_data(key, {f'field{step}': 'Квартира в центре, 54 м²'})
+            await storage.set_state(key, STATES[step % len(STATES)])
+            # Как и в боте, между обновлениями цикл событий успевает сбросить буфер
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    return elapsed / (users * steps)
+
+
+async def bench(users, steps):
+    memory = await run_updates(MemoryStorage(), users, steps)
+    print(f"MemoryStorage: {memory * 1e6:8.1f} мкс на шаг")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'fsm.sqlite3')
+        storage = SQLiteStorage(path)
+        sqlite = await run_updates(storage, users, steps)
+        started = time.perf_counter()
+        await storage.close()
+        final_flush = time.perf_counter() - started
+        print(f"SQLiteStorage: {sqlite * 1e6:8.1f} мкс на шаг "
+              f"(+{(sqlite - memory) * 1e6:.1f} мкс), финальный сброс {final_flush * 1e3:.1f} мс")
+
+        # Восстановление: новый экземпляр читает все сессии с диска
+        started = time.perf_counter()
+        storage = SQLiteStorage(path)
+        opened = time.perf_counter() - started
+        restored = 0
+        for key in keys(users):
+            if await storage.get_state(key) is not None:
+                restored += 1
+        recovered = time.perf_counter() - started
+        await storage.close()
+        print(f"Восстановление: открытие {opened * 1e3:.1f} мс, "
+              f"{restored} сессий прочитано за {recovered * 1e3:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FSM storage benchmark")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--steps', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(bench(args.users, args.steps))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+# Локальная замена Telegram Bot API для нагрузочных тестов без сети.
+# Поддерживает getUpdates (long polling), sendMessage, sendMediaGroup и
+# ответы-заглушки на остальные методы, с настраиваемой задержкой и
+# случайными ответами 429 Too Many Requests.
+# Боты подключаются к нему через TELEGRAM_API_URL=http://127.0.0.1:<port>
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.app = web.Application()
+        self.app.router.add_route('POST', '/bot{token}/{method}', self.handle)
+        self._updates = defaultdict(list)
+        self._waiters = defaultdict(asyncio.Event)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.calls = defaultdict(int)
+        self.throttled = 0
+        # Вызывается для каждого сообщения бота: (token, chat_id, method, params)
+        self.on_message = None
+
+    async def start(self, host='127.0.0.1', port=8081):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push_update(self, token, update):
+        update.setdefault('update_id', next(self._update_ids))
+        self._updates[token].append(update)
+        self._waiters[token].set()
+        return update['update_id']
+
+    async def handle(self, request):
+        token = request.match_info['token']
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if method != 'getUpdates':
+            delay = self.latency + random.uniform(0, self.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+            if self.error_rate and random.random() < self.error_rate:
+                self.throttled += 1
+                return web.json_response({
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                })
+        handler = getattr(self, f'api_{method}', None)
+        result = await handler(token, params) if handler else True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def api_getMe(self, token, params):
+        bot_id = int(token.split(':')[0])
+        return {'id': bot_id, 'is_bot': True, 'first_name': f'Bot {bot_id}', 'username': f'bot{bot_id}'}
+
+    async def api_getUpdates(self, token, params):
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        timeout = float(params.get('timeout', 0))
+        queue = self._updates[token]
+        queue[:] = [u for u in queue if u['update_id'] >= offset]
+        if not queue and timeout:
+            waiter = self._waiters[token]
+            waiter.clear()
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return queue[:limit]
+
+    def _message(self, token, chat_id, **fields):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+            'from': {'id': int(token.split(':')[0]), 'is_bot': True, 'first_name': 'Bot'},
+        }
+        message.update(fields)
+        return message
+
+    def _notify(self, token, chat_id, method, params):
+        if self.on_message is not None:
+            self.on_message(token, chat_id, method, params)
+
+    async def api_sendMessage(self, token, params):
+        chat_id = int(params['chat_id'])
+        self._notify(token, chat_id, 'sendMessage', params)
+        return self._message(token, chat_id, text=params.get('text', ''))
+
+    async def api_editMessageText(self, token, params):
+        chat_id = int(params['chat_id'])
+        self._notify(token, chat_id, 'editMessageText', params)
+        return self._message(token, chat_id, text=params.get('text', ''))
+
+    async def api_sendMediaGroup(self, token, params):
+        chat_id = int(params['chat_id'])
+        media = json.loads(params['media'])
+        self._notify(token, chat_id, 'sendMediaGroup', params)
+        return [
+            self._message(token, chat_id, photo=[{'file_id': item['media'], 'file_unique_id': item['media'],
+                                                  'width': 1, 'height': 1}])
+            for item in media
+        ]
+
+    async def api_sendDocument(self, token, params):
+        chat_id = int(params['chat_id'])
+        self._notify(token, chat_id, 'sendDocument', params)
+        return self._message(token, chat_id, document={'file_id': 'document', 'file_unique_id': 'document'})
+
+
+async def serve(args):
+    api = FakeBotAPI(latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate)
+    url = await api.start(args.host, args.port)
+    print(f"Fake Bot API: {url}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0, help="added latency per call, ms")
+    parser.add_argument('--jitter', type=float, default=0, help="random extra latency, ms")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of calls answered with 429")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
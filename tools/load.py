@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots'))
+
+from aiogram.methods import TelegramMethod
+
+from fake_api import FakeBotAPI
+
+# Нагрузочный тест без сети: поднимает фейковый Bot API, запускает ботов
+# в этом же процессе через polling (Poller из launcher.py) и проводит N виртуальных пользователей
+# через всю анкету каждого бота одновременно, включая "🔙 Назад" и фото
+# в BOT_PR. Печатает updates/sec, задержки и пиковый RSS процесса.
+# С --form-mode inline пользователи отвечают кнопками сообщения анкеты
+# (FORM_MODE=inline в forms.py), и по числу вызовов API на заявку режимы
+# можно сравнить.
+#
+#   python tools/load.py --users 200 --bots BOT_P BOT_PR --back-rate 0.2
+#   python tools/load.py --users 200 --form-mode inline
+
+ALL_BOTS = ['BOT_P', 'BOT_PR', 'BOT_Inv', 'BOT_Str', 'BOT_Ocenka']
+TOKEN_VARS = {'BOT_P': 'API_TOKEN1', 'BOT_PR': 'API_TOKEN2', 'BOT_Inv': 'API_TOKEN3',
+              'BOT_Str': 'API_TOKEN4', 'BOT_Ocenka': 'API_TOKEN5'}
+ADMIN_CHAT_ID = 1
+FIRST_USER_ID = 1_000_000
+BACK = "🔙 Назад"
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def configure_environment(api_url, data_dir, storage, throttle=False):
+    # Переменные окружения должны быть заданы до импорта модулей ботов
+    os.environ['TELEGRAM_API_URL'] = api_url
+    if not throttle:
+        # Виртуальные пользователи отвечают быстрее людей и упрутся во флуд-контроль
+        os.environ['THROTTLE_RATE'] = '0'
+        os.environ['OUTGOING_RATE'] = '0'
+    os.environ['ADMIN_CHAT_ID'] = str(ADMIN_CHAT_ID)
+    os.environ['DATA_DIR'] = data_dir
+    os.environ['FSM_STORAGE'] = storage
+    for number, name in enumerate(ALL_BOTS, start=1):
+        os.environ[TOKEN_VARS[name]] = f'{100000 + number}:load-test-{name}'
+
+
+class Simulator:
+    def __init__(self, api, back_rate, timeout, inline=False):
+        self.api = api
+        self.back_rate = back_rate
+        self.timeout = timeout
+        self.inline = inline
+        self._inbox = defaultdict(asyncio.Queue)
+        # (token, chat_id) -> inline-кнопки последнего сообщения бота: текст -> callback_data
+        self._buttons = {}
+        self._message_ids = itertools.count(1)
+        self.latencies = []
+        self.handler_latencies = []
+        self.updates = 0
+        self.lost = 0
+        self.returned = 0
+        api.on_message = self._on_message
+
+    def _on_message(self, token, chat_id, method, params):
+        if chat_id != ADMIN_CHAT_ID:
+            if self.inline:
+                markup = json.loads(params.get('reply_markup') or '{}')
+                self._buttons[(token, chat_id)] = {
+                    button['text']: button['callback_data']
+                    for row in markup.get('inline_keyboard', ()) for button in row
+                }
+            self._inbox[(token, chat_id)].put_nowait(time.perf_counter())
+
+    def install_timing(self, dp):
+        async def timing(handler, event, data):
+            started = time.perf_counter()
+            try:
+                result = await handler(event, data)
+            finally:
+                self.handler_latencies.append(time.perf_counter() - started)
+            # Метод, возвращенный обработчиком, при вебхуке уходит в HTTP-ответе
+            if isinstance(result, TelegramMethod):
+                self.returned += 1
+            return result
+        dp.update.outer_middleware(timing)
+
+    def _update(self, user_id, text=None, photo=None, data=None):
+        user = {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'last_name': str(user_id)}
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user,
+        }
+        if data:
+            # Нажатие кнопки под сообщением анкеты
+            message['from'] = {'id': 1, 'is_bot': True, 'first_name': 'Bot'}
+            return {'callback_query': {'id': str(message['message_id']), 'from': user, 'chat_instance': str(user_id),
+                                       'message': message, 'data': data}}
+        if photo:
+            message['photo'] = [{'file_id': photo, 'file_unique_id': photo, 'width': 1280, 'height': 960}]
+        else:
+            message['text'] = text
+        return {'message': message}
+
+    async def send(self, module, user_id, replies, **content):
+        token = module.bot.token
+        inbox = self._inbox[(token, user_id)]
+        started = time.perf_counter()
+        self.api.push_update(token, self._update(user_id, **content))
+        self.updates += 1
+        received = started
+        for _ in range(replies):
+            try:
+                received = await asyncio.wait_for(inbox.get(), self.timeout)
+            except asyncio.TimeoutError:
+                self.lost += 1
+                return
+        self.latencies.append(received - started)
+
+    def press(self, module, user_id, text=None):
+        # Кнопка последнего сообщения анкеты: с текстом text или любой вариант ответа
+        buttons = self._buttons.get((module.bot.token, user_id), {})
+        if text is None:
+            text = random.choice([button for button in buttons if button != BACK])
+        return {'data': buttons[text]}
+
+    def answer(self, module, form_field, user_id):
+        if self.inline and any(button != BACK for button in self._buttons.get((module.bot.token, user_id), ())):
+            return self.press(module, user_id)
+        if form_field.choices:
+            return {'text': random.choice(list(form_field.choices))}
+        if form_field.photo:
+            return {'photo': f'photo-{user_id}-{random.randrange(10 ** 6)}'}
+        if form_field.name == 'contact':
+            return {'text': f'Иван, +7 900 {user_id % 1000:03d}-00-00'}
+        return {'text': f'Ответ на {form_field.name}'}
+
+    async def conversation(self, module, user_id):
+        form = module.form
+        # В режиме inline приветствие и первый вопрос — одно сообщение
+        await self.send(module, user_id, 1 if self.inline else len(form.welcome) + 1, text='/start')
+        for position, form_field in enumerate(form.fields):
+            if position and random.random() < self.back_rate:
+                # Назад на предыдущий шаг и повторный ответ на него
+                back = self.press(module, user_id, BACK) if self.inline else {'text': BACK}
+                await self.send(module, user_id, 1, **back)
+                await self.send(module, user_id, 1, **self.answer(module, form.fields[position - 1], user_id))
+            await self.send(module, user_id, 1, **self.answer(module, form_field, user_id))
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate)
+    api_url = await api.start(port=args.port)
+    data_dir = tempfile.mkdtemp(prefix='load-')
+    configure_environment(api_url, data_dir, args.storage, args.throttle)
+    if args.concurrency is not None:
+        os.environ['HANDLER_CONCURRENCY'] = str(args.concurrency)
+    os.environ['FORM_MODE'] = args.form_mode
+
+    modules = [importlib.import_module(name) for name in args.bots]
+    # Строка лога на каждое обновление заметно искажает замеры
+    logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+    from common import get_session
+    from polling import Poller
+    simulator = Simulator(api, args.back_rate, args.timeout, args.form_mode == 'inline')
+    pollers = []
+    for name, module in zip(args.bots, modules):
+        simulator.install_timing(module.dp)
+        pollers.append(Poller(name, module.bot, module.dp, os.path.join(data_dir, f'updates_{name}.sqlite3')))
+    polling = [asyncio.create_task(poller.run()) for poller in pollers]
+    await asyncio.sleep(0.5)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulator.conversation(module, FIRST_USER_ID + user)
+        for module in modules
+        for user in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+
+    for poller in pollers:
+        poller.stop()
+    await asyncio.gather(*polling)
+    await get_session().close()
+    await api.stop()
+
+    print(f"Боты: {', '.join(args.bots)}; пользователей на бота: {args.users}")
+    print(f"Обновлений: {simulator.updates} за {elapsed:.2f} с — {simulator.updates / elapsed:.1f} updates/sec")
+    print("Обработчик, мс: p50 {:.2f}  p95 {:.2f}  p99 {:.2f}".format(
+        *(percentile(simulator.handler_latencies, share) * 1000 for share in (0.5, 0.95, 0.99))))
+    print("Обновление -> ответ, мс: p50 {:.2f}  p95 {:.2f}  p99 {:.2f}".format(
+        *(percentile(simulator.latencies, share) * 1000 for share in (0.5, 0.95, 0.99))))
+    print(f"Потеряно ответов: {simulator.lost}; ответов 429: {api.throttled}")
+    print(f"Вызовы API: {dict(api.calls)}")
+    sent = sum(count for method, count in api.calls.items() if method not in ('getUpdates', 'getMe'))
+    leads = args.users * len(args.bots)
+    print(f"Вызовов API на заявку (без getUpdates): {sent / leads:.1f}, "
+          f"при вебхуке: {(sent - simulator.returned) / leads:.1f}")
+    # ru_maxrss в Linux — килобайты; включает и фейковый API
+    print(f"Пиковый RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent conversation load generator")
+    parser.add_argument('--users', type=int, default=100, help="virtual users per bot")
+    parser.add_argument('--bots', nargs='+', default=ALL_BOTS, choices=ALL_BOTS)
+    parser.add_argument('--back-rate', type=float, default=0.1, help="chance to press back before a step")
+    parser.add_argument('--latency', type=float, default=0, help="fake API latency, ms")
+    parser.add_argument('--jitter', type=float, default=0, help="fake API random extra latency, ms")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of API calls answered with 429")
+    parser.add_argument('--storage', default='memory', choices=['memory', 'compact', 'sqlite'])
+    parser.add_argument('--throttle', action='store_true', help="keep flood control and the outgoing budget on")
+    parser.add_argument('--concurrency', type=int, help="HANDLER_CONCURRENCY for the bots (0 = unlimited)")
+    parser.add_argument('--form-mode', default='reply', choices=['reply', 'inline'],
+                        help="FORM_MODE for the bots: a message per question or one edited message")
+    parser.add_argument('--timeout', type=float, default=10, help="seconds to wait for a reply")
+    parser.add_argument('--port', type=int, default=8081)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from aiohttp import ClientSession
+
+# Отправляет записанные обновления (JSON lines, одно Update на строку)
+# на локальный сервер вебхуков и печатает ответ каждого обработчика.
+# Пример:
+#   BOT_MODE=webhook python bots/launcher.py BOT_P
+#   python tools/post_updates.py updates.jsonl --bot BOT_P
+
+
+async def post_updates(path, url, secret):
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    async with ClientSession() as session:
+        with open(path, encoding='utf-8') if path != '-' else sys.stdin as source:
+            for line in source:
+                if not line.strip():
+                    continue
+                update = json.loads(line)
+                async with session.post(url, json=update, headers=headers) as resp:
+                    body = await resp.read()
+                print(f"update {update.get('update_id')}: HTTP {resp.status} {body.decode('utf-8', 'replace')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST recorded updates to the local webhook server")
+    parser.add_argument('path', help="JSON lines file with updates, '-' for stdin")
+    parser.add_argument('--bot', default='BOT_P')
+    parser.add_argument('--server', default='http://127.0.0.1:8080')
+    parser.add_argument('--secret', default=None)
+    args = parser.parse_args()
+    url = f"{args.server.rstrip('/')}/webhook/{args.bot}"
+    asyncio.run(post_updates(args.path, url, args.secret))
+
+
+if __name__ == '__main__':
+    main()
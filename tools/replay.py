@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import gzip
+import importlib
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots'))
+
+from fake_api import FakeBotAPI
+from load import ALL_BOTS, configure_environment, percentile
+
+# Воспроизведение трасс реальных обновлений (RECORD_UPDATES=1, bots/recorder.py)
+# через фейковый Bot API: боты запускаются в этом процессе через polling,
+# и обновления подаются им в записанном темпе (--speed 1), ускоренно
+# (--speed 10) или все сразу (--speed 0). Отчет — пропускная способность,
+# время обработчика и время от подачи обновления до конца его обработки.
+# Отчеты двух версий кода сравниваются командой compare: она печатает разницу
+# и завершается с кодом 1, если новая версия хуже больше чем на --threshold %.
+#
+#   python tools/replay.py run data/traces/updates-*.jsonl.gz --speed 0 -o before.json
+#   git checkout feature
+#   python tools/replay.py run data/traces/updates-*.jsonl.gz --speed 0 -o after.json
+#   python tools/replay.py compare before.json after.json --threshold 10
+
+SHARES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99}
+# Метрики отчета для сравнения: имя -> больше значит лучше
+COMPARED = {
+    'throughput': True,
+    'handler_ms.p50': False, 'handler_ms.p95': False, 'handler_ms.p99': False,
+    'latency_ms.p50': False, 'latency_ms.p95': False, 'latency_ms.p99': False,
+}
+
+
+def read_trace(paths, bots):
+    events = []
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    event = json.loads(line)
+                    if event['bot'] in bots:
+                        events.append(event)
+            except (EOFError, json.JSONDecodeError):
+                # Файл процесса, остановленного без закрытия трассы: обрыв в конце
+                logging.warning("Трасса %s обрывается, прочитано до обрыва", path)
+    # Трассы нескольких процессов-обработчиков сливаются по времени получения
+    events.sort(key=lambda event: event['t'])
+    return events
+
+
+class Replay:
+    def __init__(self, api):
+        self.api = api
+        # (token, update_id) -> время подачи
+        self._pushed = {}
+        self.handler_latencies = []
+        self.latencies = []
+        self.errors = 0
+        self.processed = 0
+        self.total = 0
+        self.done = asyncio.Event()
+
+    def install_timing(self, dp):
+        async def timing(handler, event, data):
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                finished = time.perf_counter()
+                self.handler_latencies.append(finished - started)
+                pushed = self._pushed.pop((data['bot'].token, event.update_id), None)
+                if pushed is not None:
+                    self.latencies.append(finished - pushed)
+                self.processed += 1
+                if self.processed >= self.total:
+                    self.done.set()
+        dp.update.outer_middleware(timing)
+
+    async def feed(self, events, tokens, speed):
+        self.total = len(events)
+        started = time.perf_counter()
+        first = events[0]['t']
+        for event in events:
+            if speed:
+                delay = (event['t'] - first) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            token = tokens[event['bot']]
+            update_id = self.api.push_update(token, event['update'])
+            self._pushed[(token, update_id)] = time.perf_counter()
+
+
+def milliseconds(values):
+    return {name: round(percentile(values, share) * 1000, 3) for name, share in SHARES.items()}
+
+
+async def run(args):
+    bots = args.bots or ALL_BOTS
+    events = read_trace(args.traces, set(bots))
+    if not events:
+        sys.exit("В трассах нет обновлений выбранных ботов")
+    names = [name for name in bots if any(event['bot'] == name for event in events)]
+
+    api = FakeBotAPI(latency=args.latency / 1000, jitter=args.jitter / 1000)
+    api_url = await api.start(port=args.port)
+    data_dir = tempfile.mkdtemp(prefix='replay-')
+    configure_environment(api_url, data_dir, args.storage, args.throttle)
+    modules = [importlib.import_module(name) for name in names]
+    logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+    from common import get_session
+    from polling import Poller
+    replay = Replay(api)
+    pollers = []
+    for name, module in zip(names, modules):
+        replay.install_timing(module.dp)
+        pollers.append(Poller(name, module.bot, module.dp, os.path.join(data_dir, f'updates_{name}.sqlite3')))
+    polling = [asyncio.create_task(poller.run()) for poller in pollers]
+    await asyncio.sleep(0.5)
+
+    started = time.perf_counter()
+    await replay.feed(events, {name: module.bot.token for name, module in zip(names, modules)}, args.speed)
+    try:
+        await asyncio.wait_for(replay.done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+
+    for poller in pollers:
+        poller.stop()
+    await asyncio.gather(*polling)
+    await get_session().close()
+    await api.stop()
+
+    report = {
+        'traces': args.traces,
+        'bots': names,
+        'speed': args.speed,
+        'updates': len(events),
+        'processed': replay.processed,
+        'errors': replay.errors,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(replay.processed / elapsed, 1),
+        'handler_ms': milliseconds(replay.handler_latencies),
+        'latency_ms': milliseconds(replay.latencies),
+        'api_calls': dict(api.calls),
+        # ru_maxrss в Linux — килобайты; включает и фейковый API
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    print(f"Боты: {', '.join(names)}; обновлений: {len(events)}, обработано {replay.processed}, "
+          f"ошибок {replay.errors}")
+    print(f"{replay.processed} обновлений за {elapsed:.2f} с — {report['throughput']} updates/sec")
+    print("Обработчик, мс: p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}".format(**report['handler_ms']))
+    print("Подача -> обработка, мс: p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}".format(**report['latency_ms']))
+    print(f"Пиковый RSS: {report['peak_rss_mb']} МБ")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def metric_value(report, name):
+    value = report
+    for part in name.split('.'):
+        value = value[part]
+    return value
+
+
+def compare(args):
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    if base['updates'] != new['updates'] or base['speed'] != new['speed']:
+        print("Внимание: отчеты получены на разных трассах или скоростях")
+    regressions = []
+    print(f"{'метрика':<16} {'было':>10} {'стало':>10} {'изменение':>10}")
+    for name, higher_is_better in COMPARED.items():
+        before, after = metric_value(base, name), metric_value(new, name)
+        change = (after - before) / before * 100 if before else 0.0
+        worse = -change if higher_is_better else change
+        mark = ''
+        if worse > args.threshold:
+            regressions.append(name)
+            mark = '  ← хуже'
+        print(f"{name:<16} {before:>10.2f} {after:>10.2f} {change:>+9.1f}%{mark}")
+    for name in ('errors', 'processed'):
+        if base[name] != new[name]:
+            print(f"{name}: {base[name]} -> {new[name]}")
+    if new['errors'] > base['errors'] or new['processed'] < base['processed']:
+        regressions.append('errors')
+    if regressions:
+        print(f"Регрессия больше {args.threshold:g}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded update traces against a fake Bot API")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_command = commands.add_parser('run', help="replay traces and report throughput and latency")
+    run_command.add_argument('traces', nargs='+', help="trace files (.jsonl.gz)")
+    run_command.add_argument('--bots', nargs='+', choices=ALL_BOTS, help="replay only these bots")
+    run_command.add_argument('--speed', type=float, default=0, help="1 = recorded pace, 0 = as fast as possible")
+    run_command.add_argument('--latency', type=float, default=0, help="fake API latency, ms")
+    run_command.add_argument('--jitter', type=float, default=0, help="fake API random extra latency, ms")
+    run_command.add_argument('--storage', default='memory', choices=['memory', 'compact', 'sqlite'])
+    run_command.add_argument('--throttle', action='store_true', help="keep flood control and the outgoing budget on")
+    run_command.add_argument('--timeout', type=float, default=30, help="seconds to wait for processing after the last update")
+    run_command.add_argument('--port', type=int, default=8081)
+    run_command.add_argument('-o', '--output', help="write the report as JSON")
+    compare_command = commands.add_parser('compare', help="compare two reports")
+    compare_command.add_argument('base')
+    compare_command.add_argument('new')
+    compare_command.add_argument('--threshold', type=float, default=10, help="allowed slowdown, percent")
+    args = parser.parse_args()
+    if args.command == 'run':
+        asyncio.run(run(args))
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()